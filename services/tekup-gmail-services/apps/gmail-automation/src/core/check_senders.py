@@ -8,11 +8,20 @@ import asyncio
 import sys
 from datetime import datetime, timedelta
 from collections import defaultdict
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.gmail_access import header
+from src.utils.gmail_batch import get_messages
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import iter_messages
+from src.utils.mailbox_index import get_mailbox_index, index_enabled
+
 class SenderChecker:
     def __init__(self, creds_file, token_file):
         """Initialize Gmail service for checking senders"""
@@ -25,84 +34,66 @@ class SenderChecker:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
             
-            # Search for emails with TekUp_Processed label
-            query = f'label:TekUp_Processed after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
-            
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=100
-            ).execute()
+            if index_enabled():
+                # Local label query on the synced mailbox index
+                service = self.gmail_service.service
+                labels = LabelManager(service, self.gmail_service.user_email)
+                label_id = labels.label_id('TekUp_Processed', create=False)
+                if label_id is None:
+                    print("Label TekUp_Processed does not exist")
+                    return []
+                index = get_mailbox_index()
+                index.sync(service)
+                messages = [m.as_message() for m in index.search(
+                    label_id=label_id, after=start_date, before=end_date)]
+            else:
+                # Search for emails with TekUp_Processed label
+                query = f'label:TekUp_Processed after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
+                message_ids = [ref['id'] for ref in iter_messages(self.gmail_service.service, query, limit=100)]
+                # Only Subject/From/Date are needed - one batch, no MIME tree
+                fetched = get_messages(self.gmail_service.service, message_ids)
+                messages = [fetched[message_id] for message_id in message_ids if message_id in fetched]
             
-            message_ids = response.get('messages', [])
-            print(f"Found {len(message_ids)} emails with TekUp_Processed label")
-            return message_ids
+            print(f"Found {len(messages)} emails with TekUp_Processed label")
+            return [self.get_email_details(message) for message in messages]
             
         except Exception as e:
             print(f"Error searching for processed emails: {e}")
             return []
     
-    async def get_email_details(self, message_id):
-        """Get detailed email information"""
-        try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
-            
-            headers = message.get('payload', {}).get('headers', [])
-            subject = ''
-            sender = ''
-            date = ''
-            
-            for header in headers:
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                elif header['name'] == 'From':
-                    sender = header['value']
-                elif header['name'] == 'Date':
-                    date = header['value']
-            
-            return {
-                'id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'date': date
-            }
-            
-        except Exception as e:
-            print(f"Error getting email details for {message_id}: {e}")
-            return None
+    def get_email_details(self, message):
+        """Email information from a fetched or indexed message"""
+        return {
+            'id': message['id'],
+            'subject': header(message, 'Subject'),
+            'sender': header(message, 'From'),
+            'date': header(message, 'Date')
+        }
     
     async def check_senders(self):
         """Check which senders we have received receipts from"""
         print("=== TJEKKER AFSENDERE ===\n")
         
         # Get processed emails
-        message_ids = await self.get_processed_emails()
+        emails = await self.get_processed_emails()
         
-        if not message_ids:
+        if not emails:
             print("No processed emails found")
             return
         
         # Analyze senders
         senders = defaultdict(list)
         
-        for i, msg_id in enumerate(message_ids, 1):
-            print(f"Processing email {i}/{len(message_ids)}: {msg_id['id']}")
+        for i, email_data in enumerate(emails, 1):
+            print(f"Processing email {i}/{len(emails)}: {email_data['id']}")
             
-            email_data = await self.get_email_details(msg_id['id'])
-            if email_data:
-                sender = email_data['sender']
-                senders[sender].append(email_data)
-                print(f"  From: {sender}")
-                print(f"  Subject: {email_data['subject'][:60]}...")
-            else:
-                print(f"  Could not get details for {msg_id['id']}")
+            sender = email_data['sender']
+            senders[sender].append(email_data)
+            print(f"  From: {sender}")
+            print(f"  Subject: {email_data['subject'][:60]}...")
         
         print(f"\n=== AFSNEDERE OVERSIGT ===")
-        print(f"Total processed emails: {len(message_ids)}")
+        print(f"Total processed emails: {len(emails)}")
         print(f"Unique senders: {len(senders)}")
         print()
         
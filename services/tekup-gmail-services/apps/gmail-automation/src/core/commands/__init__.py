@@ -0,0 +1,7 @@
+"""
+Subcommands of the tekup-gmail CLI.
+
+Each module is imported only when one of its commands is invoked (see the
+command registry in src/core/main.py), and imports its heavy dependencies
+inside the command functions.
+"""
@@ -0,0 +1,57 @@
+"""
+Developer commands: test suite and startup import budget.
+"""
+
+import subprocess
+import sys
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.pass_context
+def test(ctx):
+    """Run system tests."""
+    logger.info("Running system tests...")
+    
+    try:
+        result = subprocess.run([sys.executable, "-m", "pytest", "tests/"], capture_output=True, text=True)
+        
+        if result.returncode == 0:
+            logger.info("✅ All tests passed")
+        else:
+            logger.error(f"❌ Tests failed: {result.stderr}")
+            sys.exit(1)
+            
+    except Exception as e:
+        logger.error(f"Test error: {e}")
+        sys.exit(1)
+
+
+@click.command()
+@click.option('--budget-ms', type=float, default=None,
+              help='Maximum startup import time in ms (default: IMPORT_BUDGET_MS or 250)')
+@click.option('--module', default=None, help='Module to import (default: the CLI entry point)')
+@click.option('--top', default=10, help='Number of heaviest imports to show')
+@click.pass_context
+def import_budget(ctx, budget_ms, module, top: int):
+    """Fail if importing the CLI takes longer than the budget (python -X importtime)."""
+    from src.utils.import_budget import DEFAULT_MODULE, budget_from_env, check_budget
+    
+    module = module or DEFAULT_MODULE
+    budget_ms = budget_ms if budget_ms is not None else budget_from_env()
+    
+    try:
+        total_ms, heaviest = check_budget(module)
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    
+    for timing in heaviest[:top]:
+        logger.info(f"{timing.cumulative_us / 1000:8.1f} ms  {timing.module}")
+    
+    if total_ms > budget_ms:
+        logger.error(f"❌ Importing {module} took {total_ms:.1f} ms - budget is {budget_ms:.0f} ms")
+        sys.exit(1)
+    logger.info(f"✅ Importing {module} took {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
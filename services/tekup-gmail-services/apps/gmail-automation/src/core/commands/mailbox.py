@@ -0,0 +1,37 @@
+"""
+Mailbox commands: keep the local mailbox metadata index in sync.
+"""
+
+import sys
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.option('--full', is_flag=True, help='Rebuild the index instead of reading the mailbox history')
+@click.option('--days', default=None, type=int, help='Days of mail listed by a full scan (default 365)')
+@click.pass_context
+def index_mailbox(ctx, full: bool, days):
+    """Sync the local mailbox index (message metadata and attachment manifests)."""
+    from src.core.gmail_forwarder import GmailPDFForwarder
+    from src.utils.mailbox_index import DEFAULT_SCAN_DAYS, get_mailbox_index
+    
+    try:
+        forwarder = GmailPDFForwarder()
+        forwarder.authenticate()
+        
+        index = get_mailbox_index()
+        result = index.sync(forwarder.service, days_back=days or DEFAULT_SCAN_DAYS, full=full)
+        stats = index.stats()
+        
+        logger.info(f"{'Full scan' if result.full_scan else 'History sync'}: "
+                    f"{result.updated} updated, {result.deleted} deleted")
+        if result.pending:
+            logger.warning(f"{result.pending} messages could not be fetched - the next sync retries them")
+        logger.info(f"Index {index.path}: {stats['messages']} messages, "
+                    f"{stats['attachments']} attachments, historyId {stats['history_id']}")
+        
+    except Exception as e:
+        logger.error(f"Mailbox index error: {e}")
+        sys.exit(1)
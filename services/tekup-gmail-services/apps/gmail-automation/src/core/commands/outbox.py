@@ -0,0 +1,56 @@
+"""
+Outbox commands: send queued forwards and label the emails they came from.
+"""
+
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from loguru import logger
+
+
+def _drain(limit):
+    """Drain the outbox in this process; runs in each worker process"""
+    from src.core.gmail_forwarder import GmailPDFForwarder
+    
+    forwarder = GmailPDFForwarder()
+    forwarder.authenticate()
+    return tuple(forwarder.drain_outbox(limit=limit))
+
+
+@click.command()
+@click.option('--processes', default=1, type=int, help='Worker processes draining concurrently')
+@click.option('--limit', default=None, type=int, help='Send attempts per process at most')
+@click.option('--retry-failed', is_flag=True, help='Queue entries that gave up after repeated failures again')
+@click.option('--purge-days', default=None, type=int, help='Delete labelled entries older than this many days')
+@click.pass_context
+def drain_outbox(ctx, processes: int, limit, retry_failed: bool, purge_days):
+    """Send queued forwards from the outbox and label emails whose forwards are all sent."""
+    from src.utils.outbox import get_outbox
+    
+    try:
+        outbox = get_outbox()
+        if retry_failed:
+            logger.info(f"Re-queued {outbox.retry_failed()} failed entries")
+        
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as pool:
+                results = list(pool.map(_drain, [limit] * processes))
+        else:
+            results = [_drain(limit)]
+        
+        sent, failed, labelled = (sum(column) for column in zip(*results))
+        logger.info(f"Outbox drained: {sent} sent, {failed} failed, {labelled} emails labelled")
+        
+        if purge_days is not None:
+            logger.info(f"Purged {outbox.purge(purge_days)} labelled entries")
+        
+        counts = outbox.counts()
+        logger.info(f"Outbox {outbox.path}: {counts['extracted']} queued, "
+                    f"{counts['sent']} awaiting label, {counts['failed']} failed")
+        if failed:
+            sys.exit(1)
+        
+    except Exception as e:
+        logger.error(f"Outbox error: {e}")
+        sys.exit(1)
@@ -0,0 +1,37 @@
+"""
+Receipt commands: process receipts from Gmail and Google Photos.
+"""
+
+import sys
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.option('--source', default='all', help='Source to process (gmail, photos, all)')
+@click.pass_context
+def process_receipts(ctx, source: str):
+    """Process receipts from various sources."""
+    from src.processors.google_photos_receipt_processor import GooglePhotosReceiptProcessor
+    
+    logger.info(f"Processing receipts from: {source}")
+    
+    try:
+        processor = GooglePhotosReceiptProcessor()
+        
+        if source in ['gmail', 'all']:
+            if hasattr(processor, 'process_gmail_receipts'):
+                processor.process_gmail_receipts()
+            
+        if source in ['photos', 'all']:
+            if hasattr(processor, 'process_photos_receipts'):
+                processor.process_photos_receipts()
+            else:
+                processor.process_receipts()
+            
+        logger.info("Receipt processing completed")
+        
+    except Exception as e:
+        logger.error(f"Receipt processing error: {e}")
+        sys.exit(1)
@@ -0,0 +1,76 @@
+"""
+Service commands: run the Gmail PDF forwarder.
+"""
+
+import sys
+import time
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.option('--daemon', is_flag=True, help='Run as daemon')
+@click.option('--interval', default=300, help='Processing interval in seconds')
+@click.option('--push', is_flag=True, help='Process on Gmail push notifications instead of polling')
+@click.pass_context
+def start(ctx, daemon: bool, interval: int, push: bool):
+    """Start the Gmail automation service."""
+    from src.core.gmail_forwarder import GmailPDFForwarder
+    
+    if push:
+        logger.info("Starting Gmail automation service (push mode)")
+    else:
+        logger.info(f"Starting Gmail automation service (interval: {interval}s)")
+    
+    try:
+        forwarder = GmailPDFForwarder()
+        
+        if push:
+            from src.utils.push_receiver import run_push_service
+            
+            # Event-driven: runs within seconds of new mail, polling only as a safety net
+            forwarder.authenticate()
+            run_push_service(forwarder.service, forwarder.process_messages)
+        elif daemon:
+            # Run in background
+            import threading
+            def run_forwarder():
+                while True:
+                    try:
+                        forwarder.process_emails()
+                        time.sleep(interval)
+                    except Exception as e:
+                        logger.error(f"Error in forwarder: {e}")
+                        time.sleep(60)
+            
+            thread = threading.Thread(target=run_forwarder, daemon=True)
+            thread.start()
+            thread.join()
+        else:
+            # Run once
+            forwarder.process_emails()
+            
+    except KeyboardInterrupt:
+        logger.info("Service stopped by user")
+    except Exception as e:
+        logger.error(f"Service error: {e}")
+        sys.exit(1)
+
+
+@click.command()
+@click.option('--email-id', required=True, help='Email ID to process')
+@click.pass_context
+def process(ctx, email_id: str):
+    """Process a specific email."""
+    from src.core.gmail_forwarder import GmailPDFForwarder
+    
+    logger.info(f"Processing email: {email_id}")
+    
+    try:
+        forwarder = GmailPDFForwarder()
+        result = forwarder.process_email(email_id)
+        logger.info(f"Email processed: {result}")
+    except Exception as e:
+        logger.error(f"Error processing email: {e}")
+        sys.exit(1)
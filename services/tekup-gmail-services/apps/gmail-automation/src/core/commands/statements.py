@@ -0,0 +1,39 @@
+"""
+Statement commands: import bank statement exports into the statement cache.
+"""
+
+import sys
+from pathlib import Path
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.argument('paths', nargs=-1, required=True, type=click.Path(exists=True))
+@click.option('--force', is_flag=True, help='Re-parse files even if they are unchanged')
+@click.option('--cache-dir', default=None, help='Cache directory (default: STATEMENT_CACHE_DIR)')
+@click.pass_context
+def import_statements(ctx, paths, force: bool, cache_dir):
+    """Parse bank statement CSVs (files or folders of *.csv) into the statement cache."""
+    from src.processors.amounts import AmountParseError
+    from src.processors.transactions import statement_cache
+
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob('*.csv')) if path.is_dir() else [path])
+
+    cache = statement_cache(cache_dir)
+    failed = 0
+    for path in files:
+        try:
+            parsed = cache.import_statement(str(path), force=force)
+        except (AmountParseError, ValueError, OSError) as e:
+            logger.error(f"❌ {path}: {e}")
+            failed += 1
+            continue
+        logger.info(f"{'Imported' if parsed else 'Up to date'}: {path}")
+
+    logger.info(f"{len(files) - failed} of {len(files)} statements in {cache.directory}")
+    if failed:
+        sys.exit(1)
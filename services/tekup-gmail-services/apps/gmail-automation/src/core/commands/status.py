@@ -0,0 +1,40 @@
+"""
+Status command: check the Gmail, e-conomic and receipt processor connections.
+"""
+
+import sys
+
+import click
+from loguru import logger
+
+
+@click.command()
+@click.pass_context
+def status(ctx):
+    """Check system status."""
+    from src.core.gmail_forwarder import GmailPDFForwarder
+    from src.integrations.gmail_economic_api_forwarder import EconomicApiForwarder
+    from src.processors.google_photos_receipt_processor import GooglePhotosReceiptProcessor
+    
+    logger.info("Checking system status...")
+    
+    try:
+        # Check Gmail connection
+        forwarder = GmailPDFForwarder()
+        gmail_status = forwarder.check_connection()
+        
+        # Check Economic API
+        economic = EconomicApiForwarder()
+        economic_status = economic.check_connection() if hasattr(economic, 'check_connection') else False
+        
+        # Check receipt processor
+        processor = GooglePhotosReceiptProcessor()
+        processor_status = processor.check_status() if hasattr(processor, 'check_status') else False
+        
+        logger.info(f"Gmail: {'✅' if gmail_status else '❌'}")
+        logger.info(f"Economic API: {'✅' if economic_status else '❌'}")
+        logger.info(f"Receipt Processor: {'✅' if processor_status else '❌'}")
+        
+    except Exception as e:
+        logger.error(f"Status check error: {e}")
+        sys.exit(1)
@@ -6,65 +6,152 @@ Integreret med eksisterende Gmail OAuth credentials
 """
 
 import os
-import base64
+import sys
 import json
 import logging
 import re
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
-
-# Prøv at indlæse dotenv
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-    print("OK: .env fil indlaest")
-except ImportError:
-    print("WARNING: python-dotenv ikke installeret - bruger system miljoevariabler")
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Dict, Optional
 
 from google.oauth2.credentials import Credentials
 from google.oauth2 import service_account
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email.mime.text import MIMEText
-from email import encoders
 import pickle
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.attachment_data import decode_attachment
+from src.utils.bundling import DEFAULT_BUNDLE_MAX_BYTES, plan_bundles
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import ATTACHMENTS, header
+from src.utils.gmail_batch import MAX_BATCH_SIZE, chunked, get_attachments, get_messages
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import iter_messages
+from src.utils.mime_builder import Attachment, MessageTemplate, encode_attachment, send_raw
+from src.utils.outbox import OutboxEntry, get_outbox, outbox_enabled
+from src.utils.gmail_service import get_service
+from src.utils.pipeline import (
+    GMAIL_QUOTA_COST,
+    GMAIL_QUOTA_UNITS_PER_SECOND,
+    Counters,
+    Pipeline,
+    Stage,
+    TokenBucket,
+    parse_workers,
+)
+from src.utils.resilience import DeadLetterQueue
+from src.utils.sync_state import (
+    HistoryExpiredError,
+    SyncState,
+    get_added_message_ids,
+    get_current_history_id,
+)
+
 # Konfiguration
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 TOKEN_FILE = 'token.pickle'
+SYNC_STATE_FILE = 'gmail_sync_state.json'
+# Standard antal workers pr. pipeline trin (kan overskrives med PIPELINE_WORKERS)
+DEFAULT_PIPELINE_WORKERS = {'fetch': 4, 'decode': 1, 'build': 1, 'send': 2, 'label': 1}
 LOG_FILE = 'gmail_forwarder.log'
+# Kilde-navn for denne forwarders poster i dead-letter køen
+DEAD_LETTER_SOURCE = 'gmail_forwarder'
+STAT_NAMES = ('processed', 'forwarded', 'emails_sent', 'duplicates', 'errors', 'skipped', 'dead_lettered')
+
+# Videresendelses-emails - skabelonerne bygges én gang, kun felterne udfyldes pr. email
+FORWARD_TEMPLATE = MessageTemplate('Fwd: {subject}', """
+Automatisk videresendt PDF bilag til e-conomic
+
+📧 Original afsender: {sender}
+📅 Original dato: {date}
+📝 Original emne: {subject}
+📎 Filnavn: {filename}
+📊 Størrelse: {size:,} bytes
+
+---
+🤖 Automatisk genereret af Gmail PDF Forwarder
+⏰ Videresendt: {sent}
+""")
+BUNDLE_TEMPLATE = MessageTemplate('Fwd: {subject}', """
+Automatisk videresendt {count} PDF bilag til e-conomic
+
+📧 Original afsender: {sender}
+📅 Original dato: {date}
+📝 Original emne: {subject}
+
+{files}
+
+---
+🤖 Automatisk genereret af Gmail PDF Forwarder
+⏰ Videresendt: {sent}
+""")
 
-# Setup logging
-log_level = os.getenv('LOG_LEVEL', 'INFO').upper()
-logging.basicConfig(
-    level=getattr(logging, log_level),
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler(LOG_FILE, encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
 
+_environment_loaded = False
+_logging_configured = False
+
+
+def load_environment():
+    """Indlæs .env (én gang pr. proces - ikke ved import af modulet)"""
+    global _environment_loaded
+    if _environment_loaded:
+        return
+    _environment_loaded = True
+    
+    # Prøv at indlæse dotenv
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+        print("OK: .env fil indlaest")
+    except ImportError:
+        print("WARNING: python-dotenv ikke installeret - bruger system miljoevariabler")
+
+
+def setup_logging():
+    """Log til gmail_forwarder.log og konsollen (én gang pr. proces).
+    Konsol-handleren tilføjes kun hvis programmet ikke selv har sat logging op.
+    """
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    
+    root = logging.getLogger()
+    handlers = [logging.FileHandler(LOG_FILE, encoding='utf-8')]
+    if not root.handlers:
+        handlers.append(logging.StreamHandler())
+    
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    for handler in handlers:
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    root.setLevel(getattr(logging, os.getenv('LOG_LEVEL', 'INFO').upper()))
+
 
 class GmailPDFForwarder:
     """Gmail PDF Forwarder med .env integration"""
     
     def __init__(self):
         """Initialiser med miljøvariabler"""
+        load_environment()
+        setup_logging()
         self.config = self.load_config_from_env()
         self.service = None
+        self.labels = None
         self.processed_label_id = None
-        self.stats = {
-            'processed': 0,
-            'forwarded': 0,
-            'errors': 0,
-            'skipped': 0
-        }
+        self.full_scan = True
+        self.sync_state = SyncState(SYNC_STATE_FILE)
+        self.rate_limiter = TokenBucket(self.config['quota_per_second'])
+        self.dedup = get_dedup_store()
+        self.dead_letters = DeadLetterQueue()
+        # Bygget videresendelser gemmes i outboxen før afsendelse (OUTBOX=false slår den fra)
+        self.outbox = get_outbox() if outbox_enabled() else None
+        self.stats = Counters(*STAT_NAMES)
     
     def load_config_from_env(self) -> dict:
         """Indlæs konfiguration fra miljøvariabler"""
@@ -82,6 +169,21 @@ class GmailPDFForwarder:
             'processed_label': os.getenv('PROCESSED_LABEL', 'Videresendt_econ'),
             'days_back': int(os.getenv('DAYS_BACK', '180')),
             'max_emails': int(os.getenv('MAX_EMAILS', '100')),
+            'page_size': int(os.getenv('PAGE_SIZE', '100')),
+            'batch_size': min(int(os.getenv('BATCH_SIZE', '100')), MAX_BATCH_SIZE),
+            
+            # Pipeline: workers pr. trin, kø-størrelse og Gmail kvote (units/sek)
+            'pipeline_workers': parse_workers(os.getenv('PIPELINE_WORKERS'), DEFAULT_PIPELINE_WORKERS),
+            'queue_size': int(os.getenv('PIPELINE_QUEUE_SIZE', '10')),
+            'quota_per_second': int(os.getenv('GMAIL_QUOTA_PER_SECOND', str(GMAIL_QUOTA_UNITS_PER_SECOND))),
+            
+            # Saml flere PDFs fra samme email i én videresendelse (op til e-conomics grænse)
+            'bundle_attachments': os.getenv('BUNDLE_ATTACHMENTS', 'false').lower() in ('1', 'true', 'yes'),
+            'bundle_max_bytes': int(os.getenv('BUNDLE_MAX_BYTES', str(DEFAULT_BUNDLE_MAX_BYTES))),
+            
+            # Inkrementel sync via Gmail historyId
+            'incremental_sync': os.getenv('INCREMENTAL_SYNC', 'true').lower() in ('1', 'true', 'yes'),
+            'full_scan_interval_hours': int(os.getenv('FULL_SCAN_INTERVAL_HOURS', '24')),
             
             # Søgeord og filtre
             'search_keywords': self.parse_list_env('SEARCH_KEYWORDS', 
@@ -140,6 +242,17 @@ class GmailPDFForwarder:
     
     def authenticate(self):
         """Autentificer med Gmail API.
+        Servicen bygges kun første gang i processen - senere kald (fx hver planlagt
+        kørsel) genbruger den cachede service og credentials, og access token
+        fornyes i baggrunden før det udløber.
+        """
+        self.service = get_service(f"gmail:{self.config['gmail_user_email']}",
+                                   self.load_credentials, on_refresh=self.save_token)
+        self.labels = LabelManager(self.service, self.config['gmail_user_email'],
+                                   rate_limiter=self.rate_limiter)
+    
+    def load_credentials(self):
+        """Indlæs Gmail credentials.
         Forsøg først service account impersonation (headless). Fald tilbage til OAuth hvis ikke muligt.
         """
 
@@ -170,10 +283,8 @@ class GmailPDFForwarder:
                 )
 
                 delegated_credentials = base_credentials.with_subject(sa_impersonated_user)
-
-                self.service = build('gmail', 'v1', credentials=delegated_credentials)
                 logger.info("✅ Gmail API forbindelse oprettet via service account (impersonation)")
-                return
+                return delegated_credentials
 
             except Exception as e:
                 if headless_only:
@@ -206,48 +317,46 @@ class GmailPDFForwarder:
                 creds = flow.run_local_server(port=0)
 
             # Gem token til næste gang
-            with open(TOKEN_FILE, 'wb') as token:
-                pickle.dump(creds, token)
+            self.save_token(creds)
             logger.info("Token gemt")
 
-        self.service = build('gmail', 'v1', credentials=creds)
         logger.info("✅ Gmail API forbindelse oprettet via OAuth2")
+        return creds
+    
+    def save_token(self, creds):
+        """Gem OAuth2 token (kaldes også efter hver fornyelse i baggrunden)"""
+        if not isinstance(creds, Credentials):
+            return  # Service account credentials gemmes ikke
+        tmp_file = f"{TOKEN_FILE}.tmp"
+        with open(tmp_file, 'wb') as token:
+            pickle.dump(creds, token)
+        os.replace(tmp_file, TOKEN_FILE)
     
     def get_or_create_label(self, label_name: str) -> str:
-        """Opret eller hent Gmail label ID"""
+        """Opret eller hent Gmail label ID (caches på tværs af kørsler)"""
         try:
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
-            
-            for label in labels:
-                if label['name'] == label_name:
-                    logger.info(f"📂 Label fundet: {label_name}")
-                    return label['id']
-            
-            # Opret nyt label
-            label_object = {
-                'name': label_name,
-                'labelListVisibility': 'labelShow',
-                'messageListVisibility': 'show'
-            }
-            created_label = self.service.users().labels().create(
-                userId='me', body=label_object).execute()
-            
-            logger.info(f"📂 Label oprettet: {label_name}")
-            return created_label['id']
+            label_id = self.labels.label_id(label_name)
+            logger.info(f"📂 Label: {label_name}")
+            return label_id
         
         except HttpError as error:
             logger.error(f"❌ Label fejl: {error}")
             raise
     
-    def build_search_query(self) -> str:
-        """Byg Gmail søgequery"""
+    def build_search_query(self, since: Optional[datetime] = None) -> str:
+        """Byg Gmail søgequery.
+        Med `since` begrænses søgningen til mails modtaget efter det tidspunkt
+        (inkrementel sync) i stedet for hele `days_back` vinduet.
+        """
         query_parts = ['has:attachment', 'filename:pdf']
         
         # Dato begrænsning
-        days = self.config['days_back']
-        date_from = (datetime.now() - timedelta(days=days)).strftime('%Y/%m/%d')
-        query_parts.append(f'after:{date_from}')
+        if since:
+            query_parts.append(f'after:{int(since.timestamp())}')
+        else:
+            days = self.config['days_back']
+            date_from = (datetime.now() - timedelta(days=days)).strftime('%Y/%m/%d')
+            query_parts.append(f'after:{date_from}')
         
         # Søgeord
         if self.config['search_keywords']:
@@ -266,20 +375,93 @@ class GmailPDFForwarder:
         logger.info(f"🔍 Søgequery: {query}")
         return query
     
-    def get_pdf_attachments(self, message_id: str) -> List[Dict]:
-        """Hent PDF vedhæftninger fra email"""
-        try:
-            message = self.service.users().messages().get(
-                userId='me', id=message_id, format='full').execute()
+    def needs_full_scan(self) -> bool:
+        """Afgør om denne kørsel skal scanne hele søgevinduet"""
+        if not self.config['incremental_sync'] or not self.sync_state.history_id:
+            return True
+        
+        if not self.sync_state.last_sync or not self.sync_state.last_full_scan:
+            return True
+        
+        # Periodisk fuld scanning som sikkerhedsnet (fx fejlede videresendelser)
+        interval = timedelta(hours=self.config['full_scan_interval_hours'])
+        return datetime.now() - self.sync_state.last_full_scan >= interval
+    
+    def iter_message_ids(self, query: str, limit: Optional[int] = None) -> Iterator[str]:
+        """Gennemløb email IDs der matcher søgequery, side for side"""
+        for message in iter_messages(self.service, query,
+                                     page_size=self.config['page_size'], limit=limit):
+            yield message['id']
+    
+    def find_message_ids(self) -> Iterator[str]:
+        """Find emails til behandling: først fejlede emails fra dead-letter køen,
+        derefter nye emails (se find_new_message_ids)
+        """
+        retry_ids = list(dict.fromkeys(
+            entry['message_id'] for entry in self.dead_letters.claim(DEAD_LETTER_SOURCE)
+            if entry.get('message_id')))
+        if retry_ids:
+            logger.info(f"🔁 Genforsøger {len(retry_ids)} emails fra dead-letter køen")
+        yield from retry_ids
+        
+        retried = set(retry_ids)
+        for msg_id in self.find_new_message_ids():
+            if msg_id not in retried:
+                yield msg_id
+    
+    def find_new_message_ids(self) -> Iterator[str]:
+        """Find nye emails - inkrementelt via historyId når muligt.
+        Stopper efter `max_emails` IDs.
+        """
+        self.full_scan = self.needs_full_scan()
+        
+        if not self.full_scan:
+            try:
+                added_ids = get_added_message_ids(self.service, self.sync_state.history_id)
+            except HistoryExpiredError:
+                logger.warning("⚠️  Sync cursor er udløbet - falder tilbage til fuld scanning")
+                self.full_scan = True
+            else:
+                logger.info(f"🔄 Inkrementel sync: {len(added_ids)} nye emails siden historyId "
+                            f"{self.sync_state.history_id}")
+                if not added_ids:
+                    return
+                
+                # Snævert tidsvindue (med 1 dags margin) + filtrering til nye IDs
+                since = self.sync_state.last_sync - timedelta(days=1)
+                new_ids = (msg_id for msg_id in self.iter_message_ids(self.build_search_query(since=since))
+                           if msg_id in added_ids)
+                yield from islice(new_ids, self.config['max_emails'])
+                return
+        
+        logger.info("🔍 Fuld scanning af søgevinduet")
+        yield from self.iter_message_ids(self.build_search_query(), limit=self.config['max_emails'])
+    
+    def get_pdf_attachment_refs(self, message_ids: List[str]) -> Dict[str, List[Dict]]:
+        """Hent metadata for mange emails i én batch request og find PDF vedhæftninger.
+        Returnerer vedhæftninger uden indhold - de hentes af fetch_stage.
+        Emails hvis metadata ikke kunne hentes er ikke med i resultatet.
+        """
+        # Kun headers, filnavne og attachment IDs - ingen indhold
+        messages = get_messages(self.service, message_ids, projection=ATTACHMENTS,
+                                batch_size=self.config['batch_size'])
+        refs = {}
+        
+        for message_id in message_ids:
+            message = messages.get(message_id)
+            if message is None:
+                # Fejlen er allerede logget af batch laget
+                continue
             
             attachments = []
+            refs[message_id] = attachments
+            
             payload = message.get('payload', {})
             
             # Hent headers
-            headers = {h['name']: h['value'] for h in payload.get('headers', [])}
-            subject = headers.get('Subject', 'Ingen emne')
-            sender = headers.get('From', 'Ukendt afsender')
-            date = headers.get('Date', '')
+            subject = header(message, 'Subject', 'Ingen emne')
+            sender = header(message, 'From', 'Ukendt afsender')
+            date = header(message, 'Date')
             
             # Ekstraktér PDF vedhæftninger rekursivt
             def extract_parts(parts):
@@ -287,23 +469,14 @@ class GmailPDFForwarder:
                     filename = part.get('filename', '')
                     
                     if filename.lower().endswith('.pdf') and 'attachmentId' in part.get('body', {}):
-                        att_id = part['body']['attachmentId']
-                        
-                        # Hent vedhæftning
-                        attachment = self.service.users().messages().attachments().get(
-                            userId='me', messageId=message_id, id=att_id).execute()
-                        
-                        file_data = base64.urlsafe_b64decode(attachment['data'])
-                        
                         attachments.append({
+                            'message_id': message_id,
+                            'attachment_id': part['body']['attachmentId'],
                             'filename': filename,
-                            'data': file_data,
-                            'size': len(file_data),
                             'subject': subject,
                             'sender': sender,
                             'date': date
                         })
-                        logger.info(f"📎 PDF fundet: {filename} ({len(file_data)} bytes)")
                     
                     # Rekursiv søgning i nested parts
                     if 'parts' in part:
@@ -311,142 +484,325 @@ class GmailPDFForwarder:
             
             if 'parts' in payload:
                 extract_parts(payload['parts'])
-            
-            return attachments
         
-        except HttpError as error:
-            logger.error(f"❌ Fejl ved hentning af vedhæftninger: {error}")
-            return []
+        return refs
     
-    def create_forward_email(self, attachment_info: Dict, destination: str) -> MIMEMultipart:
-        """Opret videresendelse email"""
-        msg = MIMEMultipart()
-        msg['From'] = self.config['gmail_user_email']
-        msg['To'] = destination
-        
-        original_subject = attachment_info.get('subject', 'Bilag')
-        msg['Subject'] = f"Fwd: {original_subject}"
-        
-        # Email indhold
-        body_text = f"""
-Automatisk videresendt PDF bilag til e-conomic
-
-📧 Original afsender: {attachment_info.get('sender', 'Ukendt')}
-📅 Original dato: {attachment_info.get('date', 'Ukendt')}
-📝 Original emne: {original_subject}
-📎 Filnavn: {attachment_info['filename']}
-📊 Størrelse: {attachment_info['size']:,} bytes
-
----
-🤖 Automatisk genereret af Gmail PDF Forwarder
-⏰ Videresendt: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        """
-        msg.attach(MIMEText(body_text, 'plain', 'utf-8'))
-        
-        # Tilføj PDF vedhæftning
-        part = MIMEBase('application', 'pdf')
-        part.set_payload(attachment_info['data'])
-        encoders.encode_base64(part)
-        part.add_header(
-            'Content-Disposition',
-            f'attachment; filename="{attachment_info["filename"]}"'
-        )
-        msg.attach(part)
+    def create_forward_email(self, attachment_info: Dict, destination: str) -> bytes:
+        """Opret videresendelse email (færdig RFC 822 besked)"""
+        return FORWARD_TEMPLATE.render(
+            self.config['gmail_user_email'], destination,
+            [Attachment(attachment_info['filename'], encode_attachment(attachment_info['data']))],
+            subject=attachment_info.get('subject', 'Bilag'),
+            sender=attachment_info.get('sender', 'Ukendt'),
+            date=attachment_info.get('date', 'Ukendt'),
+            filename=attachment_info['filename'],
+            size=attachment_info['size'],
+            sent=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    
+    def create_bundle_email(self, attachments: List[Dict], destination: str) -> bytes:
+        """Opret én videresendelse med flere PDF vedhæftninger fra samme email"""
+        if len(attachments) == 1:
+            return self.create_forward_email(attachments[0], destination)
         
-        return msg
+        first = attachments[0]
+        return BUNDLE_TEMPLATE.render(
+            self.config['gmail_user_email'], destination,
+            [Attachment(a['filename'], encode_attachment(a['data'])) for a in attachments],
+            count=len(attachments),
+            subject=first.get('subject', 'Bilag'),
+            sender=first.get('sender', 'Ukendt'),
+            date=first.get('date', 'Ukendt'),
+            files='\n'.join(f"📎 {a['filename']} ({a['size']:,} bytes)" for a in attachments),
+            sent=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
     
-    def send_email(self, message: MIMEMultipart) -> bool:
-        """Send email via Gmail API"""
+    def send_email(self, message: bytes) -> bool:
+        """Send email via Gmail API (media upload af den rå besked)"""
         try:
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            send_message = {'raw': raw_message}
-            
-            result = self.service.users().messages().send(
-                userId='me', body=send_message).execute()
+            result = send_raw(self.service, message)
             
             logger.info(f"✅ Email sendt: ID {result['id']}")
             return True
         
-        except HttpError as error:
+        except Exception as error:
+            # Forbigående fejl er allerede forsøgt igen af send_raw()
             logger.error(f"❌ Email fejl: {error}")
             return False
     
+    def send_outbox_entry(self, entry: OutboxEntry) -> str:
+        """Send en videresendelse fra outboxen inden for Gmail kvoten - fejl kastes videre"""
+        self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.send'])
+        result = send_raw(self.service, entry.body)
+        logger.info(f"✅ Videresendt: {', '.join(entry.filenames)}")
+        self.stats.incr('forwarded', len(entry.digests))
+        self.stats.incr('emails_sent')
+        return result['id']
+    
+    def label_messages(self, message_ids: List[str]) -> None:
+        """Marker emails som behandlet med det samme (bruges af outboxen)"""
+        for message_id in message_ids:
+            self.mark_as_processed(message_id)
+        labelled = self.labels.flush()
+        if labelled < len(message_ids):
+            # Outboxen prøver igen - at sætte en label to gange er harmløst
+            raise RuntimeError(f"Kun {labelled} af {len(message_ids)} emails fik label")
+    
+    def drain_outbox(self, limit: Optional[int] = None):
+        """Send ventende videresendelser fra outboxen og marker færdige emails som behandlet.
+        Kan køre i flere processer samtidig - hver videresendelse sendes af én proces.
+        """
+        result = self.outbox.drain(self.send_outbox_entry, self.label_messages, limit=limit)
+        self.stats.incr('errors', result.failed)
+        if result.sent or result.failed or result.labelled:
+            logger.info(f"📮 Outbox: {result.sent} sendt, {result.failed} fejlet, "
+                        f"{result.labelled} emails markeret")
+        return result
+    
     def mark_as_processed(self, message_id: str):
-        """Marker email som behandlet"""
+        """Marker email som behandlet - samles og sendes som batchModify (op til 1000 ad gangen)"""
+        self.labels.add(message_id, self.config['processed_label'])
+    
+    def flush_processed_labels(self):
+        """Påfør alle ventende labels"""
         try:
-            self.service.users().messages().modify(
-                userId='me',
-                id=message_id,
-                body={'addLabelIds': [self.processed_label_id]}
-            ).execute()
-            logger.info(f"🏷️  Email markeret som behandlet: {message_id}")
+            labelled = self.labels.flush()
+            if labelled:
+                logger.info(f"🏷️  {labelled} emails markeret som behandlet")
         
         except HttpError as error:
             logger.error(f"❌ Label fejl: {error}")
     
     def process_messages(self):
-        """Hovedproces: Find og videresend PDFs"""
+        """Hovedproces: Find og videresend PDFs.
+        Kan kaldes gentagne gange på samme instans (fx i push mode).
+        """
+        self.stats = Counters(*STAT_NAMES)
         try:
             # Hent/opret processed label
             self.processed_label_id = self.get_or_create_label(
                 self.config['processed_label'])
             
-            # Søg emails
-            query = self.build_search_query()
-            results = self.service.users().messages().list(
-                userId='me', 
-                q=query, 
-                maxResults=self.config['max_emails']
-            ).execute()
+            # Gem historyId før søgning, så mails der ankommer under kørslen
+            # fanges af næste inkrementelle sync
+            sync_started = datetime.now()
+            history_id = get_current_history_id(self.service)
             
-            messages = results.get('messages', [])
-            logger.info(f"📧 Fundet {len(messages)} emails til behandling")
+            destination = self.config['economic_receipt_email']
+            
+            if self.outbox is not None:
+                # Afslut arbejde fra afbrudte kørsler før nye emails hentes
+                self.drain_outbox()
             
-            if not messages:
+            # Søg og behandl emails efterhånden som siderne hentes, gennem
+            # fetch -> decode -> build -> send -> label pipelinen
+            result = self.build_pipeline(destination).run(self.iter_work_items())
+            logger.debug(f"Pipeline resultat: {result}")
+            # Genforsøgte emails fjernes først fra køen nu - nye fejl er lagt i køen igen
+            self.dead_letters.release()
+            self.flush_processed_labels()
+            if self.outbox is not None:
+                self.outbox.label_sent(self.label_messages)
+            
+            if not self.stats['processed']:
                 logger.info("📭 Ingen emails at behandle")
-                return
             
-            destination = self.config['economic_receipt_email']
+            self.sync_state.save(history_id, sync_started, full_scan=self.full_scan)
+            self.print_report()
+        
+        except HttpError as error:
+            logger.error(f"❌ Gmail API fejl: {error}")
+            raise
+    
+    def build_pipeline(self, destination: str) -> Pipeline:
+        """Opret videresendelses-pipelinen med bounded køer mellem trinene"""
+        workers = self.config['pipeline_workers']
+        stages = [
+            Stage('fetch', self.fetch_stage, workers['fetch']),
+            Stage('decode', self.decode_stage, workers['decode']),
+            Stage('build', lambda item: self.build_stage(item, destination), workers['build']),
+            Stage('send', self.send_stage, workers['send']),
+            Stage('label', self.label_stage, workers['label']),
+        ]
+        # Emails der fejler i et trin lægges i dead-letter køen
+        return Pipeline(stages, queue_size=self.config['queue_size'],
+                        on_error=lambda stage, item, error: self.dead_letter(item, f"{stage}: {error}"))
+    
+    def dead_letter(self, item: Dict, reason) -> None:
+        """Læg en fejlet email i dead-letter køen - den forsøges igen ved næste kørsel"""
+        self.dead_letters.push(DEAD_LETTER_SOURCE, {'message_id': item['message_id']}, reason)
+        self.stats.incr('dead_lettered')
+    
+    def iter_work_items(self) -> Iterator[Dict]:
+        """Gennemløb emails med PDF vedhæftninger - metadata hentes i batches af op til 100"""
+        for chunk in chunked(self.find_message_ids(), self.config['batch_size']):
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.get'] * len(chunk))
+            refs_by_message = self.get_pdf_attachment_refs(chunk)
             
-            # Behandl hver email
-            for msg in messages:
-                msg_id = msg['id']
-                self.stats['processed'] += 1
+            for msg_id in chunk:
+                self.stats.incr('processed')
                 
-                logger.info(f"\n📧 Behandler email: {msg_id}")
-                
-                # Hent PDF vedhæftninger
-                attachments = self.get_pdf_attachments(msg_id)
+                if msg_id not in refs_by_message:
+                    # Ukendt om emailen har PDFs - den må ikke markeres som behandlet
+                    logger.error(f"❌ Kunne ikke hente metadata for {msg_id}")
+                    self.stats.incr('errors')
+                    self.dead_letter({'message_id': msg_id}, 'Kunne ikke hente metadata')
+                    continue
                 
-                if not attachments:
-                    logger.warning("📭 Ingen PDF vedhæftninger fundet")
-                    self.stats['skipped'] += 1
+                if not refs_by_message[msg_id]:
+                    logger.warning(f"📭 Ingen PDF vedhæftninger fundet i {msg_id}")
+                    self.stats.incr('skipped')
+                    # Markeres alligevel, så emailen ikke hentes igen ved hver fuld scanning
+                    self.mark_as_processed(msg_id)
                     continue
                 
-                # Send hver PDF
-                for attachment in attachments:
-                    try:
-                        forward_msg = self.create_forward_email(attachment, destination)
-                        
-                        if self.send_email(forward_msg):
-                            self.stats['forwarded'] += 1
-                            logger.info(f"✅ Videresendt: {attachment['filename']}")
-                        else:
-                            self.stats['errors'] += 1
-                    
-                    except Exception as e:
-                        logger.error(f"❌ Videresendelse fejl: {e}")
-                        self.stats['errors'] += 1
+                yield {'message_id': msg_id, 'attachments': refs_by_message[msg_id]}
+    
+    def fetch_stage(self, item: Dict) -> Optional[Dict]:
+        """Pipeline trin: hent rå vedhæftningsdata for én email"""
+        refs = item['attachments']
+        self.rate_limiter.acquire(GMAIL_QUOTA_COST['attachments.get'] * len(refs))
+        bodies = get_attachments(
+            self.service,
+            [(a['message_id'], a['attachment_id']) for a in refs],
+            parallelism=1
+        )
+        
+        if len(bodies) < len(refs):
+            # Behandl ikke emailen halvt - den tages med igen ved næste kørsel
+            logger.error(f"❌ Kunne ikke hente alle vedhæftninger for {item['message_id']}")
+            self.stats.incr('errors')
+            self.dead_letter(item, 'Kunne ikke hente alle vedhæftninger')
+            return None
+        
+        for attachment in refs:
+            attachment['raw'] = bodies[(attachment['message_id'], attachment['attachment_id'])]
+        return item
+    
+    def decode_stage(self, item: Dict) -> Dict:
+        """Pipeline trin: base64-dekod vedhæftninger (dedup digest beregnes samtidig)"""
+        for attachment in item['attachments']:
+            file_data = decode_attachment(attachment.pop('raw'))
+            attachment['data'] = file_data
+            attachment['size'] = len(file_data)
+            logger.info(f"📎 PDF fundet: {attachment['filename']} ({len(file_data)} bytes)")
+        return item
+    
+    def build_stage(self, item: Dict, destination: str) -> Optional[Dict]:
+        """Pipeline trin: spring dubletter over og byg videresendelses-emails.
+        I bundling mode samles emailens PDFs i så få videresendelser som størrelsesgrænsen tillader.
+        Emails hvor en videresendelse ikke kunne bygges lægges i dead-letter køen.
+        """
+        claimed = []
+        for attachment in item['attachments']:
+            # Reservér indholdet før afsendelse - samme bilag sendes aldrig to gange,
+            # heller ikke på tværs af kørsler, emails eller processer
+            attachment['digest'] = content_digest(attachment['data'])
+            if not self.dedup.claim(attachment['digest'], attachment['filename'], self.config['processed_label']):
+                logger.info(f"♻️  Dublet sprunget over: {attachment['filename']}")
+                self.stats.incr('duplicates')
+                continue
+            claimed.append(attachment)
+        
+        if self.config['bundle_attachments']:
+            bundles = plan_bundles(claimed, lambda a: a['size'], self.config['bundle_max_bytes'])
+        else:
+            bundles = [[attachment] for attachment in claimed]
+        
+        forwards = []
+        failed = []
+        for bundle in bundles:
+            try:
+                forward_msg = self.create_bundle_email(bundle, destination)
+                # Emailen har nu sin egen (base64) kopi - frigiv de dekodede PDFs
+                for attachment in bundle:
+                    attachment.pop('data')
                 
-                # Marker som behandlet
-                if attachments:
-                    self.mark_as_processed(msg_id)
+                if self.outbox is None:
+                    forwards.append((bundle, forward_msg))
+                    continue
+                # Outboxen sørger nu for afsendelsen, også efter et nedbrud -
+                # bilagene registreres derfor som sendt med det samme
+                self.outbox.enqueue(item['message_id'], destination,
+                                    [a['digest'] for a in bundle], [a['filename'] for a in bundle],
+                                    forward_msg)
+                for attachment in bundle:
+                    self.dedup.confirm(attachment['digest'])
+            except Exception as e:
+                for attachment in bundle:
+                    self.dedup.release(attachment['digest'])
+                logger.error(f"❌ Videresendelse fejl: {e}")
+                self.stats.incr('errors')
+                failed.append(', '.join(attachment['filename'] for attachment in bundle))
+        
+        if failed:
+            # Byggede men ikke sendte videresendelser frigives - hele emailen forsøges igen
+            for bundle, _ in forwards:
+                for attachment in bundle:
+                    self.dedup.release(attachment['digest'])
+            self.dead_letter(item, f"Opbygning fejlede: {', '.join(failed)}")
+            return None
+        item['forwards'] = forwards
+        return item
+    
+    def send_stage(self, item: Dict) -> Optional[Dict]:
+        """Pipeline trin: send videresendelser inden for Gmail kvoten.
+        Emails med fejlede afsendelser markeres ikke som behandlet.
+        """
+        if self.outbox is not None:
+            return self.send_queued(item)
+        
+        failed = []
+        for bundle, forward_msg in item.pop('forwards'):
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.send'])
+            filenames = ', '.join(attachment['filename'] for attachment in bundle)
             
-            self.print_report()
+            if self.send_email(forward_msg):
+                # Hver PDF registreres for sig, også når de sendes samlet
+                for attachment in bundle:
+                    self.dedup.confirm(attachment['digest'])
+                    self.stats.incr('forwarded')
+                self.stats.incr('emails_sent')
+                logger.info(f"✅ Videresendt: {filenames}")
+            else:
+                for attachment in bundle:
+                    self.dedup.release(attachment['digest'])
+                self.stats.incr('errors')
+                failed.append(filenames)
         
-        except HttpError as error:
-            logger.error(f"❌ Gmail API fejl: {error}")
-            raise
+        if failed:
+            self.dead_letter(item, f"Afsendelse fejlede: {', '.join(failed)}")
+            return None
+        return item
+    
+    def send_queued(self, item: Dict) -> Optional[Dict]:
+        """Send emailens videresendelser fra outboxen.
+        Fejlede afsendelser bliver i outboxen og forsøges igen senere.
+        """
+        item.pop('forwards')
+        failed = 0
+        for entry in self.outbox.lease(message_id=item['message_id']):
+            if not self.outbox.renew(entry.id):
+                # En anden proces har overtaget videresendelsen - den sender og registrerer den
+                logger.warning(f"⚠️  Outbox lease mistet for {', '.join(entry.filenames)}")
+                continue
+            try:
+                sent_id = self.send_outbox_entry(entry)
+            except Exception as e:
+                logger.error(f"❌ Email fejl: {e}")
+                self.outbox.fail(entry.id, str(e))
+                self.stats.incr('errors')
+                failed += 1
+                continue
+            if not self.outbox.mark_sent(entry.id, sent_id):
+                logger.warning(f"⚠️  Outbox lease mistet under afsendelse af {', '.join(entry.filenames)}")
+        return None if failed else item
+    
+    def label_stage(self, item: Dict) -> Dict:
+        """Pipeline trin: marker email som behandlet.
+        Emails med videresendelser i outboxen markeres af outboxen, når alle er sendt.
+        """
+        if self.outbox is None or not self.outbox.has_entries(item['message_id']):
+            self.mark_as_processed(item['message_id'])
+        return item
     
     def print_report(self):
         """Print behandlingsrapport"""
@@ -455,8 +811,15 @@ Automatisk videresendt PDF bilag til e-conomic
         logger.info("="*60)
         logger.info(f"📧 Emails behandlet:    {self.stats['processed']}")
         logger.info(f"📎 PDFs videresendt:    {self.stats['forwarded']}")
+        logger.info(f"✉️  Emails sendt:        {self.stats['emails_sent']}")
         logger.info(f"⏭️  Emails sprunget over: {self.stats['skipped']}")
+        logger.info(f"♻️  Dubletter:           {self.stats['duplicates']}")
         logger.info(f"❌ Fejl:                {self.stats['errors']}")
+        logger.info(f"🔁 Til genforsøg:       {self.stats['dead_lettered']}")
+        if self.outbox is not None:
+            counts = self.outbox.counts()
+            logger.info(f"📮 Outbox:              {counts['extracted']} venter, "
+                        f"{counts['sent']} mangler label, {counts['failed']} opgivet")
         logger.info("="*60)
         
         # Success rate
@@ -472,7 +835,7 @@ Automatisk videresendt PDF bilag til e-conomic
         logger.info(f"🎯 e-conomic email: {self.config['economic_receipt_email']}")
         logger.info(f"📧 Gmail konto: {self.config['gmail_user_email']}")
         logger.info(f"📅 Søgeperiode: {self.config['days_back']} dage")
-        logger.info(f"📊 Max emails: {self.config['max_emails']}")
+        logger.info(f"📊 Max emails: {self.config['max_emails']} (sidestørrelse {self.config['page_size']})")
         logger.info(f"🔍 Søgeord: {', '.join(self.config['search_keywords'])}")
         
         if self.config['allowed_senders']:
@@ -481,6 +844,14 @@ Automatisk videresendt PDF bilag til e-conomic
             logger.info("✉️  Tilladte afsendere: Alle")
             
         logger.info(f"🏷️  Label: {self.config['processed_label']}")
+        logger.info(f"🔄 Inkrementel sync: {'Ja' if self.config['incremental_sync'] else 'Nej'}")
+        if self.config['bundle_attachments']:
+            logger.info(f"📦 Bundling: op til {self.config['bundle_max_bytes'] / (1024 * 1024):.0f} MB pr. email")
+        else:
+            logger.info("📦 Bundling: Nej")
+        workers = ', '.join(f"{name}={count}" for name, count in self.config['pipeline_workers'].items())
+        logger.info(f"⚙️  Pipeline: {workers} (kø {self.config['queue_size']}, "
+                    f"kvote {self.config['quota_per_second']} units/sek)")
     
     def run(self):
         """Kør hele processen"""
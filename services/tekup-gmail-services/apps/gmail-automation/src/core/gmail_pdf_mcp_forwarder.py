@@ -8,30 +8,48 @@ import os
 import sys
 import logging
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-import base64
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.attachment_data import decode_attachment
+from src.utils.gmail_access import ATTACHMENTS, get_message, header
+from src.utils.gmail_http import execute
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import DEFAULT_PAGE_SIZE, iter_messages
+from src.utils.mime_builder import Attachment, MessageTemplate, encode_attachment, send_raw
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Simple forward format that e-conomic can parse
+FORWARD_TEMPLATE = MessageTemplate('PDF Bilag: {subject}', """PDF bilag videresendt fra Gmail.
+
+Original email:
+Fra: {sender}
+Emne: {subject}
+Dato: {date}
+PDF fil: {filename}
+
+Automatisk videresendt af Gmail PDF Forwarder.
+""")
+
 class GmailPDFMCPForwarder:
     def __init__(self, creds_file, token_file, economic_email):
         """Initialize Gmail PDF MCP Forwarder"""
         self.gmail_service = GmailService(creds_file, token_file)
         self.economic_email = economic_email
         self.processed_label = "Videresendt_econ"
+        self.labels = LabelManager(self.gmail_service.service, self.gmail_service.user_email)
         logger.info(f"Initialized Gmail PDF MCP Forwarder for {self.gmail_service.user_email}")
     
-    async def search_emails_with_pdfs(self, days_back=180):
-        """Search for emails with PDF attachments from the last N days"""
+    def search_emails_with_pdfs(self, days_back=180, max_emails=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate emails with PDF attachments from the last N days, page by page"""
         try:
             # Calculate date range
             end_date = datetime.now()
@@ -46,39 +64,29 @@ class GmailPDFMCPForwarder:
             
             logger.info(f"Searching for emails with PDFs from {start_date_str} to {end_date_str}")
             
-            # Get message IDs
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=100
-            ).execute()
-            
-            message_ids = response.get('messages', [])
-            logger.info(f"Found {len(message_ids)} emails with PDF attachments")
-            
-            return message_ids
+            # Stream message IDs
+            yield from iter_messages(
+                self.gmail_service.service,
+                query,
+                page_size=page_size,
+                limit=max_emails
+            )
             
         except Exception as e:
             logger.error(f"Error searching emails: {e}")
-            return []
     
     async def get_email_with_attachments(self, message_id):
         """Get email details with attachments"""
         try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
+            # Attachment structure only - bodies are downloaded separately
+            message = get_message(self.gmail_service.service, message_id, ATTACHMENTS)
             
-            # Extract headers
-            headers = message.get('payload', {}).get('headers', [])
             email_data = {
                 'id': message['id'],
                 'threadId': message['threadId'],
-                'subject': next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject'),
-                'from': next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown'),
-                'date': next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown'),
+                'subject': header(message, 'Subject', 'No Subject'),
+                'from': header(message, 'From', 'Unknown'),
+                'date': header(message, 'Date', 'Unknown'),
                 'attachments': []
             }
             
@@ -121,15 +129,15 @@ class GmailPDFMCPForwarder:
     async def download_attachment(self, message_id, attachment_id):
         """Download attachment from Gmail"""
         try:
-            attachment = self.gmail_service.service.users().messages().attachments().get(
+            attachment = execute(self.gmail_service.service.users().messages().attachments().get(
                 userId='me',
                 messageId=message_id,
                 id=attachment_id
-            ).execute()
+            ))
             
             data = attachment.get('data')
             if data:
-                return base64.urlsafe_b64decode(data)
+                return decode_attachment(data)
             return None
             
         except Exception as e:
@@ -150,44 +158,17 @@ class GmailPDFMCPForwarder:
             if not clean_filename.endswith('.pdf'):
                 clean_filename += '.pdf'
             
-            # Create email message with e-conomic compatible format
-            msg = MIMEMultipart()
-            msg['From'] = self.gmail_service.user_email
-            msg['To'] = self.economic_email
-            msg['Subject'] = f"PDF Bilag: {email_data['subject']}"
-            msg['Content-Type'] = 'multipart/mixed'
-            
-            # Simple email body (e-conomic prefers very simple format)
-            body = f"""PDF bilag videresendt fra Gmail.
-
-Original email:
-Fra: {email_data['from']}
-Emne: {email_data['subject']}
-Dato: {email_data['date']}
-PDF fil: {clean_filename}
-
-Automatisk videresendt af Gmail PDF Forwarder.
-"""
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-            
-            # Attach PDF with e-conomic compatible headers
-            pdf_attachment = MIMEBase('application', 'pdf')
-            pdf_attachment.set_payload(pdf_data)
-            encoders.encode_base64(pdf_attachment)
-            
-            # Use simple headers that e-conomic can read
-            pdf_attachment.add_header('Content-Disposition', f'attachment; filename="{clean_filename}"')
-            pdf_attachment.add_header('Content-Type', 'application/pdf')
-            pdf_attachment.add_header('Content-Transfer-Encoding', 'base64')
-            
-            msg.attach(pdf_attachment)
+            # Create email with e-conomic optimized format
+            message = FORWARD_TEMPLATE.render(
+                self.gmail_service.user_email, self.economic_email,
+                [Attachment(clean_filename, encode_attachment(pdf_data))],
+                subject=email_data['subject'],
+                sender=email_data['from'],
+                date=email_data['date'],
+                filename=clean_filename)
             
             # Send email
-            raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-            send_message = self.gmail_service.service.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
+            send_message = send_raw(self.gmail_service.service, message)
             
             logger.info(f"PDF {clean_filename} ({file_size_mb:.1f}MB) forwarded to {self.economic_email}")
             return send_message['id']
@@ -197,50 +178,31 @@ Automatisk videresendt af Gmail PDF Forwarder.
             return None
     
     async def add_processed_label(self, message_id):
-        """Add processed label to email"""
+        """Queue processed label for email (applied in bulk by flush_processed_labels)"""
+        self.labels.add(message_id, self.processed_label)
+    
+    async def flush_processed_labels(self):
+        """Apply all queued processed labels with batchModify"""
         try:
-            # First check if label exists, create if not
-            labels = self.gmail_service.service.users().labels().list(userId='me').execute()
-            label_exists = any(label['name'] == self.processed_label for label in labels.get('labels', []))
-            
-            if not label_exists:
-                # Create the label
-                label_body = {
-                    'name': self.processed_label,
-                    'labelListVisibility': 'labelShow',
-                    'messageListVisibility': 'show'
-                }
-                self.gmail_service.service.users().labels().create(
-                    userId='me',
-                    body=label_body
-                ).execute()
-                logger.info(f"Created label: {self.processed_label}")
-            
-            # Add label to message
-            self.gmail_service.service.users().messages().modify(
-                userId='me',
-                id=message_id,
-                body={'addLabelIds': [self.processed_label]}
-            ).execute()
-            logger.info(f"Added processed label to message {message_id}")
+            labelled = self.labels.flush()
+            if labelled:
+                logger.info(f"Added processed label to {labelled} messages")
         except Exception as e:
-            logger.error(f"Error adding label to message {message_id}: {e}")
+            logger.error(f"Error adding processed labels: {e}")
     
-    async def run_forwarding_process(self, days_back=180):
+    async def run_forwarding_process(self, days_back=180, max_emails=None, page_size=DEFAULT_PAGE_SIZE):
         """Run the complete PDF forwarding process"""
         logger.info("Starting Gmail PDF MCP Forwarding process...")
         
-        # Search for emails with PDFs
-        message_ids = await self.search_emails_with_pdfs(days_back)
-        
-        if not message_ids:
-            logger.info("No emails with PDF attachments found")
-            return
+        # Search for emails with PDFs (streamed page by page)
+        messages = self.search_emails_with_pdfs(days_back, max_emails=max_emails, page_size=page_size)
         
         processed_count = 0
         forwarded_pdfs = 0
+        found = 0
         
-        for msg_id in message_ids:
+        for msg_id in messages:
+            found += 1
             try:
                 # Get email details
                 email_data = await self.get_email_with_attachments(msg_id['id'])
@@ -276,6 +238,11 @@ Automatisk videresendt af Gmail PDF Forwarder.
             except Exception as e:
                 logger.error(f"Error processing message {msg_id['id']}: {e}")
         
+        await self.flush_processed_labels()
+        
+        if not found:
+            logger.info("No emails with PDF attachments found")
+        
         logger.info(f"Processed {processed_count} emails, forwarded {forwarded_pdfs} PDFs")
         return processed_count, forwarded_pdfs
 
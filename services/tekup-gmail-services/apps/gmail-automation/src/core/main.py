@@ -2,14 +2,15 @@
 TekUp Gmail Automation - Main Entry Point
 
 This module provides the main entry point for the TekUp Gmail Automation system.
+Subcommands live in src/core/commands and are imported only when invoked, so
+``tekup-gmail --help`` or a single command does not load Google APIs, PIL or
+e-conomic clients it does not use (check with ``tekup-gmail import-budget``).
 """
 
-import asyncio
-import logging
+import importlib
 import sys
-import time
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional
 
 import click
 from loguru import logger
@@ -17,9 +18,41 @@ from loguru import logger
 # Add src to path for imports
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from src.core.gmail_forwarder import GmailPDFForwarder
-from src.integrations.gmail_economic_api_forwarder import EconomicApiForwarder
-from src.processors.google_photos_receipt_processor import GooglePhotosReceiptProcessor
+# Command name -> "module:attribute", imported on first use
+COMMANDS: Dict[str, str] = {
+    'start': 'src.core.commands.service:start',
+    'process': 'src.core.commands.service:process',
+    'status': 'src.core.commands.status:status',
+    'process-receipts': 'src.core.commands.receipts:process_receipts',
+    'import-statements': 'src.core.commands.statements:import_statements',
+    'index-mailbox': 'src.core.commands.mailbox:index_mailbox',
+    'drain-outbox': 'src.core.commands.outbox:drain_outbox',
+    'test': 'src.core.commands.dev:test',
+    'import-budget': 'src.core.commands.dev:import_budget',
+}
+
+
+class LazyGroup(click.Group):
+    """click Group that imports each subcommand from a registry when it is needed"""
+
+    def __init__(self, *args, lazy_commands: Optional[Dict[str, str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands or {}
+
+    def list_commands(self, ctx: click.Context) -> List[str]:
+        return sorted(set(super().list_commands(ctx)) | set(self.lazy_commands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_commands:
+            return self._load(cmd_name)
+        return super().get_command(ctx, cmd_name)
+
+    def _load(self, cmd_name: str) -> click.Command:
+        module_name, attr = self.lazy_commands[cmd_name].split(':')
+        command = getattr(importlib.import_module(module_name), attr)
+        if not isinstance(command, click.Command):
+            raise TypeError(f"{self.lazy_commands[cmd_name]} is not a click command")
+        return command
 
 
 def setup_logging(level: str = "INFO") -> None:
@@ -48,7 +81,7 @@ def setup_logging(level: str = "INFO") -> None:
     )
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_commands=COMMANDS)
 @click.option('--log-level', default='INFO', help='Log level (DEBUG, INFO, WARNING, ERROR)')
 @click.option('--config', default='config/env.example', help='Configuration file path')
 @click.pass_context
@@ -62,134 +95,5 @@ def cli(ctx, log_level: str, config: str):
     logger.info("TekUp Gmail Automation started")
 
 
-@cli.command()
-@click.option('--daemon', is_flag=True, help='Run as daemon')
-@click.option('--interval', default=300, help='Processing interval in seconds')
-@click.pass_context
-def start(ctx, daemon: bool, interval: int):
-    """Start the Gmail automation service."""
-    logger.info(f"Starting Gmail automation service (interval: {interval}s)")
-    
-    try:
-        forwarder = GmailPDFForwarder()
-        
-        if daemon:
-            # Run in background
-            import threading
-            def run_forwarder():
-                while True:
-                    try:
-                        forwarder.process_emails()
-                        time.sleep(interval)
-                    except Exception as e:
-                        logger.error(f"Error in forwarder: {e}")
-                        time.sleep(60)
-            
-            thread = threading.Thread(target=run_forwarder, daemon=True)
-            thread.start()
-            thread.join()
-        else:
-            # Run once
-            forwarder.process_emails()
-            
-    except KeyboardInterrupt:
-        logger.info("Service stopped by user")
-    except Exception as e:
-        logger.error(f"Service error: {e}")
-        sys.exit(1)
-
-
-@cli.command()
-@click.option('--email-id', required=True, help='Email ID to process')
-@click.pass_context
-def process(ctx, email_id: str):
-    """Process a specific email."""
-    logger.info(f"Processing email: {email_id}")
-    
-    try:
-        forwarder = GmailPDFForwarder()
-        result = forwarder.process_email(email_id)
-        logger.info(f"Email processed: {result}")
-    except Exception as e:
-        logger.error(f"Error processing email: {e}")
-        sys.exit(1)
-
-
-@cli.command()
-@click.pass_context
-def status(ctx):
-    """Check system status."""
-    logger.info("Checking system status...")
-    
-    try:
-        # Check Gmail connection
-        forwarder = GmailPDFForwarder()
-        gmail_status = forwarder.check_connection()
-        
-        # Check Economic API
-        economic = EconomicApiForwarder()
-        economic_status = economic.check_connection() if hasattr(economic, 'check_connection') else False
-        
-        # Check receipt processor
-        processor = GooglePhotosReceiptProcessor()
-        processor_status = processor.check_status() if hasattr(processor, 'check_status') else False
-        
-        logger.info(f"Gmail: {'✅' if gmail_status else '❌'}")
-        logger.info(f"Economic API: {'✅' if economic_status else '❌'}")
-        logger.info(f"Receipt Processor: {'✅' if processor_status else '❌'}")
-        
-    except Exception as e:
-        logger.error(f"Status check error: {e}")
-        sys.exit(1)
-
-
-@cli.command()
-@click.option('--source', default='all', help='Source to process (gmail, photos, all)')
-@click.pass_context
-def process_receipts(ctx, source: str):
-    """Process receipts from various sources."""
-    logger.info(f"Processing receipts from: {source}")
-    
-    try:
-        processor = GooglePhotosReceiptProcessor()
-        
-        if source in ['gmail', 'all']:
-            if hasattr(processor, 'process_gmail_receipts'):
-                processor.process_gmail_receipts()
-            
-        if source in ['photos', 'all']:
-            if hasattr(processor, 'process_photos_receipts'):
-                processor.process_photos_receipts()
-            else:
-                processor.process_receipts()
-            
-        logger.info("Receipt processing completed")
-        
-    except Exception as e:
-        logger.error(f"Receipt processing error: {e}")
-        sys.exit(1)
-
-
-@cli.command()
-@click.pass_context
-def test(ctx):
-    """Run system tests."""
-    logger.info("Running system tests...")
-    
-    try:
-        import subprocess
-        result = subprocess.run([sys.executable, "-m", "pytest", "tests/"], capture_output=True, text=True)
-        
-        if result.returncode == 0:
-            logger.info("✅ All tests passed")
-        else:
-            logger.error(f"❌ Tests failed: {result.stderr}")
-            sys.exit(1)
-            
-    except Exception as e:
-        logger.error(f"Test error: {e}")
-        sys.exit(1)
-
-
 if __name__ == "__main__":
     cli()
@@ -2,14 +2,23 @@
 # -*- coding: utf-8 -*-
 """
 Scheduler til Gmail PDF Forwarder
-Kører automatisk på planlagte tidspunkter
+Kører automatisk på planlagte tidspunkter, eller med --push event-drevet via
+Gmail push notifikationer (se src/utils/push_receiver.py)
 """
 
+import argparse
 import schedule
+import sys
 import time
 import logging
 from datetime import datetime
-from gmail_forwarder import GmailPDFForwarder
+from pathlib import Path
+
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.core.gmail_forwarder import GmailPDFForwarder
+from src.utils.push_receiver import run_push_service
+from src.utils.resilience import backoff_delay
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,32 +26,88 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Genforsøg efter en fejlet kørsel: eksponentiel backoff med jitter, 1 min - 1 time
+RETRY_BASE_SECONDS = 60
+RETRY_MAX_SECONDS = 3600
+
+_failed_runs = 0
 
-def run_forwarder():
-    """Kør forwarder job"""
+
+def run_forwarder() -> bool:
+    """Kør forwarder job - returnerer True hvis kørslen lykkedes"""
     logger.info("=" * 60)
     logger.info(f"🕒 Planlagt kørsel startet: {datetime.now()}")
     logger.info("=" * 60)
     
     try:
+        # Ny forwarder pr. kørsel (genindlæser konfigurationen) - Gmail servicen og
+        # credentials er cachet i processen, så opstarten er billig
         forwarder = GmailPDFForwarder()
         forwarder.run()
         logger.info("✅ Planlagt kørsel gennemført")
+        return True
     except Exception as e:
         logger.error(f"❌ Fejl under planlagt kørsel: {e}", exc_info=True)
+        return False
+
+
+def run_with_retry():
+    """Kør forwarder job - ved fejl planlægges et ekstra forsøg med stigende ventetid"""
+    global _failed_runs
+    
+    schedule.clear('retry')
+    if run_forwarder():
+        _failed_runs = 0
+        return
+    
+    _failed_runs += 1
+    delay = int(backoff_delay(_failed_runs, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
+    logger.warning(f"🔁 Nyt forsøg om {delay // 60} min {delay % 60} sek (fejl nr. {_failed_runs} i træk)")
+    schedule.every(delay).seconds.do(retry_forwarder).tag('retry')
+
+
+def retry_forwarder():
+    """Engangs-job for et genforsøg"""
+    run_with_retry()
+    return schedule.CancelJob
+
+
+def run_push_mode():
+    """Event-drevet kørsel: behandl nye emails få sekunder efter en push notifikation.
+    Polling kører kun som sikkerhedsnet (PUSH_POLL_INTERVAL_HOURS), og Gmail watch
+    fornyes dagligt.
+    """
+    logger.info("📨 Starter push mode")
+    forwarder = GmailPDFForwarder()
+    forwarder.print_config()
+    forwarder.authenticate()
+    
+    try:
+        run_push_service(forwarder.service, forwarder.process_messages)
+    except KeyboardInterrupt:
+        logger.info("\n⏹️  Push mode stoppet af bruger")
 
 
 def main():
     """Main scheduler"""
+    parser = argparse.ArgumentParser(description="Gmail PDF Forwarder Scheduler")
+    parser.add_argument('--push', action='store_true',
+                        help="Event-drevet mode via Gmail push notifikationer i stedet for daglig kørsel")
+    args = parser.parse_args()
+    
     print("🤖 Gmail PDF Forwarder Scheduler")
     print("=" * 50)
     
+    if args.push:
+        run_push_mode()
+        return
+    
     # Kør ved start
     logger.info("🚀 Starter scheduler - første kørsel nu...")
-    run_forwarder()
+    run_with_retry()
     
     # Planlæg daglig kørsel kl. 09:00
-    schedule.every().day.at("09:00").do(run_forwarder)
+    schedule.every().day.at("09:00").do(run_with_retry)
     
     # Alternativt: Andre tider (kommenter ind/ud efter behov)
     # schedule.every().day.at("15:00").do(run_forwarder)  # Eftermiddag
@@ -51,19 +116,23 @@ def main():
     
     logger.info("⏰ Scheduler konfigureret:")
     logger.info("   • Daglig kørsel kl. 09:00")
+    logger.info("   • Fejlede kørsler forsøges igen med stigende ventetid")
     logger.info("   • Tryk CTRL+C for at stoppe")
     
     # Hold scheduler kørende
+    loop_errors = 0
     while True:
         try:
             schedule.run_pending()
+            loop_errors = 0
             time.sleep(60)  # Tjek hvert minut
         except KeyboardInterrupt:
             logger.info("\n⏹️  Scheduler stoppet af bruger")
             break
         except Exception as e:
+            loop_errors += 1
             logger.error(f"💥 Scheduler fejl: {e}", exc_info=True)
-            time.sleep(300)  # Vent 5 minutter ved fejl
+            time.sleep(backoff_delay(loop_errors, RETRY_BASE_SECONDS, RETRY_MAX_SECONDS))
 
 
 if __name__ == '__main__':
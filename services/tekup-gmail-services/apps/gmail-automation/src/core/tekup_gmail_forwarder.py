@@ -6,170 +6,151 @@ Automatisk PDF bilag forwarding til e-conomic
 """
 
 import asyncio
+import itertools
 import logging
 import os
 import sys
-import base64
-import hashlib
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.attachment_data import decode_attachment
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import ATTACHMENTS, header, message_request
+from src.utils.gmail_http import execute
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import DEFAULT_PAGE_SIZE, iter_messages
+from src.utils.mime_builder import Attachment, MessageTemplate, encode_attachment, send_raw
+from src.utils.pipeline import (
+    GMAIL_QUOTA_COST,
+    GMAIL_QUOTA_UNITS_PER_SECOND,
+    Counters,
+    Pipeline,
+    Stage,
+    TokenBucket,
+    parse_workers,
+)
+from src.utils.resilience import DeadLetterQueue
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_PIPELINE_WORKERS = {'fetch': 4, 'decode': 1, 'build': 1, 'send': 2, 'label': 1}
+DEAD_LETTER_SOURCE = 'tekup_forwarder'
+
+# Email body with TekUp branding
+TEKUP_TEMPLATE = MessageTemplate('TekUp Bilag: {filename}', """
+TekUp Gmail PDF Auto Forwarder
+==============================
+
+Organisation: {organization}
+CVR: {cvr}
+Dato: {date}
+
+PDF Bilag: {filename}
+Størrelse: {size_mb:.1f} MB
+
+Dette bilag er automatisk sendt fra TekUp Gmail system.
+Kontakt: ftfiestaa@gmail.com
+
+---
+TekUp Organization
+Gmail PDF Automation System
+""")
+
 class TekUpGmailForwarder:
     def __init__(self, creds_file, token_file):
         """Initialize TekUp Gmail Forwarder"""
         self.gmail_service = GmailService(creds_file, token_file)
         self.processed_label = "TekUp_Processed"
-        self.sent_pdfs = set()  # Track sent PDFs to avoid duplicates
+        self.dedup = get_dedup_store()  # Persistent index of sent PDFs, shared across runs
+        self.dead_letters = DeadLetterQueue()  # Failed emails, retried on the next run
         
         # TekUp specific configuration
         self.tekup_economic_email = "788bilag1714566@e-conomic.dk"
         self.tekup_organization = "Foodtruck Fiesta ApS"
         self.tekup_cvr = "44371901"
         
+        # Pipeline configuration: workers per stage, queue size and Gmail quota (units/sec)
+        self.pipeline_workers = parse_workers(os.getenv('PIPELINE_WORKERS'), DEFAULT_PIPELINE_WORKERS)
+        self.queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '10'))
+        self.rate_limiter = TokenBucket(
+            int(os.getenv('GMAIL_QUOTA_PER_SECOND', str(GMAIL_QUOTA_UNITS_PER_SECOND))))
+        self.stats = Counters('processed', 'forwarded', 'duplicates', 'errors', 'dead_lettered')
+        self.labels = LabelManager(self.gmail_service.service, self.gmail_service.user_email,
+                                   rate_limiter=self.rate_limiter)
+        
         logger.info(f"Initialized TekUp Gmail Forwarder for {self.gmail_service.user_email}")
     
-    def _generate_pdf_hash(self, pdf_data, filename):
-        """Generate a unique hash for PDF to detect duplicates"""
-        content_hash = hashlib.md5(pdf_data).hexdigest()
-        filename_hash = hashlib.md5(filename.encode()).hexdigest()
-        size_hash = hashlib.md5(str(len(pdf_data)).encode()).hexdigest()
-        combined_hash = hashlib.md5(f"{content_hash}_{filename_hash}_{size_hash}".encode()).hexdigest()
-        return combined_hash
+    def create_tekup_message(self, pdf_data, filename):
+        """Build the e-conomic email for a PDF, or None if it is too large"""
+        # Check file size (e-conomic limit)
+        file_size_mb = len(pdf_data) / (1024 * 1024)
+        if file_size_mb > 10:
+            logger.warning(f"PDF {filename} is too large ({file_size_mb:.1f}MB), skipping")
+            return None
+        
+        # Clean filename for e-conomic compatibility
+        clean_filename = filename.replace(' ', '_').replace('(', '').replace(')', '').replace('/', '_')
+        
+        # Create email for TekUp e-conomic
+        return TEKUP_TEMPLATE.render(
+            self.gmail_service.user_email, self.tekup_economic_email,
+            [Attachment(clean_filename, encode_attachment(pdf_data))],
+            filename=clean_filename,
+            organization=self.tekup_organization,
+            cvr=self.tekup_cvr,
+            date=datetime.now().strftime('%d/%m/%Y %H:%M'),
+            size_mb=file_size_mb,
+        )
 
-    async def forward_pdf_to_tekup_economic(self, email_data, pdf_data, filename):
-        """Forward PDF to TekUp e-conomic with duplicate detection"""
+    def send_tekup_message(self, msg, filename):
+        """Send a prepared e-conomic email"""
         try:
-            # Generate unique hash for this PDF
-            pdf_hash = self._generate_pdf_hash(pdf_data, filename)
+            send_raw(self.gmail_service.service, msg)
             
-            # Check if we've already sent this PDF
-            if pdf_hash in self.sent_pdfs:
-                logger.info(f"SKIPPING DUPLICATE: {filename} (already sent to TekUp e-conomic)")
-                return "duplicate"
-            
-            # Check file size (e-conomic limit)
-            file_size_mb = len(pdf_data) / (1024 * 1024)
-            if file_size_mb > 10:
-                logger.warning(f"PDF {filename} is too large ({file_size_mb:.1f}MB), skipping")
-                return None
-            
-            # Clean filename for e-conomic compatibility
-            clean_filename = filename.replace(' ', '_').replace('(', '').replace(')', '').replace('/', '_')
-            
-            # Create email for TekUp e-conomic
-            msg = MIMEMultipart('mixed')
-            msg['From'] = self.gmail_service.user_email
-            msg['To'] = self.tekup_economic_email
-            msg['Subject'] = f"TekUp Bilag: {clean_filename}"
-            
-            # Email body with TekUp branding
-            body = f"""
-TekUp Gmail PDF Auto Forwarder
-==============================
-
-Organisation: {self.tekup_organization}
-CVR: {self.tekup_cvr}
-Dato: {datetime.now().strftime('%d/%m/%Y %H:%M')}
-
-PDF Bilag: {clean_filename}
-Størrelse: {file_size_mb:.1f} MB
-
-Dette bilag er automatisk sendt fra TekUp Gmail system.
-Kontakt: ftfiestaa@gmail.com
-
----
-TekUp Organization
-Gmail PDF Automation System
-"""
-            
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-            
-            # Attach PDF with proper headers for e-conomic
-            pdf_attachment = MIMEBase('application', 'pdf')
-            pdf_attachment.set_payload(pdf_data)
-            encoders.encode_base64(pdf_attachment)
-            pdf_attachment.add_header(
-                'Content-Disposition',
-                f'attachment; filename="{clean_filename}"'
-            )
-            pdf_attachment.add_header('Content-Type', 'application/pdf')
-            pdf_attachment.add_header('Content-Transfer-Encoding', 'base64')
-            
-            msg.attach(pdf_attachment)
-            
-            # Send email
-            raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode('utf-8')
-            
-            self.gmail_service.service.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
-            
-            # Add to sent PDFs to prevent duplicates
-            self.sent_pdfs.add(pdf_hash)
-            logger.info(f"SUCCESS: TekUp PDF {clean_filename} ({file_size_mb:.1f}MB) sent to e-conomic")
-            return "success"
+            logger.info(f"SUCCESS: TekUp PDF {filename} sent to e-conomic")
+            return True
                 
         except Exception as e:
             logger.error(f"ERROR: Failed to send TekUp PDF {filename} to e-conomic: {e}")
-            return None
+            return False
 
-    async def search_emails_with_pdfs(self, days_back=180):
-        """Search for emails with PDF attachments"""
+    def search_emails_with_pdfs(self, days_back=180, max_emails=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate emails with PDF attachments, fetching result pages lazily"""
         try:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
             
             query = f'has:attachment filename:pdf after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
+            logger.info(f"TekUp: Searching for emails with PDF attachments from {start_date.strftime('%Y/%m/%d')} to {end_date.strftime('%Y/%m/%d')}")
             
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=50
-            ).execute()
-            
-            message_ids = response.get('messages', [])
-            logger.info(f"TekUp: Found {len(message_ids)} emails with PDF attachments from {start_date.strftime('%Y/%m/%d')} to {end_date.strftime('%Y/%m/%d')}")
-            return message_ids
+            yield from iter_messages(
+                self.gmail_service.service,
+                query,
+                page_size=page_size,
+                limit=max_emails
+            )
             
         except Exception as e:
             logger.error(f"ERROR: TekUp email search failed: {e}")
-            return []
 
-    async def get_email_details(self, message_id):
+    def get_email_details(self, message_id):
         """Get detailed email information"""
         try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
-            
-            headers = message.get('payload', {}).get('headers', [])
-            subject = ''
-            sender = ''
-            
-            for header in headers:
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                elif header['name'] == 'From':
-                    sender = header['value']
+            # Attachment structure only - bodies are downloaded separately
+            message = execute(message_request(self.gmail_service.service, message_id, ATTACHMENTS))
             
             return {
                 'id': message_id,
-                'subject': subject,
-                'sender': sender,
+                'subject': header(message, 'Subject'),
+                'sender': header(message, 'From'),
                 'payload': message.get('payload', {})
             }
             
@@ -202,19 +183,15 @@ Gmail PDF Automation System
         extract_from_part(payload)
         return attachments
 
-    async def download_attachment(self, message_id, attachment_id):
-        """Download attachment from Gmail"""
+    def fetch_attachment(self, message_id, attachment_id):
+        """Fetch the raw (base64url) attachment data from Gmail"""
         try:
-            attachment = self.gmail_service.service.users().messages().attachments().get(
+            attachment = execute(self.gmail_service.service.users().messages().attachments().get(
                 userId='me',
                 messageId=message_id,
                 id=attachment_id
-            ).execute()
-            
-            data = attachment.get('data')
-            if data:
-                return base64.urlsafe_b64decode(data)
-            return None
+            ))
+            return attachment.get('data')
             
         except Exception as e:
             logger.error(f"ERROR: TekUp attachment download failed for {attachment_id}: {e}")
@@ -223,48 +200,146 @@ Gmail PDF Automation System
     async def create_tekup_processed_label(self):
         """Create or get TekUp processed label"""
         try:
-            # Check if label exists
-            labels = self.gmail_service.service.users().labels().list(userId='me').execute()
-            for label in labels.get('labels', []):
-                if label['name'] == self.processed_label:
-                    logger.info(f"TekUp: Using existing label: {self.processed_label} (ID: {label['id']})")
-                    return label['id']
-            
-            # Create new TekUp label
-            label_body = {
-                'name': self.processed_label,
-                'labelListVisibility': 'labelShow',
-                'messageListVisibility': 'show'
-            }
-            
-            created_label = self.gmail_service.service.users().labels().create(
-                userId='me',
-                body=label_body
-            ).execute()
-            
-            logger.info(f"TekUp: Created new label: {self.processed_label} (ID: {created_label['id']})")
-            return created_label['id']
+            label_id = self.labels.label_id(self.processed_label)
+            logger.info(f"TekUp: Using label: {self.processed_label} (ID: {label_id})")
+            return label_id
             
         except Exception as e:
             logger.error(f"ERROR: TekUp label creation failed: {e}")
             return None
 
-    async def mark_as_tekup_processed(self, message_id, label_id):
-        """Mark email as processed by TekUp system"""
+    def mark_as_tekup_processed(self, message_id):
+        """Queue email to be marked as processed by TekUp system (applied in bulk by flush_processed_labels)"""
+        self.labels.add(message_id, self.processed_label)
+
+    def flush_processed_labels(self):
+        """Apply all queued processed labels with batchModify (up to 1000 messages per call)"""
         try:
-            if label_id:
-                self.gmail_service.service.users().messages().modify(
-                    userId='me',
-                    id=message_id,
-                    body={'addLabelIds': [label_id]}
-                ).execute()
-                logger.info(f"TekUp: Marked message {message_id} as processed")
-            else:
-                logger.warning(f"TekUp: Could not mark message {message_id} as processed - no label ID")
+            labelled = self.labels.flush()
+            if labelled:
+                logger.info(f"TekUp: Marked {labelled} messages as processed")
         except Exception as e:
-            logger.error(f"ERROR: TekUp message marking failed for {message_id}: {e}")
+            logger.error(f"ERROR: TekUp message marking failed: {e}")
 
-    async def run_tekup_forwarding_process(self, days_back=180, max_emails=10):
+    def _fetch_stage(self, item):
+        """Pipeline stage: fetch email details and raw PDF attachment data"""
+        msg_id = item['id']
+        self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.get'])
+        email_data = self.get_email_details(msg_id)
+        if not email_data:
+            logger.warning(f"TekUp: Could not get details for email {msg_id}")
+            self.dead_letter(item, 'Could not get email details')
+            return None
+        
+        logger.info(f"TekUp Email: {email_data['subject']}")
+        logger.info(f"TekUp From: {email_data['sender']}")
+        
+        pdf_attachments = self._extract_pdf_attachments(email_data['payload'])
+        if not pdf_attachments:
+            # Still labelled, so the email is not listed and fetched again on every run
+            logger.warning(f"TekUp: No PDF attachments found in email {msg_id}")
+            return {'id': msg_id, 'attachments': [], 'failed': []}
+        
+        logger.info(f"TekUp PDF attachments: {len(pdf_attachments)}")
+        
+        for attachment in pdf_attachments:
+            logger.info(f"TekUp: Processing PDF: {attachment['filename']} ({attachment['size']} bytes)")
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['attachments.get'])
+            attachment['raw'] = self.fetch_attachment(msg_id, attachment['id'])
+        
+        return {'id': msg_id, 'attachments': pdf_attachments, 'failed': []}
+
+    def _decode_stage(self, item):
+        """Pipeline stage: decode downloaded attachments, hashing them in the same pass"""
+        for attachment in item['attachments']:
+            raw = attachment.pop('raw')
+            if raw:
+                attachment['data'] = decode_attachment(raw)
+            else:
+                logger.error(f"TekUp: Failed to download: {attachment['filename']}")
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
+
+    def _build_stage(self, item):
+        """Pipeline stage: skip duplicates and build the e-conomic emails"""
+        for attachment in item['attachments']:
+            if 'data' not in attachment:
+                continue
+            
+            # Claim the digest up front so parallel send workers - and other
+            # runs or processes - never send the same PDF twice
+            attachment['hash'] = content_digest(attachment['data'])
+            if not self.dedup.claim(attachment['hash'], attachment['filename'], self.processed_label):
+                self.stats.incr('duplicates')
+                logger.info(f"TekUp: SKIPPED DUPLICATE: {attachment['filename']}")
+                continue
+            
+            # The email holds its own (base64) copy from here on - release the decoded PDF
+            attachment['message'] = self.create_tekup_message(attachment.pop('data'), attachment['filename'])
+            if attachment['message'] is None:
+                self.dedup.release(attachment['hash'])
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
+
+    def _send_stage(self, item):
+        """Pipeline stage: send the e-conomic emails within the Gmail quota"""
+        for attachment in item['attachments']:
+            msg = attachment.pop('message', None)
+            if msg is None:
+                continue
+            
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.send'])
+            if self.send_tekup_message(msg, attachment['filename']):
+                self.dedup.confirm(attachment['hash'])
+                self.stats.incr('forwarded')
+            else:
+                # Release the claim so the PDF can be sent on a later run
+                self.dedup.release(attachment['hash'])
+                logger.warning(f"TekUp: Failed to send: {attachment['filename']}")
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
+
+    def _label_stage(self, item):
+        """Pipeline stage: mark the email as processed by TekUp.
+        Emails with failed downloads, builds or sends are dead-lettered instead, so a
+        later run picks them up again.
+        """
+        if item['failed']:
+            self.dead_letter(item, f"Failed: {', '.join(item['failed'])}")
+            return None
+        self.mark_as_tekup_processed(item['id'])
+        self.stats.incr('processed')
+        return item
+
+    def dead_letter(self, item, reason):
+        """Record a failed email in the dead-letter queue"""
+        self.dead_letters.push(DEAD_LETTER_SOURCE, {'message_id': item['id']}, reason)
+        self.stats.incr('dead_lettered')
+
+    def dead_lettered_messages(self):
+        """The emails dead-lettered by earlier runs, in search result form"""
+        entries = self.dead_letters.claim(DEAD_LETTER_SOURCE)
+        message_ids = list(dict.fromkeys(e['message_id'] for e in entries if e.get('message_id')))
+        if message_ids:
+            logger.info(f"TekUp: Retrying {len(message_ids)} dead-lettered emails")
+        return [{'id': message_id} for message_id in message_ids]
+
+    def build_pipeline(self):
+        """Create the fetch -> decode -> build -> send -> label pipeline"""
+        workers = self.pipeline_workers
+        return Pipeline([
+            Stage('fetch', self._fetch_stage, workers['fetch']),
+            Stage('decode', self._decode_stage, workers['decode']),
+            Stage('build', self._build_stage, workers['build']),
+            Stage('send', self._send_stage, workers['send']),
+            Stage('label', self._label_stage, workers['label']),
+        ], queue_size=self.queue_size,
+            on_error=lambda stage, item, error: self.dead_letter(item, f"{stage}: {error}"))
+
+    async def run_tekup_forwarding_process(self, days_back=180, max_emails=10, page_size=DEFAULT_PAGE_SIZE):
         """Run the TekUp PDF forwarding process"""
         logger.info("=== TekUp Gmail PDF Forwarding Process Started ===")
         logger.info(f"Organization: {self.tekup_organization}")
@@ -272,81 +347,32 @@ Gmail PDF Automation System
         logger.info(f"Target: {self.tekup_economic_email}")
         
         # Create TekUp processed label
-        label_id = await self.create_tekup_processed_label()
+        await self.create_tekup_processed_label()
+        
+        # Search for emails with PDFs (streamed page by page, capped at max_emails)
+        messages = self.search_emails_with_pdfs(days_back, max_emails=max_emails, page_size=page_size)
+        logger.info(f"TekUp: Processing up to {max_emails} emails")
         
-        # Search for emails with PDFs
-        message_ids = await self.search_emails_with_pdfs(days_back)
+        # Rate limiting is handled by the shared quota token bucket inside the
+        # pipeline; the blocking Gmail calls run in worker threads
+        self.stats = Counters('processed', 'forwarded', 'duplicates', 'errors', 'dead_lettered')
+        pipeline = self.build_pipeline()
+        loop = asyncio.get_running_loop()
+        messages = itertools.chain(self.dead_lettered_messages(), messages)
+        result = await loop.run_in_executor(None, pipeline.run, messages)
+        # Retried emails leave the queue only now; new failures were queued again
+        self.dead_letters.release()
+        await loop.run_in_executor(None, self.flush_processed_labels)
         
-        if not message_ids:
+        found = sum(result.values())
+        if not found:
             logger.info("TekUp: No emails with PDF attachments found")
             return
         
-        # Process emails (limited to max_emails)
-        emails_to_process = message_ids[:max_emails]
-        logger.info(f"TekUp: Processing {len(emails_to_process)} emails (limited to {max_emails})")
-        
-        processed_count = 0
-        forwarded_pdfs = 0
-        duplicates = 0
-        errors = 0
-        
-        for i, msg_id in enumerate(emails_to_process, 1):
-            try:
-                logger.info(f"TekUp: Processing email {i}/{len(emails_to_process)}: {msg_id['id']}")
-                
-                # Get email details
-                email_data = await self.get_email_details(msg_id['id'])
-                if not email_data:
-                    logger.warning(f"TekUp: Could not get details for email {msg_id['id']}")
-                    continue
-                
-                logger.info(f"TekUp Email: {email_data['subject']}")
-                logger.info(f"TekUp From: {email_data['sender']}")
-                
-                # Extract PDF attachments
-                attachments = self._extract_pdf_attachments(email_data['payload'])
-                pdf_attachments = [att for att in attachments if att['mimeType'] == 'application/pdf']
-                
-                if not pdf_attachments:
-                    logger.warning(f"TekUp: No PDF attachments found in email {msg_id['id']}")
-                    continue
-                
-                logger.info(f"TekUp PDF attachments: {len(pdf_attachments)}")
-                
-                # Process each PDF attachment
-                for attachment in pdf_attachments:
-                    logger.info(f"TekUp: Processing PDF: {attachment['filename']} ({attachment['size']} bytes)")
-                    
-                    # Download PDF
-                    pdf_data = await self.download_attachment(msg_id['id'], attachment['id'])
-                    if pdf_data:
-                        # Forward to TekUp e-conomic
-                        result = await self.forward_pdf_to_tekup_economic(
-                            email_data, pdf_data, attachment['filename']
-                        )
-                        if result == "duplicate":
-                            duplicates += 1
-                            logger.info(f"TekUp: SKIPPED DUPLICATE: {attachment['filename']}")
-                        elif result == "success":
-                            forwarded_pdfs += 1
-                            logger.info(f"TekUp: Successfully sent: {attachment['filename']}")
-                        else:
-                            logger.warning(f"TekUp: Failed to send: {attachment['filename']}")
-                            errors += 1
-                    else:
-                        logger.error(f"TekUp: Failed to download: {attachment['filename']}")
-                        errors += 1
-                
-                # Mark as processed by TekUp
-                await self.mark_as_tekup_processed(msg_id['id'], label_id)
-                processed_count += 1
-                
-                # Rate limiting
-                await asyncio.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"ERROR: TekUp processing failed for email {msg_id['id']}: {e}")
-                errors += 1
+        processed_count = self.stats['processed']
+        forwarded_pdfs = self.stats['forwarded']
+        duplicates = self.stats['duplicates']
+        errors = self.stats['errors'] + result['failed']
         
         # TekUp Summary
         logger.info(f"\n=== TekUp Processing Complete ===")
@@ -355,6 +381,7 @@ Gmail PDF Automation System
         logger.info(f"Forwarded: {forwarded_pdfs} PDFs to e-conomic")
         logger.info(f"Duplicates: {duplicates} skipped")
         logger.info(f"Errors: {errors}")
+        logger.info(f"Dead-lettered: {self.stats['dead_lettered']} emails (retried next run)")
         print(f"\nTekUp SUCCESS: Processed {processed_count} emails, forwarded {forwarded_pdfs} PDFs, {duplicates} duplicates, {errors} errors")
 
 async def main():
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+e-conomic REST API client
+Async client med pooled keep-alive forbindelser til e-conomic REST API
+"""
+
+import asyncio
+import importlib.util
+import logging
+import os
+from typing import Any, Dict, Optional
+
+import httpx
+
+from src.utils.resilience import RETRYABLE_STATUS, acall, is_retry_safe
+
+logger = logging.getLogger(__name__)
+
+API_BASE_URL = "https://restapi.e-conomic.com"
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+class EconomicApiError(Exception):
+    """Non-success response from the e-conomic API"""
+
+    def __init__(self, status_code: int, message: str, retry_after: Optional[str] = None):
+        super().__init__(f"{status_code}: {message}")
+        self.status_code = status_code
+        self.message = message
+        self.retry_after = retry_after
+
+
+class EconomicClient:
+    """Async e-conomic client sharing one pooled connection per event loop.
+
+    The underlying ``httpx.AsyncClient`` is created on first use, keeps TLS
+    connections alive between requests and uses HTTP/2 when available.
+    ``max_concurrency`` caps requests in flight (ECONOMIC_MAX_CONCURRENCY).
+    429/5xx responses and connection errors are retried with backoff behind
+    a per-endpoint circuit breaker (see utils.resilience); POSTs create
+    records, so they are only retried on 429 or when no connection was made.
+    """
+
+    def __init__(self, app_secret_token: str, agreement_grant_token: str,
+                 base_url: str = API_BASE_URL,
+                 max_concurrency: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.base_url = base_url
+        self.headers = {
+            'X-AppSecretToken': app_secret_token,
+            'X-AgreementGrantToken': agreement_grant_token,
+            'Content-Type': 'application/json'
+        }
+        self.max_concurrency = max_concurrency or int(os.getenv('ECONOMIC_MAX_CONCURRENCY', '4'))
+        self.timeout = timeout or float(os.getenv('ECONOMIC_TIMEOUT', '30'))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    @classmethod
+    def from_config(cls, economic_config: Dict[str, Any]) -> 'EconomicClient':
+        """Create a client from an ``economic_config`` dict (tokens + optional settings)"""
+        return cls(
+            economic_config['app_secret_token'],
+            economic_config['agreement_grant_token'],
+            base_url=economic_config.get('base_url', API_BASE_URL),
+            max_concurrency=economic_config.get('max_concurrency'),
+            timeout=economic_config.get('timeout')
+        )
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                http2=HTTP2_AVAILABLE,
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                timeout=httpx.Timeout(self.timeout, connect=10.0)
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        """Send a request through the shared pool, bounded by ``max_concurrency``.
+
+        Transient failures are retried; if they persist the last one is raised
+        as EconomicApiError (or the underlying httpx error).
+        """
+        retry = is_retry_safe if method.upper() == 'POST' else None
+        return await acall(f"economic {method} {path}", self._send, method, path,
+                           retry=retry, **kwargs)
+
+    async def _send(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        client = self._get_client()
+        async with self._semaphore:
+            response = await client.request(method, path, **kwargs)
+        if response.status_code in RETRYABLE_STATUS:
+            raise EconomicApiError(response.status_code, response.text,
+                                   retry_after=response.headers.get('retry-after'))
+        return response
+
+    async def test_connection(self) -> bool:
+        """Return True if the tokens are accepted by the API"""
+        try:
+            response = await self.request('GET', '/customers', params={'pagesize': 1})
+        except EconomicApiError as e:
+            logger.error(f"e-conomic API connection failed - {e.status_code}")
+            return False
+        if response.status_code == 200:
+            return True
+        logger.error(f"e-conomic API connection failed - {response.status_code}")
+        return False
+
+    async def create_voucher(self, voucher_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Create a voucher; returns the created voucher or raises EconomicApiError"""
+        response = await self.request('POST', '/vouchers', json=voucher_data)
+        if response.status_code != 201:
+            raise EconomicApiError(response.status_code, response.text)
+        return response.json()
+
+    async def aclose(self) -> None:
+        """Close pooled connections (the client reconnects on next use)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._semaphore = None
+
+    async def __aenter__(self) -> 'EconomicClient':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
@@ -5,180 +5,154 @@ Automatisk PDF bilag forwarding med e-conomic API integration
 """
 
 import asyncio
+import itertools
 import logging
 import os
 import sys
 import base64
-import hashlib
 import json
-import requests
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.integrations.economic_client import EconomicApiError, EconomicClient
+from src.utils.attachment_data import decode_attachment
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import ATTACHMENTS, header, message_request
+from src.utils.gmail_http import execute
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import DEFAULT_PAGE_SIZE, iter_messages
+from src.utils.pipeline import (
+    GMAIL_QUOTA_COST,
+    GMAIL_QUOTA_UNITS_PER_SECOND,
+    Counters,
+    Pipeline,
+    Stage,
+    TokenBucket,
+    parse_workers,
+)
+from src.utils.resilience import DeadLetterQueue
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+DEFAULT_PIPELINE_WORKERS = {'fetch': 4, 'decode': 1, 'build': 1, 'send': 2, 'label': 1}
+DEAD_LETTER_SOURCE = 'economic_api_forwarder'
+
 class EconomicApiForwarder:
     def __init__(self, creds_file, token_file, economic_config):
         """Initialize Gmail e-conomic API Forwarder"""
         self.gmail_service = GmailService(creds_file, token_file)
         self.economic_config = economic_config
         self.processed_label = "Videresendt_econ"
-        self.sent_pdfs = set()  # Track sent PDFs to avoid duplicates
+        self.dedup = get_dedup_store()  # Persistent index of sent PDFs, shared across runs
+        self.dead_letters = DeadLetterQueue()  # Failed emails, retried on the next run
         
-        # e-conomic API configuration
-        self.api_base_url = "https://restapi.e-conomic.com"
-        self.headers = {
-            'X-AppSecretToken': economic_config['app_secret_token'],
-            'X-AgreementGrantToken': economic_config['agreement_grant_token'],
-            'Content-Type': 'application/json'
-        }
+        # e-conomic API client (pooled keep-alive connections, bounded concurrency)
+        self.economic = EconomicClient.from_config(economic_config)
+        self._loop = None
+        
+        # Pipeline configuration: workers per stage, queue size and Gmail quota (units/sec)
+        self.pipeline_workers = parse_workers(os.getenv('PIPELINE_WORKERS'), DEFAULT_PIPELINE_WORKERS)
+        self.queue_size = int(os.getenv('PIPELINE_QUEUE_SIZE', '10'))
+        self.rate_limiter = TokenBucket(
+            int(os.getenv('GMAIL_QUOTA_PER_SECOND', str(GMAIL_QUOTA_UNITS_PER_SECOND))))
+        self.stats = Counters('processed', 'forwarded', 'duplicates', 'errors', 'dead_lettered')
+        self.labels = LabelManager(self.gmail_service.service, self.gmail_service.user_email,
+                                   rate_limiter=self.rate_limiter)
         
         logger.info(f"Initialized Gmail e-conomic API Forwarder for {self.gmail_service.user_email}")
     
     async def test_economic_connection(self):
         """Test connection to e-conomic API"""
         try:
-            response = requests.get(f"{self.api_base_url}/customers", headers=self.headers)
-            if response.status_code == 200:
+            if await self.economic.test_connection():
                 logger.info("SUCCESS: Connected to e-conomic API")
                 return True
             else:
-                logger.error(f"FAILED: e-conomic API connection failed - {response.status_code}")
+                logger.error("FAILED: e-conomic API connection failed")
                 return False
         except Exception as e:
             logger.error(f"ERROR: e-conomic API connection failed - {e}")
             return False
     
-    async def create_economic_voucher(self, pdf_data, filename, description="PDF Bilag"):
+    def build_voucher(self, pdf_data, filename, description="PDF Bilag"):
+        """Build the voucher payload for a PDF, or None if it is too large"""
+        # Check file size (e-conomic API limit)
+        file_size_mb = len(pdf_data) / (1024 * 1024)
+        if file_size_mb > 10:
+            logger.warning(f"PDF {filename} is too large ({file_size_mb:.1f}MB), skipping")
+            return None
+        
+        return {
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "text": f"{description}: {filename}",
+            "voucherNumber": None,  # Let e-conomic assign number
+            "attachments": [
+                {
+                    "fileName": filename,
+                    "data": base64.b64encode(pdf_data).decode('utf-8')
+                }
+            ]
+        }
+
+    async def create_economic_voucher(self, voucher_data, filename):
         """Create a voucher in e-conomic with PDF attachment"""
         try:
-            # Create voucher entry
-            voucher_data = {
-                "date": datetime.now().strftime("%Y-%m-%d"),
-                "text": f"{description}: {filename}",
-                "voucherNumber": None,  # Let e-conomic assign number
-                "attachments": [
-                    {
-                        "fileName": filename,
-                        "data": base64.b64encode(pdf_data).decode('utf-8')
-                    }
-                ]
-            }
+            voucher = await self.economic.create_voucher(voucher_data)
+            voucher_id = voucher.get('voucherNumber')
+            logger.info(f"SUCCESS: Created e-conomic voucher {voucher_id} for {filename}")
+            return voucher_id
             
-            # Create voucher via API
-            response = requests.post(
-                f"{self.api_base_url}/vouchers",
-                headers=self.headers,
-                json=voucher_data
-            )
-            
-            if response.status_code == 201:
-                voucher_id = response.json().get('voucherNumber')
-                logger.info(f"SUCCESS: Created e-conomic voucher {voucher_id} for {filename}")
-                return voucher_id
-            else:
-                logger.error(f"FAILED: Could not create e-conomic voucher - {response.status_code}: {response.text}")
-                return None
-                
+        except EconomicApiError as e:
+            logger.error(f"FAILED: Could not create e-conomic voucher - {e}")
+            return None
         except Exception as e:
             logger.error(f"ERROR: Failed to create e-conomic voucher for {filename}: {e}")
             return None
     
-    def _generate_pdf_hash(self, pdf_data, filename):
-        """Generate a unique hash for PDF to detect duplicates"""
-        content_hash = hashlib.md5(pdf_data).hexdigest()
-        filename_hash = hashlib.md5(filename.encode()).hexdigest()
-        size_hash = hashlib.md5(str(len(pdf_data)).encode()).hexdigest()
-        combined_hash = hashlib.md5(f"{content_hash}_{filename_hash}_{size_hash}".encode()).hexdigest()
-        return combined_hash
-
-    async def forward_pdf_to_economic_api(self, email_data, pdf_data, filename):
-        """Forward PDF to e-conomic using API with duplicate detection"""
-        try:
-            # Generate unique hash for this PDF
-            pdf_hash = self._generate_pdf_hash(pdf_data, filename)
-            
-            # Check if we've already sent this PDF
-            if pdf_hash in self.sent_pdfs:
-                logger.info(f"SKIPPING DUPLICATE: {filename} (already sent)")
-                return "duplicate"
-            
-            # Check file size (e-conomic API limit)
-            file_size_mb = len(pdf_data) / (1024 * 1024)
-            if file_size_mb > 10:
-                logger.warning(f"PDF {filename} is too large ({file_size_mb:.1f}MB), skipping")
-                return None
-            
-            # Create voucher in e-conomic
-            voucher_id = await self.create_economic_voucher(pdf_data, filename)
-            
-            if voucher_id:
-                # Add to sent PDFs to prevent duplicates
-                self.sent_pdfs.add(pdf_hash)
-                logger.info(f"PDF {filename} ({file_size_mb:.1f}MB) uploaded to e-conomic voucher {voucher_id}")
-                return voucher_id
-            else:
-                logger.warning(f"Failed to upload {filename} to e-conomic")
-                return None
-                
-        except Exception as e:
-            logger.error(f"Error uploading PDF {filename} to e-conomic: {e}")
-            return None
+    async def _upload_vouchers(self, uploads):
+        """Upload several vouchers concurrently over the shared connection pool"""
+        return await asyncio.gather(*(
+            self.create_economic_voucher(voucher, attachment['filename'])
+            for attachment, voucher in uploads
+        ))
 
-    async def search_emails_with_pdfs(self, days_back=180):
-        """Search for emails with PDF attachments"""
+    def search_emails_with_pdfs(self, days_back=180, max_emails=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate emails with PDF attachments, fetching result pages lazily"""
         try:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
             
             query = f'has:attachment filename:pdf after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
+            logger.info(f"Searching for emails with PDF attachments from {start_date.strftime('%Y/%m/%d')} to {end_date.strftime('%Y/%m/%d')}")
             
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=50
-            ).execute()
-            
-            message_ids = response.get('messages', [])
-            logger.info(f"Found {len(message_ids)} emails with PDF attachments from {start_date.strftime('%Y/%m/%d')} to {end_date.strftime('%Y/%m/%d')}")
-            return message_ids
+            yield from iter_messages(
+                self.gmail_service.service,
+                query,
+                page_size=page_size,
+                limit=max_emails
+            )
             
         except Exception as e:
             logger.error(f"Error searching emails: {e}")
-            return []
 
-    async def get_email_details(self, message_id):
+    def get_email_details(self, message_id):
         """Get detailed email information"""
         try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
-            
-            headers = message.get('payload', {}).get('headers', [])
-            subject = ''
-            sender = ''
-            
-            for header in headers:
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                elif header['name'] == 'From':
-                    sender = header['value']
+            # Attachment structure only - bodies are downloaded separately
+            message = execute(message_request(self.gmail_service.service, message_id, ATTACHMENTS))
             
             return {
                 'id': message_id,
-                'subject': subject,
-                'sender': sender,
+                'subject': header(message, 'Subject'),
+                'sender': header(message, 'From'),
                 'payload': message.get('payload', {})
             }
             
@@ -211,19 +185,15 @@ class EconomicApiForwarder:
         extract_from_part(payload)
         return attachments
 
-    async def download_attachment(self, message_id, attachment_id):
-        """Download attachment from Gmail"""
+    def fetch_attachment(self, message_id, attachment_id):
+        """Fetch the raw (base64url) attachment data from Gmail"""
         try:
-            attachment = self.gmail_service.service.users().messages().attachments().get(
+            attachment = execute(self.gmail_service.service.users().messages().attachments().get(
                 userId='me',
                 messageId=message_id,
                 id=attachment_id
-            ).execute()
-            
-            data = attachment.get('data')
-            if data:
-                return base64.urlsafe_b64decode(data)
-            return None
+            ))
+            return attachment.get('data')
             
         except Exception as e:
             logger.error(f"Error downloading attachment {attachment_id}: {e}")
@@ -232,134 +202,200 @@ class EconomicApiForwarder:
     async def create_processed_label(self):
         """Create or get processed label"""
         try:
-            # Check if label exists
-            labels = self.gmail_service.service.users().labels().list(userId='me').execute()
-            for label in labels.get('labels', []):
-                if label['name'] == self.processed_label:
-                    logger.info(f"Using existing label: {self.processed_label} (ID: {label['id']})")
-                    return label['id']
-            
-            # Create new label
-            label_body = {
-                'name': self.processed_label,
-                'labelListVisibility': 'labelShow',
-                'messageListVisibility': 'show'
-            }
-            
-            created_label = self.gmail_service.service.users().labels().create(
-                userId='me',
-                body=label_body
-            ).execute()
-            
-            logger.info(f"Created new label: {self.processed_label} (ID: {created_label['id']})")
-            return created_label['id']
+            label_id = self.labels.label_id(self.processed_label)
+            logger.info(f"Using label: {self.processed_label} (ID: {label_id})")
+            return label_id
             
         except Exception as e:
             logger.error(f"Error creating label: {e}")
             return None
 
-    async def mark_as_processed(self, message_id, label_id):
-        """Mark email as processed"""
+    def mark_as_processed(self, message_id):
+        """Queue email to be marked as processed (applied in bulk by flush_processed_labels)"""
+        self.labels.add(message_id, self.processed_label)
+
+    def flush_processed_labels(self):
+        """Apply all queued processed labels with batchModify (up to 1000 messages per call)"""
         try:
-            if label_id:
-                self.gmail_service.service.users().messages().modify(
-                    userId='me',
-                    id=message_id,
-                    body={'addLabelIds': [label_id]}
-                ).execute()
-                logger.info(f"Marked message {message_id} as processed")
-            else:
-                logger.warning(f"Could not mark message {message_id} as processed - no label ID")
+            labelled = self.labels.flush()
+            if labelled:
+                logger.info(f"Marked {labelled} messages as processed")
         except Exception as e:
-            logger.error(f"Error marking message {message_id} as processed: {e}")
+            logger.error(f"Error marking messages as processed: {e}")
+
+    def _fetch_stage(self, item):
+        """Pipeline stage: fetch email details and raw PDF attachment data"""
+        msg_id = item['id']
+        self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.get'])
+        email_data = self.get_email_details(msg_id)
+        if not email_data:
+            logger.warning(f"Could not get details for email {msg_id}")
+            self.dead_letter(item, 'Could not get email details')
+            return None
+        
+        logger.info(f"Email: {email_data['subject']}")
+        logger.info(f"From: {email_data['sender']}")
+        
+        pdf_attachments = self._extract_pdf_attachments(email_data['payload'])
+        if not pdf_attachments:
+            # Still labelled, so the email is not listed and fetched again on every run
+            logger.warning(f"No PDF attachments found in email {msg_id}")
+            return {'id': msg_id, 'attachments': [], 'failed': []}
+        
+        logger.info(f"PDF attachments: {len(pdf_attachments)}")
+        
+        for attachment in pdf_attachments:
+            logger.info(f"Processing PDF: {attachment['filename']} ({attachment['size']} bytes)")
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['attachments.get'])
+            attachment['raw'] = self.fetch_attachment(msg_id, attachment['id'])
+        
+        return {'id': msg_id, 'attachments': pdf_attachments, 'failed': []}
+
+    def _decode_stage(self, item):
+        """Pipeline stage: decode downloaded attachments, hashing them in the same pass"""
+        for attachment in item['attachments']:
+            raw = attachment.pop('raw')
+            if raw:
+                attachment['data'] = decode_attachment(raw)
+            else:
+                logger.error(f"Failed to download: {attachment['filename']}")
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
+
+    def _build_stage(self, item):
+        """Pipeline stage: skip duplicates and build the voucher payloads"""
+        for attachment in item['attachments']:
+            if 'data' not in attachment:
+                continue
+            
+            # Claim the digest up front so parallel upload workers - and other
+            # runs or processes - never upload the same PDF twice
+            attachment['hash'] = content_digest(attachment['data'])
+            if not self.dedup.claim(attachment['hash'], attachment['filename'], self.processed_label):
+                self.stats.incr('duplicates')
+                logger.info(f"SKIPPED DUPLICATE: {attachment['filename']}")
+                continue
+            
+            attachment['voucher'] = self.build_voucher(attachment.pop('data'), attachment['filename'])
+            if attachment['voucher'] is None:
+                self.dedup.release(attachment['hash'])
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
+
+    def _send_stage(self, item):
+        """Pipeline stage: upload the vouchers to e-conomic on the event loop"""
+        uploads = []
+        for attachment in item['attachments']:
+            voucher = attachment.pop('voucher', None)
+            if voucher is not None:
+                uploads.append((attachment, voucher))
+        if not uploads:
+            return item
+        
+        # The async client lives on the main event loop, which is free while
+        # the pipeline runs in the executor - hand the uploads over to it
+        voucher_ids = asyncio.run_coroutine_threadsafe(
+            self._upload_vouchers(uploads), self._loop).result()
+        
+        for (attachment, _), voucher_id in zip(uploads, voucher_ids):
+            if voucher_id:
+                self.dedup.confirm(attachment['hash'])
+                self.stats.incr('forwarded')
+                logger.info(f"Successfully uploaded: {attachment['filename']} (Voucher: {voucher_id})")
+            else:
+                # Release the claim so the PDF can be uploaded on a later run
+                self.dedup.release(attachment['hash'])
+                logger.warning(f"Failed to upload: {attachment['filename']}")
+                self.stats.incr('errors')
+                item['failed'].append(attachment['filename'])
+        return item
 
-    async def run_forwarding_process(self, days_back=180, max_emails=10):
+    def _label_stage(self, item):
+        """Pipeline stage: mark the email as processed.
+        Emails with failed downloads, builds or sends are dead-lettered instead, so a
+        later run picks them up again.
+        """
+        if item['failed']:
+            self.dead_letter(item, f"Failed: {', '.join(item['failed'])}")
+            return None
+        self.mark_as_processed(item['id'])
+        self.stats.incr('processed')
+        return item
+
+    def dead_letter(self, item, reason):
+        """Record a failed email in the dead-letter queue"""
+        self.dead_letters.push(DEAD_LETTER_SOURCE, {'message_id': item['id']}, reason)
+        self.stats.incr('dead_lettered')
+
+    def dead_lettered_messages(self):
+        """The emails dead-lettered by earlier runs, in search result form"""
+        entries = self.dead_letters.claim(DEAD_LETTER_SOURCE)
+        message_ids = list(dict.fromkeys(e['message_id'] for e in entries if e.get('message_id')))
+        if message_ids:
+            logger.info(f"Retrying {len(message_ids)} dead-lettered emails")
+        return [{'id': message_id} for message_id in message_ids]
+
+    def build_pipeline(self):
+        """Create the fetch -> decode -> build -> send -> label pipeline"""
+        workers = self.pipeline_workers
+        return Pipeline([
+            Stage('fetch', self._fetch_stage, workers['fetch']),
+            Stage('decode', self._decode_stage, workers['decode']),
+            Stage('build', self._build_stage, workers['build']),
+            Stage('send', self._send_stage, workers['send']),
+            Stage('label', self._label_stage, workers['label']),
+        ], queue_size=self.queue_size,
+            on_error=lambda stage, item, error: self.dead_letter(item, f"{stage}: {error}"))
+
+    async def run_forwarding_process(self, days_back=180, max_emails=10, page_size=DEFAULT_PAGE_SIZE):
         """Run the PDF forwarding process with e-conomic API"""
         logger.info("Starting Gmail e-conomic API PDF Forwarding process...")
         
+        try:
+            await self._run_forwarding_process(days_back, max_emails, page_size)
+        finally:
+            await self.economic.aclose()
+
+    async def _run_forwarding_process(self, days_back, max_emails, page_size):
         # Test e-conomic connection
         if not await self.test_economic_connection():
             logger.error("Cannot connect to e-conomic API. Please check configuration.")
             return
         
         # Create processed label
-        label_id = await self.create_processed_label()
+        await self.create_processed_label()
+        
+        # Search for emails with PDFs (streamed page by page, capped at max_emails)
+        messages = self.search_emails_with_pdfs(days_back, max_emails=max_emails, page_size=page_size)
+        logger.info(f"Processing up to {max_emails} emails")
         
-        # Search for emails with PDFs
-        message_ids = await self.search_emails_with_pdfs(days_back)
+        # Rate limiting is handled by the shared quota token bucket inside the
+        # pipeline; the blocking Gmail calls run in worker threads while the
+        # voucher uploads run concurrently on this event loop
+        self.stats = Counters('processed', 'forwarded', 'duplicates', 'errors', 'dead_lettered')
+        pipeline = self.build_pipeline()
+        self._loop = asyncio.get_running_loop()
+        messages = itertools.chain(self.dead_lettered_messages(), messages)
+        result = await self._loop.run_in_executor(None, pipeline.run, messages)
+        # Retried emails leave the queue only now; new failures were queued again
+        self.dead_letters.release()
+        await self._loop.run_in_executor(None, self.flush_processed_labels)
         
-        if not message_ids:
+        if not sum(result.values()):
             logger.info("No emails with PDF attachments found")
             return
         
-        # Process emails (limited to max_emails)
-        emails_to_process = message_ids[:max_emails]
-        logger.info(f"Processing {len(emails_to_process)} emails (limited to {max_emails})")
-        
-        processed_count = 0
-        forwarded_pdfs = 0
-        errors = 0
-        
-        for i, msg_id in enumerate(emails_to_process, 1):
-            try:
-                logger.info(f"Processing email {i}/{len(emails_to_process)}: {msg_id['id']}")
-                
-                # Get email details
-                email_data = await self.get_email_details(msg_id['id'])
-                if not email_data:
-                    logger.warning(f"Could not get details for email {msg_id['id']}")
-                    continue
-                
-                logger.info(f"Email: {email_data['subject']}")
-                logger.info(f"From: {email_data['sender']}")
-                
-                # Extract PDF attachments
-                attachments = self._extract_pdf_attachments(email_data['payload'])
-                pdf_attachments = [att for att in attachments if att['mimeType'] == 'application/pdf']
-                
-                if not pdf_attachments:
-                    logger.warning(f"No PDF attachments found in email {msg_id['id']}")
-                    continue
-                
-                logger.info(f"PDF attachments: {len(pdf_attachments)}")
-                
-                # Process each PDF attachment
-                for attachment in pdf_attachments:
-                    logger.info(f"Processing PDF: {attachment['filename']} ({attachment['size']} bytes)")
-                    
-                    # Download PDF
-                    pdf_data = await self.download_attachment(msg_id['id'], attachment['id'])
-                    if pdf_data:
-                        # Forward to e-conomic via API
-                        voucher_id = await self.forward_pdf_to_economic_api(
-                            email_data, pdf_data, attachment['filename']
-                        )
-                        if voucher_id == "duplicate":
-                            logger.info(f"SKIPPED DUPLICATE: {attachment['filename']}")
-                        elif voucher_id:
-                            forwarded_pdfs += 1
-                            logger.info(f"Successfully uploaded: {attachment['filename']} (Voucher: {voucher_id})")
-                        else:
-                            logger.warning(f"Failed to upload: {attachment['filename']}")
-                            errors += 1
-                    else:
-                        logger.error(f"Failed to download: {attachment['filename']}")
-                        errors += 1
-                
-                # Mark as processed
-                await self.mark_as_processed(msg_id['id'], label_id)
-                processed_count += 1
-                
-                # Rate limiting
-                await asyncio.sleep(1)
-                
-            except Exception as e:
-                logger.error(f"Error processing email {msg_id['id']}: {e}")
-                errors += 1
+        processed_count = self.stats['processed']
+        forwarded_pdfs = self.stats['forwarded']
+        errors = self.stats['errors'] + result['failed']
         
         # Summary
         logger.info(f"\nSUCCESS: Processed {processed_count} emails, uploaded {forwarded_pdfs} PDFs to e-conomic, {errors} errors")
         print(f"\nSUCCESS: Processed {processed_count} emails, uploaded {forwarded_pdfs} PDFs to e-conomic, {errors} errors")
+        if self.stats['dead_lettered']:
+            logger.warning(f"{self.stats['dead_lettered']} emails dead-lettered - they are retried on the next run")
 
 async def main():
     """Main function"""
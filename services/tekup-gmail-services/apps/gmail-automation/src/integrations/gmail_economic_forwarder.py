@@ -8,31 +8,50 @@ import os
 import sys
 import logging
 from datetime import datetime, timedelta
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
-import base64
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.attachment_data import decode_attachment
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import ATTACHMENTS, get_message, header
+from src.utils.gmail_http import execute
+from src.utils.gmail_labels import LabelManager
+from src.utils.gmail_paging import DEFAULT_PAGE_SIZE, iter_messages
+from src.utils.mime_builder import Attachment, MessageTemplate, encode_attachment, send_raw
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Simple forward format that e-conomic can parse
+FORWARD_TEMPLATE = MessageTemplate('PDF Bilag: {subject}', """PDF bilag videresendt fra Gmail.
+
+Original email:
+Fra: {sender}
+Emne: {subject}
+Dato: {date}
+PDF fil: {filename}
+
+Automatisk videresendt af Gmail PDF Forwarder.
+""")
+
 class GmailEconomicForwarder:
     def __init__(self, creds_file, token_file, economic_email):
         """Initialize Gmail e-conomic Forwarder"""
         self.gmail_service = GmailService(creds_file, token_file)
         self.economic_email = economic_email
         self.processed_label = "Videresendt_econ"
-        self.sent_pdfs = set()  # Track sent PDFs to avoid duplicates
+        self.dedup = get_dedup_store()  # Persistent index of sent PDFs, shared across runs
+        self.labels = LabelManager(self.gmail_service.service, self.gmail_service.user_email)
         logger.info(f"Initialized Gmail e-conomic Forwarder for {self.gmail_service.user_email}")
     
-    async def search_emails_with_pdfs(self, days_back=180):
-        """Search for emails with PDF attachments"""
+    def search_emails_with_pdfs(self, days_back=180, max_emails=None, page_size=DEFAULT_PAGE_SIZE):
+        """Iterate emails with PDF attachments, fetching result pages lazily"""
         try:
             end_date = datetime.now()
             start_date = end_date - timedelta(days=days_back)
@@ -45,38 +64,28 @@ class GmailEconomicForwarder:
             
             logger.info(f"Searching for emails with PDFs from {start_date_str} to {end_date_str}")
             
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=50  # Limit to prevent timeout
-            ).execute()
-            
-            message_ids = response.get('messages', [])
-            logger.info(f"Found {len(message_ids)} emails with PDF attachments")
-            
-            return message_ids
+            yield from iter_messages(
+                self.gmail_service.service,
+                query,
+                page_size=page_size,
+                limit=max_emails
+            )
             
         except Exception as e:
             logger.error(f"Error searching emails: {e}")
-            return []
     
     async def get_email_details(self, message_id):
         """Get email details with attachments"""
         try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
+            # Attachment structure only - bodies are downloaded separately
+            message = get_message(self.gmail_service.service, message_id, ATTACHMENTS)
             
-            # Extract headers
-            headers = message.get('payload', {}).get('headers', [])
             email_data = {
                 'id': message['id'],
                 'threadId': message['threadId'],
-                'subject': next((h['value'] for h in headers if h['name'] == 'Subject'), 'No Subject'),
-                'from': next((h['value'] for h in headers if h['name'] == 'From'), 'Unknown'),
-                'date': next((h['value'] for h in headers if h['name'] == 'Date'), 'Unknown'),
+                'subject': header(message, 'Subject', 'No Subject'),
+                'from': header(message, 'From', 'Unknown'),
+                'date': header(message, 'Date', 'Unknown'),
                 'attachments': []
             }
             
@@ -119,157 +128,106 @@ class GmailEconomicForwarder:
     async def download_attachment(self, message_id, attachment_id):
         """Download attachment from Gmail"""
         try:
-            attachment = self.gmail_service.service.users().messages().attachments().get(
+            attachment = execute(self.gmail_service.service.users().messages().attachments().get(
                 userId='me',
                 messageId=message_id,
                 id=attachment_id
-            ).execute()
+            ))
             
             data = attachment.get('data')
             if data:
-                return base64.urlsafe_b64decode(data)
+                return decode_attachment(data)
             return None
             
         except Exception as e:
             logger.error(f"Error downloading attachment {attachment_id}: {e}")
             return None
     
-    def _generate_pdf_hash(self, pdf_data, filename):
-        """Generate a unique hash for PDF to detect duplicates"""
-        import hashlib
-        # Create hash based on content + filename + size
-        content_hash = hashlib.md5(pdf_data).hexdigest()
-        filename_hash = hashlib.md5(filename.encode()).hexdigest()
-        size_hash = hashlib.md5(str(len(pdf_data)).encode()).hexdigest()
-        
-        # Combine all hashes for unique identification
-        combined_hash = hashlib.md5(f"{content_hash}_{filename_hash}_{size_hash}".encode()).hexdigest()
-        return combined_hash
-
     async def forward_pdf_to_economic(self, email_data, pdf_data, filename):
         """Forward PDF to e-conomic with optimized formatting and duplicate detection"""
+        pdf_hash = None
         try:
-            # Generate unique hash for this PDF
-            pdf_hash = self._generate_pdf_hash(pdf_data, filename)
-            
-            # Check if we've already sent this PDF
-            if pdf_hash in self.sent_pdfs:
-                logger.info(f"SKIPPING DUPLICATE: {filename} (already sent)")
-                return "duplicate"
-            
             # Check file size
             file_size_mb = len(pdf_data) / (1024 * 1024)
             if file_size_mb > 10:
                 logger.warning(f"PDF {filename} is too large ({file_size_mb:.1f}MB), skipping")
                 return None
             
+            # Claim this PDF's content so it is never sent twice, across runs and processes
+            pdf_hash = content_digest(pdf_data)
+            if not self.dedup.claim(pdf_hash, filename, self.processed_label):
+                logger.info(f"SKIPPING DUPLICATE: {filename} (already sent)")
+                return "duplicate"
+            
             # Clean filename for e-conomic
             clean_filename = filename.replace(' ', '_').replace('(', '').replace(')', '').replace('/', '_').replace('\\', '_')
             if not clean_filename.endswith('.pdf'):
                 clean_filename += '.pdf'
             
             # Create email with e-conomic optimized format
-            msg = MIMEMultipart()
-            msg['From'] = self.gmail_service.user_email
-            msg['To'] = self.economic_email
-            msg['Subject'] = f"PDF Bilag: {email_data['subject']}"
-            
-            # Simple body that e-conomic can parse
-            body = f"""PDF bilag videresendt fra Gmail.
-
-Original email:
-Fra: {email_data['from']}
-Emne: {email_data['subject']}
-Dato: {email_data['date']}
-PDF fil: {clean_filename}
-
-Automatisk videresendt af Gmail PDF Forwarder.
-"""
-            msg.attach(MIMEText(body, 'plain', 'utf-8'))
-            
-            # Attach PDF with e-conomic compatible headers
-            pdf_attachment = MIMEBase('application', 'pdf')
-            pdf_attachment.set_payload(pdf_data)
-            encoders.encode_base64(pdf_attachment)
-            
-            # Use headers that e-conomic can definitely read
-            pdf_attachment.add_header('Content-Disposition', f'attachment; filename="{clean_filename}"')
-            pdf_attachment.add_header('Content-Type', 'application/pdf')
-            pdf_attachment.add_header('Content-Transfer-Encoding', 'base64')
-            
-            msg.attach(pdf_attachment)
+            message = FORWARD_TEMPLATE.render(
+                self.gmail_service.user_email, self.economic_email,
+                [Attachment(clean_filename, encode_attachment(pdf_data))],
+                subject=email_data['subject'],
+                sender=email_data['from'],
+                date=email_data['date'],
+                filename=clean_filename)
             
             # Send email
-            raw_message = base64.urlsafe_b64encode(msg.as_bytes()).decode()
-            send_message = self.gmail_service.service.users().messages().send(
-                userId='me',
-                body={'raw': raw_message}
-            ).execute()
+            send_message = send_raw(self.gmail_service.service, message)
             
-            # Add to sent PDFs to prevent duplicates
-            self.sent_pdfs.add(pdf_hash)
+            self.dedup.confirm(pdf_hash)
             
             logger.info(f"PDF {clean_filename} ({file_size_mb:.1f}MB) forwarded to {self.economic_email}")
             return send_message['id']
             
         except Exception as e:
+            if pdf_hash:
+                self.dedup.release(pdf_hash)
             logger.error(f"Error forwarding PDF {filename}: {e}")
             return None
     
     async def create_processed_label(self):
         """Create processed label if it doesn't exist"""
         try:
-            labels = self.gmail_service.service.users().labels().list(userId='me').execute()
-            label_exists = any(label['name'] == self.processed_label for label in labels.get('labels', []))
-            
-            if not label_exists:
-                label_body = {
-                    'name': self.processed_label,
-                    'labelListVisibility': 'labelShow',
-                    'messageListVisibility': 'show'
-                }
-                created_label = self.gmail_service.service.users().labels().create(
-                    userId='me',
-                    body=label_body
-                ).execute()
-                logger.info(f"Created label: {self.processed_label} (ID: {created_label['id']})")
-                return created_label['id']
-            else:
-                # Find existing label ID
-                for label in labels.get('labels', []):
-                    if label['name'] == self.processed_label:
-                        logger.info(f"Using existing label: {self.processed_label} (ID: {label['id']})")
-                        return label['id']
+            label_id = self.labels.label_id(self.processed_label)
+            logger.info(f"Using label: {self.processed_label} (ID: {label_id})")
+            return label_id
             
         except Exception as e:
             logger.error(f"Error creating label: {e}")
             return None
     
-    async def mark_as_processed(self, message_id, label_id):
-        """Mark email as processed"""
+    async def mark_as_processed(self, message_id):
+        """Queue email to be marked as processed (applied in bulk by flush_processed_labels)"""
+        self.labels.add(message_id, self.processed_label)
+    
+    async def flush_processed_labels(self):
+        """Apply all queued processed labels with batchModify"""
         try:
-            if label_id:
-                self.gmail_service.service.users().messages().modify(
-                    userId='me',
-                    id=message_id,
-                    body={'addLabelIds': [label_id]}
-                ).execute()
-                logger.info(f"Marked message {message_id} as processed")
-            else:
-                logger.warning(f"Could not mark message {message_id} as processed - no label ID")
+            labelled = self.labels.flush()
+            if labelled:
+                logger.info(f"Marked {labelled} messages as processed")
         except Exception as e:
-            logger.error(f"Error marking message {message_id} as processed: {e}")
+            logger.error(f"Error marking messages as processed: {e}")
     
     async def load_sent_pdfs(self):
-        """Load already sent PDFs from sent emails to prevent duplicates"""
+        """Seed the dedup store from emails already sent to e-conomic.
+        
+        Only needed once: after the first run the store persists every sent PDF.
+        """
+        if len(self.dedup):
+            logger.info(f"Dedup store holds {len(self.dedup)} previously sent PDFs")
+            return
+        
         try:
             # Search for emails sent to e-conomic in the last 30 days
             query = f'to:{self.economic_email} after:2025/09/01'
-            response = self.gmail_service.service.users().messages().list(
+            response = execute(self.gmail_service.service.users().messages().list(
                 userId='me',
                 q=query,
                 maxResults=100
-            ).execute()
+            ))
             
             sent_message_ids = response.get('messages', [])
             logger.info(f"Found {len(sent_message_ids)} previously sent emails to e-conomic")
@@ -277,11 +235,7 @@ Automatisk videresendt af Gmail PDF Forwarder.
             # Extract PDF hashes from sent emails
             for msg_id in sent_message_ids:
                 try:
-                    message = self.gmail_service.service.users().messages().get(
-                        userId='me',
-                        id=msg_id['id'],
-                        format='full'
-                    ).execute()
+                    message = get_message(self.gmail_service.service, msg_id['id'], ATTACHMENTS)
                     
                     # Extract PDF attachments from sent emails
                     attachments = self._extract_pdf_attachments(message.get('payload', {}))
@@ -290,45 +244,39 @@ Automatisk videresendt af Gmail PDF Forwarder.
                             # Download and hash the PDF
                             pdf_data = await self.download_attachment(msg_id['id'], attachment['id'])
                             if pdf_data:
-                                pdf_hash = self._generate_pdf_hash(pdf_data, attachment['filename'])
-                                self.sent_pdfs.add(pdf_hash)
+                                self.dedup.add(content_digest(pdf_data), attachment['filename'], self.processed_label)
                                 logger.debug(f"Loaded sent PDF hash: {attachment['filename']}")
                 except Exception as e:
                     logger.debug(f"Could not process sent email {msg_id['id']}: {e}")
             
-            logger.info(f"Loaded {len(self.sent_pdfs)} previously sent PDF hashes")
+            logger.info(f"Loaded {len(self.dedup)} previously sent PDF hashes")
             
         except Exception as e:
             logger.warning(f"Could not load sent PDFs: {e}")
 
-    async def run_forwarding_process(self, days_back=180, max_emails=10):
+    async def run_forwarding_process(self, days_back=180, max_emails=10, page_size=DEFAULT_PAGE_SIZE):
         """Run the PDF forwarding process with limits"""
         logger.info("Starting Gmail e-conomic PDF Forwarding process...")
         
         # Load previously sent PDFs to avoid duplicates
         await self.load_sent_pdfs()
         
-        # Create processed label
-        label_id = await self.create_processed_label()
-        
-        # Search for emails with PDFs
-        message_ids = await self.search_emails_with_pdfs(days_back)
-        
-        if not message_ids:
-            logger.info("No emails with PDF attachments found")
-            return
+        # Resolve processed label up front
+        await self.create_processed_label()
         
-        # Limit processing to prevent overload
-        message_ids = message_ids[:max_emails]
-        logger.info(f"Processing {len(message_ids)} emails (limited to {max_emails})")
+        # Search for emails with PDFs (streamed page by page, capped at max_emails)
+        messages = self.search_emails_with_pdfs(days_back, max_emails=max_emails, page_size=page_size)
+        logger.info(f"Processing up to {max_emails} emails")
         
         processed_count = 0
         forwarded_pdfs = 0
         errors = 0
+        found = 0
         
-        for i, msg_id in enumerate(message_ids, 1):
+        for i, msg_id in enumerate(messages, 1):
+            found = i
             try:
-                logger.info(f"Processing email {i}/{len(message_ids)}: {msg_id['id']}")
+                logger.info(f"Processing email {i}/{max_emails}: {msg_id['id']}")
                 
                 # Get email details
                 email_data = await self.get_email_details(msg_id['id'])
@@ -365,16 +313,18 @@ Automatisk videresendt af Gmail PDF Forwarder.
                             errors += 1
                 
                 # Mark as processed
-                await self.mark_as_processed(msg_id['id'], label_id)
+                await self.mark_as_processed(msg_id['id'])
                 processed_count += 1
                 
-                # Small delay to prevent rate limiting
-                await asyncio.sleep(1)
-                
             except Exception as e:
                 logger.error(f"Error processing message {msg_id['id']}: {e}")
                 errors += 1
         
+        await self.flush_processed_labels()
+        
+        if not found:
+            logger.info("No emails with PDF attachments found")
+        
         logger.info(f"Processed {processed_count} emails, forwarded {forwarded_pdfs} PDFs, {errors} errors")
         return processed_count, forwarded_pdfs, errors
 
@@ -7,26 +7,32 @@ Automatisk hentning og behandling af kvitteringsbilleder fra Google Photos
 import asyncio
 import sys
 import os
-import io
 import json
 from datetime import datetime, timedelta
-from PIL import Image
 import requests
 import base64
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import FULL, get_message, header
+from src.utils.image_pdf import ImageConverter
+
 class AutomatedPhotosProcessor:
     def __init__(self, creds_file, token_file):
         """Initialize Gmail service for sending receipts"""
         self.gmail_service = GmailService(creds_file, token_file)
-        self.processed_photos = set()
+        self.dedup = get_dedup_store()  # Persistent index of sent receipts, shared across runs
+        self.converter = ImageConverter()  # PDF conversion in worker processes (IMAGE_CONVERT_WORKERS)
         self.sent_count = 0
         self.error_count = 0
         
@@ -56,11 +62,8 @@ class AutomatedPhotosProcessor:
             
             for msg_id in message_ids[:20]:  # Limit to first 20
                 try:
-                    message = self.gmail_service.service.users().messages().get(
-                        userId='me',
-                        id=msg_id['id'],
-                        format='full'
-                    ).execute()
+                    # Body text is needed to find the photo links
+                    message = get_message(self.gmail_service.service, msg_id['id'], FULL)
                     
                     # Extract photo links from email body
                     payload = message.get('payload', {})
@@ -69,8 +72,8 @@ class AutomatedPhotosProcessor:
                     if body and ('photos.google.com' in body or 'drive.google.com' in body):
                         photo_links.append({
                             'id': msg_id['id'],
-                            'subject': self._get_header(message, 'Subject'),
-                            'date': self._get_header(message, 'Date'),
+                            'subject': header(message, 'Subject'),
+                            'date': header(message, 'Date'),
                             'body': body
                         })
                         
@@ -107,14 +110,6 @@ class AutomatedPhotosProcessor:
         
         return body
     
-    def _get_header(self, message, header_name):
-        """Get email header value"""
-        headers = message.get('payload', {}).get('headers', [])
-        for header in headers:
-            if header['name'] == header_name:
-                return header['value']
-        return ""
-    
     async def process_receipt_photos_from_links(self, photo_links):
         """Process receipt photos from found links"""
         print("=== BEHANDLER KVITTERINGSBILEDER ===")
@@ -158,6 +153,7 @@ class AutomatedPhotosProcessor:
     
     async def _process_single_photo(self, photo_url, filename_base):
         """Process a single photo URL"""
+        digest = None
         try:
             print(f"Processing photo: {photo_url[:50]}...")
             
@@ -167,27 +163,30 @@ class AutomatedPhotosProcessor:
                 print(f"Failed to download photo: {response.status_code}")
                 return
             
-            # Convert to PDF
-            image = Image.open(io.BytesIO(response.content))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Skip photos already sent (the rendered PDF differs per run, so key on the image)
+            digest = content_digest(response.content)
+            if not self.dedup.claim(digest, filename_base, 'automated_photos'):
+                print(f"SKIPPING DUPLICATE: {filename_base} (already sent)")
+                return
             
-            # Create PDF
-            pdf_buffer = io.BytesIO()
-            image.save(pdf_buffer, format='PDF')
-            pdf_data = pdf_buffer.getvalue()
+            # Convert to PDF in a worker process
+            pdf_data = await self.converter.convert(response.content)
             
             # Send to e-conomic
             filename = f"{filename_base}_receipt.pdf"
             success = await self._send_to_economic(pdf_data, filename)
             
             if success:
+                self.dedup.confirm(digest)
                 self.sent_count += 1
                 print(f"SUCCESS: Sent {filename} to e-conomic")
             else:
+                self.dedup.release(digest)
                 self.error_count += 1
                 
         except Exception as e:
+            if digest:
+                self.dedup.release(digest)
             print(f"Error processing photo: {e}")
             self.error_count += 1
     
@@ -248,13 +247,17 @@ Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
             return
         
         # Process photos
-        await self.process_receipt_photos_from_links(photo_links)
+        try:
+            await self.process_receipt_photos_from_links(photo_links)
+        finally:
+            self.converter.close()
         
         # Summary
         print(f"\n=== PROCESSING COMPLETE ===")
         print(f"Processed links: {len(photo_links)}")
         print(f"Sent to e-conomic: {self.sent_count}")
         print(f"Errors: {self.error_count}")
+        print(f"Images: {self.converter.stats}")
 
 async def main():
     """Main function"""
@@ -0,0 +1,212 @@
+"""
+Data-driven vendor categorizer for bank-statement texts.
+
+Vendor rules live in a JSON file (``vendor_rules.json`` next to this module,
+or VENDOR_RULES_FILE), so adding a vendor or a spelling is a config change.
+Every pattern of every rule is compiled into one regex - a trie of the
+patterns, so scanning costs the text length rather than the number of rules -
+with word boundaries, so ``ok`` no longer matches inside "booking". A whole
+column of texts is scanned in one pass. Each match is mapped back to its rule, and
+the rule listed first in the file wins when a text matches several; generic
+payment-type prefixes (MCD, LS, BS) therefore sit last, as fallbacks behind
+the actual vendors.
+
+Rules file format::
+
+    {
+      "categories": {"fuel": "Benzin", ...},
+      "default": {"vendor": "unknown", "name": "Ukategoriseret", "category": "uncategorized"},
+      "vendors": [
+        {"vendor": "circle_k", "name": "Circle K", "category": "fuel",
+         "patterns": ["circle k"]},
+        {"vendor": "own_invoice", "name": "Egen faktura", "category": "own_invoice",
+         "patterns": ["ftf-"], "applies_to": "income"},
+        ...
+      ]
+    }
+
+Patterns are case-insensitive literals matched as whole words; a trailing
+``*`` also matches longer words (``molslinje*`` matches "Molslinjen").
+``applies_to`` limits a rule to ``income`` (positive amounts) or ``expense``.
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_RULES_FILE = Path(__file__).with_name('vendor_rules.json')
+
+INCOME = 'income'
+EXPENSE = 'expense'
+
+
+class VendorRule(NamedTuple):
+    vendor: str
+    name: str
+    category: str
+    patterns: Tuple[str, ...]
+    # 'income', 'expense' or None for both
+    applies_to: Optional[str] = None
+
+
+def _term(pattern: str) -> str:
+    """The text a pattern matches, lower-cased and without the prefix marker"""
+    return pattern.rstrip('*').lower()
+
+
+# Trie keys marking where a pattern ends (character keys are one char long)
+_WORD_END = '<end>'
+_PREFIX_END = '<prefix>'
+
+
+def _is_word_char(char: str) -> bool:
+    return re.match(r'\w', char) is not None
+
+
+def _branches(node: Dict[str, Dict]) -> List[str]:
+    """One regex alternative per next character of a pattern trie node"""
+    return [re.escape(key) + _trie_regex(child, key)
+            for key, child in sorted(node.items()) if key not in (_WORD_END, _PREFIX_END)]
+
+
+def _trie_regex(node: Dict[str, Dict], last_char: str) -> str:
+    """Regex for the rest of a pattern trie, sharing common prefixes.
+
+    Alternatives that share a prefix are merged, so the regex engine picks a
+    branch from the next character instead of retrying every pattern at
+    every position. Longer continuations come before a pattern ending so
+    the longest pattern wins.
+    """
+    branches = _branches(node)
+    if _PREFIX_END in node:
+        branches.append('')
+    elif _WORD_END in node:
+        branches.append(r'\b' if _is_word_char(last_char) else '')
+
+    if len(branches) == 1:
+        return branches[0]
+    return '(?:' + '|'.join(branches) + ')'
+
+
+def _compile(patterns: List[str]) -> Optional[Pattern]:
+    trie: Dict[str, Dict] = {}
+    for pattern in patterns:
+        node = trie
+        for char in _term(pattern):
+            node = node.setdefault(char, {})
+        node[_PREFIX_END if pattern.endswith('*') else _WORD_END] = {}
+    if not trie:
+        return None
+
+    # Patterns starting with a word character must also start a word
+    words = {key: child for key, child in trie.items() if _is_word_char(key)}
+    others = {key: child for key, child in trie.items() if key not in words}
+    alternatives = _branches(others)
+    if words:
+        alternatives.insert(0, r'\b(?:' + '|'.join(_branches(words)) + ')')
+    return re.compile('|'.join(alternatives))
+
+
+class Categorizer:
+    """Assigns vendor and category IDs to statement texts using an ordered rule list"""
+
+    def __init__(self, rules: List[VendorRule], categories: Dict[str, str],
+                 default: Optional[VendorRule] = None):
+        self.rules = list(rules)
+        self.categories = dict(categories)
+        self.default = default or VendorRule('unknown', 'Ukategoriseret', 'uncategorized', ())
+        self.categories.setdefault(self.default.category, self.default.name)
+
+        # Highest-priority (lowest) rule index per matched term and direction
+        self._priority: Dict[Optional[str], Dict[str, int]] = {INCOME: {}, EXPENSE: {}, None: {}}
+        for index, rule in enumerate(self.rules):
+            if rule.category not in self.categories:
+                raise ValueError(f"Vendor rule {rule.vendor!r} uses unknown category {rule.category!r}")
+            if rule.applies_to not in (INCOME, EXPENSE, None):
+                raise ValueError(f"Vendor rule {rule.vendor!r}: applies_to must be "
+                                 f"{INCOME!r} or {EXPENSE!r}, not {rule.applies_to!r}")
+            if not rule.patterns or not all(_term(p) for p in rule.patterns):
+                raise ValueError(f"Vendor rule {rule.vendor!r} has an empty pattern")
+            for pattern in rule.patterns:
+                term = _term(pattern)
+                for direction in (INCOME, EXPENSE):
+                    if rule.applies_to in (direction, None):
+                        self._priority[direction].setdefault(term, index)
+                # Direction unknown (no amounts): every rule applies
+                self._priority[None].setdefault(term, index)
+
+        self.regex = _compile([p for rule in self.rules for p in rule.patterns])
+
+        self._vendors = np.array([r.vendor for r in self.rules] + [self.default.vendor], dtype=object)
+        self._category_ids = np.array([r.category for r in self.rules] + [self.default.category],
+                                      dtype=object)
+        self._labels = np.array([self.label(r) for r in self.rules] + [self.default.name],
+                                dtype=object)
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> 'Categorizer':
+        """Load rules from ``path`` (default VENDOR_RULES_FILE or the bundled vendor_rules.json)"""
+        path = path or os.getenv('VENDOR_RULES_FILE') or DEFAULT_RULES_FILE
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+
+        def rule(entry: Dict) -> VendorRule:
+            return VendorRule(entry['vendor'], entry['name'], entry['category'],
+                              tuple(entry.get('patterns', ())), entry.get('applies_to'))
+
+        try:
+            rules = [rule(entry) for entry in config['vendors']]
+            default = rule(config['default']) if 'default' in config else None
+            return cls(rules, config['categories'], default)
+        except KeyError as e:
+            raise ValueError(f"Invalid vendor rules file {path}: missing {e}") from e
+
+    def label(self, rule: VendorRule) -> str:
+        """Display label, e.g. "Circle K (Benzin)" """
+        category = self.categories[rule.category]
+        return rule.name if category == rule.name else f"{rule.name} ({category})"
+
+    def categorize(self, texts: pd.Series, amounts: Optional[pd.Series] = None) -> pd.DataFrame:
+        """``vendor``, ``category`` (IDs) and ``label`` for every text.
+
+        With ``amounts``, rules limited to income or expenses only apply to
+        positive or non-positive amounts respectively.
+        """
+        n = len(texts)
+        best = np.full(n, len(self.rules))
+        if n and self.regex is not None:
+            matches = texts.reset_index(drop=True).astype(str).str.lower().str.findall(self.regex)
+            matches = matches.explode().dropna()
+            if not matches.empty:
+                rows = matches.index.to_numpy()
+                if amounts is None:
+                    priority = matches.map(self._priority[None])
+                else:
+                    income = amounts.to_numpy()[rows] > 0
+                    priority = matches.map(self._priority[EXPENSE]).where(
+                        ~income, matches.map(self._priority[INCOME]))
+                priority = priority.dropna().astype(np.int64)
+                firsts = priority.groupby(level=0).min()
+                best[firsts.index.to_numpy()] = firsts.to_numpy()
+
+        return pd.DataFrame({
+            'vendor': self._vendors[best],
+            'category': self._category_ids[best],
+            'label': self._labels[best],
+        }, index=texts.index)
+
+
+@lru_cache(maxsize=None)
+def _load(path: str) -> Categorizer:
+    return Categorizer.from_file(path)
+
+
+def load_categorizer(path: Optional[str] = None) -> Categorizer:
+    """Process-wide Categorizer for ``path`` (default as in ``Categorizer.from_file``)"""
+    return _load(str(path or os.getenv('VENDOR_RULES_FILE') or DEFAULT_RULES_FILE))
@@ -8,11 +8,18 @@ import asyncio
 import sys
 from datetime import datetime, timedelta
 from collections import defaultdict
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.gmail_access import header
+from src.utils.mailbox_index import get_mailbox_index, index_enabled
+from src.utils.vendor_search import VendorSearchResult, search_vendors
+
 class DetailedReceiptFinder:
     def __init__(self, creds_file, token_file):
         """Initialize Gmail service for finding missing receipts"""
@@ -31,65 +38,36 @@ class DetailedReceiptFinder:
         
         print(f"Initialized Detailed Receipt Finder for {self.gmail_service.user_email}")
     
-    async def search_for_vendor_receipts(self, vendor_name, days_back=180):
-        """Search for receipts from specific vendor"""
-        try:
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days_back)
-            
-            # Create search query for vendor
-            query = f'has:attachment filename:pdf after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
-            
-            # Add vendor-specific terms
-            vendor_terms = vendor_name.lower().replace(' ', ' OR ')
-            query += f' ({vendor_terms})'
-            
-            response = self.gmail_service.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=50
-            ).execute()
-            
-            message_ids = response.get('messages', [])
-            return message_ids
-            
-        except Exception as e:
-            print(f"Error searching for {vendor_name}: {e}")
-            return []
+    def _base_query(self, days_back=180):
+        """Search for PDF attachments received in the last ``days_back`` days (not our own sent forwards)"""
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days_back)
+        return f'has:attachment filename:pdf -in:sent after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")}'
     
-    async def get_email_details(self, message_id):
-        """Get detailed email information"""
-        try:
-            message = self.gmail_service.service.users().messages().get(
-                userId='me',
-                id=message_id,
-                format='full'
-            ).execute()
-            
-            headers = message.get('payload', {}).get('headers', [])
-            subject = ''
-            sender = ''
-            date = ''
-            
-            for header in headers:
-                if header['name'] == 'Subject':
-                    subject = header['value']
-                elif header['name'] == 'From':
-                    sender = header['value']
-                elif header['name'] == 'Date':
-                    date = header['value']
-            
-            return {
-                'id': message_id,
-                'subject': subject,
-                'sender': sender,
-                'date': date,
-                'payload': message.get('payload', {})
-            }
-            
-        except Exception as e:
-            print(f"Error getting email details for {message_id}: {e}")
-            return None
+    def _vendor_hits(self, per_vendor, days_back=180):
+        """PDF emails per vendor - local mailbox index queries, or a few packed Gmail queries"""
+        service = self.gmail_service.service
+        if not index_enabled():
+            return search_vendors(service, self.priority_vendors, self._base_query(days_back),
+                                  per_vendor=per_vendor)
+        
+        index = get_mailbox_index()
+        index.sync(service)
+        hits = index.vendor_hits(self.priority_vendors, per_vendor,
+                                 after=datetime.now() - timedelta(days=days_back),
+                                 mime_types=['application/pdf'])
+        return VendorSearchResult({vendor: [m.as_message() for m in messages]
+                                   for vendor, messages in hits.items()}, [], 0)
+    
+    def _email_data(self, message):
+        """Email information from a message fetched with the attachments projection"""
+        return {
+            'id': message['id'],
+            'subject': header(message, 'Subject'),
+            'sender': header(message, 'From'),
+            'date': header(message, 'Date'),
+            'payload': message.get('payload', {})
+        }
     
     def _extract_pdf_attachments(self, payload):
         """Extract PDF attachments from email payload"""
@@ -122,39 +100,41 @@ class DetailedReceiptFinder:
         
         all_found_receipts = []
         
+        try:
+            result = self._vendor_hits(per_vendor=5)
+        except Exception as e:
+            print(f"Error searching for vendor receipts: {e}")
+            return all_found_receipts
+        
         for vendor in self.priority_vendors:
-            print(f"Searching for {vendor} receipts...")
-            
-            # Search for vendor receipts
-            message_ids = await self.search_for_vendor_receipts(vendor)
+            messages = result.hits[vendor]
             
-            if message_ids:
-                print(f"Found {len(message_ids)} potential receipts for {vendor}")
+            if messages:
+                print(f"Found {len(messages)} potential receipts for {vendor}")
                 
-                # Get details for first few emails
-                for i, msg_id in enumerate(message_ids[:5]):  # Limit to first 5
-                    email_data = await self.get_email_details(msg_id['id'])
-                    if email_data:
-                        attachments = self._extract_pdf_attachments(email_data['payload'])
-                        pdf_attachments = [att for att in attachments if att['mimeType'] == 'application/pdf']
+                for message in messages:
+                    email_data = self._email_data(message)
+                    attachments = self._extract_pdf_attachments(email_data['payload'])
+                    pdf_attachments = [att for att in attachments if att['mimeType'] == 'application/pdf']
+                    
+                    if pdf_attachments:
+                        print(f"  - {email_data['subject'][:60]}...")
+                        print(f"    From: {email_data['sender']}")
+                        print(f"    PDFs: {len(pdf_attachments)}")
                         
-                        if pdf_attachments:
-                            print(f"  - {email_data['subject'][:60]}...")
-                            print(f"    From: {email_data['sender']}")
-                            print(f"    PDFs: {len(pdf_attachments)}")
-                            
-                            all_found_receipts.append({
-                                'vendor': vendor,
-                                'email_data': email_data,
-                                'attachments': pdf_attachments
-                            })
+                        all_found_receipts.append({
+                            'vendor': vendor,
+                            'email_data': email_data,
+                            'attachments': pdf_attachments
+                        })
             else:
                 print(f"No receipts found for {vendor}")
             
             print()
         
         print(f"=== SAMMENDRAG ===")
-        print(f"Total vendors searched: {len(self.priority_vendors)}")
+        print(f"Total vendors searched: {len(self.priority_vendors)} ({result.queries} Gmail queries)")
+        print(f"Emails not matched to a vendor: {len(result.unattributed)}")
         print(f"Total receipts found: {len(all_found_receipts)}")
         
         return all_found_receipts
@@ -7,22 +7,31 @@ Hent kvitteringsbilleder fra Google Photos og konverter til PDFs for e-conomic
 import asyncio
 import sys
 import os
-import io
 from datetime import datetime, timedelta
-from PIL import Image
 import requests
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.image_pdf import ImageConverter, image_to_pdf
+
+# Photos downloaded and converted ahead of the one being sent (at least two per worker)
+PREFETCH = 16
+
 class GooglePhotosReceiptProcessor:
     def __init__(self, creds_file, token_file):
         """Initialize Google Photos and Gmail services"""
         self.gmail_service = GmailService(creds_file, token_file)
+        self.dedup = get_dedup_store()  # Persistent index of sent receipts, shared across runs
+        self.converter = ImageConverter()  # PDF conversion in worker processes (IMAGE_CONVERT_WORKERS)
         
         # Initialize Google Photos API
         self.photos_service = None
@@ -121,8 +130,9 @@ class GooglePhotosReceiptProcessor:
             photo_id = photo_item['id']
             base_url = photo_item['baseUrl']
             
-            # Download photo
-            response = requests.get(f"{base_url}=d")
+            # Download photo in a thread, so other downloads and conversions keep going
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, lambda: requests.get(f"{base_url}=d", timeout=60))
             if response.status_code == 200:
                 return response.content
             else:
@@ -136,18 +146,7 @@ class GooglePhotosReceiptProcessor:
     def convert_image_to_pdf(self, image_data, filename):
         """Convert image to PDF"""
         try:
-            # Open image
-            image = Image.open(io.BytesIO(image_data))
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Create PDF
-            pdf_buffer = io.BytesIO()
-            image.save(pdf_buffer, format='PDF')
-            pdf_data = pdf_buffer.getvalue()
-            
+            pdf_data = image_to_pdf(image_data, self.converter.profile)
             print(f"Converted {filename} to PDF ({len(pdf_data)} bytes)")
             return pdf_data
             
@@ -170,42 +169,77 @@ class GooglePhotosReceiptProcessor:
             print("No receipt photos found")
             return
         
-        print(f"Processing {min(len(photos), max_photos)} photos...")
+        photos = photos[:max_photos]
+        print(f"Processing {len(photos)} photos...")
         
         processed_count = 0
         sent_count = 0
         
-        for i, photo in enumerate(photos[:max_photos]):
-            print(f"\nProcessing photo {i+1}/{min(len(photos), max_photos)}")
-            print(f"Photo: {photo.get('filename', 'Unknown')}")
-            print(f"Date: {photo.get('mediaMetadata', {}).get('creationTime', 'Unknown')}")
-            
-            # Download photo
-            image_data = await self.download_photo(photo)
-            if not image_data:
-                print("Failed to download photo")
-                continue
-            
-            # Convert to PDF
-            filename = photo.get('filename', f'receipt_{photo["id"]}.jpg')
-            pdf_data = self.convert_image_to_pdf(image_data, filename)
-            if not pdf_data:
-                print("Failed to convert to PDF")
-                continue
-            
-            # Send to e-conomic
-            try:
-                await self.send_to_economic(pdf_data, filename)
-                sent_count += 1
-                print(f"SUCCESS: Sent {filename} to e-conomic")
-            except Exception as e:
-                print(f"ERROR: Failed to send {filename}: {e}")
-            
-            processed_count += 1
+        # Download and convert ahead in the background; results are sent in order
+        ahead = asyncio.Semaphore(max(PREFETCH, 2 * self.converter.workers))
+        prepared = [asyncio.ensure_future(self._prepare_photo(photo, ahead)) for photo in photos]
+        
+        try:
+            for i, (photo, task) in enumerate(zip(photos, prepared)):
+                print(f"\nProcessing photo {i+1}/{len(photos)}")
+                print(f"Photo: {photo.get('filename', 'Unknown')}")
+                print(f"Date: {photo.get('mediaMetadata', {}).get('creationTime', 'Unknown')}")
+                
+                try:
+                    result = await task
+                finally:
+                    ahead.release()
+                if result is None:
+                    continue
+                filename, digest, pdf_data = result
+                
+                # Send to e-conomic
+                try:
+                    await self.send_to_economic(pdf_data, filename)
+                    self.dedup.confirm(digest)
+                    sent_count += 1
+                    print(f"SUCCESS: Sent {filename} to e-conomic")
+                except Exception as e:
+                    self.dedup.release(digest)
+                    print(f"ERROR: Failed to send {filename}: {e}")
+                
+                processed_count += 1
+        finally:
+            for task in prepared:
+                task.cancel()
+            self.converter.close()
         
         print(f"\n=== PROCESSING COMPLETE ===")
         print(f"Processed: {processed_count} photos")
         print(f"Sent to e-conomic: {sent_count} PDFs")
+        print(f"Images: {self.converter.stats}")
+    
+    async def _prepare_photo(self, photo, ahead):
+        """Download a photo, claim it and convert it to PDF; None if it is skipped.
+        Holds a slot of ``ahead`` until process_receipt_photos has sent the result.
+        """
+        await ahead.acquire()
+        image_data = await self.download_photo(photo)
+        if not image_data:
+            print(f"Failed to download photo {photo.get('id', 'unknown')}")
+            return None
+        
+        # Skip photos already sent (the rendered PDF differs per run, so key on the image)
+        filename = photo.get('filename', f'receipt_{photo["id"]}.jpg')
+        digest = content_digest(image_data)
+        if not self.dedup.claim(digest, filename, 'google_photos'):
+            print(f"SKIPPING DUPLICATE: {filename} (already sent)")
+            return None
+        
+        # Convert to PDF in a worker process
+        try:
+            pdf_data = await self.converter.convert(image_data)
+        except Exception as e:
+            self.dedup.release(digest)
+            print(f"Error converting {filename} to PDF: {e}")
+            return None
+        print(f"Converted {filename} to PDF ({len(pdf_data)} bytes)")
+        return filename, digest, pdf_data
     
     async def send_to_economic(self, pdf_data, filename):
         """Send PDF to e-conomic via email"""
@@ -7,36 +7,32 @@ Hjælp med at behandle kvitteringsbilleder manuelt fra Google Photos
 import os
 import sys
 from datetime import datetime
-from PIL import Image
+from pathlib import Path
 import asyncio
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.image_pdf import ImageConverter, image_profile, image_to_pdf
+
 class ManualReceiptProcessor:
     def __init__(self, creds_file, token_file):
         """Initialize Gmail service for sending receipts"""
         self.gmail_service = GmailService(creds_file, token_file)
+        self.dedup = get_dedup_store()  # Persistent index of sent receipts, shared across runs
         print(f"Initialized Manual Receipt Processor for {self.gmail_service.user_email}")
     
     def convert_image_to_pdf(self, image_path, output_path=None):
         """Convert image to PDF"""
         try:
-            # Open image
-            image = Image.open(image_path)
-            
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            
-            # Create output path if not provided
-            if not output_path:
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                output_path = f"{base_name}_receipt.pdf"
+            with open(image_path, 'rb') as f:
+                pdf_data = image_to_pdf(f.read(), image_profile())
             
-            # Save as PDF
-            image.save(output_path, format='PDF')
+            output_path = self._save_pdf(image_path, pdf_data, output_path)
             print(f"Converted {image_path} to {output_path}")
             return output_path
             
@@ -44,6 +40,17 @@ class ManualReceiptProcessor:
             print(f"Error converting {image_path} to PDF: {e}")
             return None
     
+    def _save_pdf(self, image_path, pdf_data, output_path=None):
+        """Write a converted receipt (default: <image name>_receipt.pdf in the working directory)"""
+        # Create output path if not provided
+        if not output_path:
+            base_name = os.path.splitext(os.path.basename(image_path))[0]
+            output_path = f"{base_name}_receipt.pdf"
+        
+        with open(output_path, 'wb') as f:
+            f.write(pdf_data)
+        return output_path
+    
     async def send_receipt_to_economic(self, pdf_path, original_filename=None):
         """Send PDF receipt to e-conomic"""
         try:
@@ -116,33 +123,60 @@ Date: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
         
         processed_count = 0
         sent_count = 0
+        claimed = []
         
         for filename in os.listdir(folder_path):
             file_path = os.path.join(folder_path, filename)
             
             # Check if it's an image file
             if os.path.isfile(file_path) and any(filename.lower().endswith(ext) for ext in image_extensions):
+                # Skip images already sent (the rendered PDF differs per run, so key on the image)
+                with open(file_path, 'rb') as f:
+                    digest = content_digest(f.read())
+                if not self.dedup.claim(digest, filename, 'manual'):
+                    print(f"SKIPPING DUPLICATE: {filename} (already sent)")
+                    processed_count += 1
+                    continue
+                claimed.append((filename, file_path, digest))
+        
+        def read_images():
+            for _, file_path, _ in claimed:
+                with open(file_path, 'rb') as f:
+                    yield f.read()
+        
+        # Convert in worker processes, a few images ahead of the one being sent
+        converter = ImageConverter()
+        with converter:
+            for (filename, file_path, digest), conversion in zip(claimed, converter.imap(read_images())):
                 print(f"\nProcessing: {filename}")
+                processed_count += 1
                 
-                # Convert to PDF
-                pdf_path = self.convert_image_to_pdf(file_path)
-                if pdf_path:
-                    # Send to e-conomic
-                    success = asyncio.run(self.send_receipt_to_economic(pdf_path, filename))
-                    if success:
-                        sent_count += 1
-                    
-                    # Clean up PDF file
-                    try:
-                        os.remove(pdf_path)
-                    except:
-                        pass
+                try:
+                    pdf_path = self._save_pdf(file_path, conversion.result())
+                    print(f"Converted {file_path} to {pdf_path}")
+                except Exception as e:
+                    print(f"Error converting {file_path} to PDF: {e}")
+                    self.dedup.release(digest)
+                    continue
                 
-                processed_count += 1
+                # Send to e-conomic
+                success = asyncio.run(self.send_receipt_to_economic(pdf_path, filename))
+                if success:
+                    self.dedup.confirm(digest)
+                    sent_count += 1
+                else:
+                    self.dedup.release(digest)
+                
+                # Clean up PDF file
+                try:
+                    os.remove(pdf_path)
+                except:
+                    pass
         
         print(f"\n=== PROCESSING COMPLETE ===")
         print(f"Processed: {processed_count} images")
         print(f"Sent to e-conomic: {sent_count} PDFs")
+        print(f"Images: {converter.stats}")
 
 def main():
     """Main function with instructions"""
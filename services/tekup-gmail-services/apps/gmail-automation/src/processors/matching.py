@@ -0,0 +1,155 @@
+"""
+Matching of receipts (bilag) to bank transactions.
+
+TransactionIndex sorts the transactions by (amount, date) once. Each receipt
+finds the slice of transactions within ``amount_tolerance`` kr with two
+binary searches (``np.searchsorted``), so generating candidates for m
+receipts against n transactions costs O((n + m) log n) plus the candidates
+themselves. Candidates outside the date window are dropped, and the rest
+are assigned one-to-one: closest amount first, then closest date, and every
+transaction and receipt is used at most once.
+
+Receipts are a frame with ``amount`` (signed like the bank line, so expenses
+are negative), an optional ``date`` (NaT matches any date) and any other
+columns to carry along, e.g. ``text``. ``read_receipts`` loads them from a
+``Dato;Beløb;Tekst`` CSV in the bank export's Danish number format.
+"""
+
+from typing import Iterable, NamedTuple, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.processors.amounts import parse_danish_amounts
+
+DEFAULT_AMOUNT_TOLERANCE = 1.0
+# Bank lines may be booked a few days before the receipt date, and
+# invoices are often paid some time after it
+DEFAULT_DAYS_BEFORE = 3
+DEFAULT_DAYS_AFTER = 14
+
+# Stands in for a missing date (NaT) in day numbers
+_NO_DATE = np.iinfo(np.int64).min
+
+
+class MatchResult(NamedTuple):
+    # receipt, transaction (index labels), amount_diff (kr), days (transaction - receipt)
+    matches: pd.DataFrame
+    unmatched_receipts: pd.DataFrame
+    unmatched_transactions: pd.DataFrame
+
+
+def _day_numbers(dates: pd.Series) -> np.ndarray:
+    days = pd.to_datetime(dates).to_numpy(dtype='datetime64[D]')
+    numbers = days.astype(np.int64)
+    numbers[np.isnat(days)] = _NO_DATE
+    return numbers
+
+
+class TransactionIndex:
+    """Transactions sorted by (amount, date) for tolerance-window lookups"""
+
+    def __init__(self, transactions: pd.DataFrame):
+        self.transactions = transactions
+        amounts = transactions['amount'].to_numpy(dtype='float64')
+        days = _day_numbers(transactions['date'])
+        self._order = np.lexsort((days, amounts))
+        self._amounts = amounts[self._order]
+        self._days = days[self._order]
+
+    def candidates(self, amounts: np.ndarray, days: np.ndarray,
+                   amount_tolerance: float = DEFAULT_AMOUNT_TOLERANCE,
+                   days_before: int = DEFAULT_DAYS_BEFORE,
+                   days_after: int = DEFAULT_DAYS_AFTER) -> Tuple[np.ndarray, np.ndarray]:
+        """``(receipt, transaction)`` positions of every pair inside the windows"""
+        low = np.searchsorted(self._amounts, amounts - amount_tolerance, side='left')
+        high = np.searchsorted(self._amounts, amounts + amount_tolerance, side='right')
+        counts = np.maximum(high - low, 0)
+
+        # Expand every receipt's [low, high) slice into (receipt, sorted position) pairs
+        receipts = np.repeat(np.arange(len(amounts)), counts)
+        starts = np.repeat(low - np.cumsum(counts) + counts, counts)
+        sorted_positions = np.arange(len(receipts)) + starts
+
+        receipt_days = days[receipts]
+        offsets = self._days[sorted_positions] - receipt_days
+        in_window = ((receipt_days == _NO_DATE)
+                     | ((self._days[sorted_positions] != _NO_DATE)
+                        & (offsets >= -days_before) & (offsets <= days_after)))
+        return receipts[in_window], self._order[sorted_positions[in_window]]
+
+    def match(self, receipts: pd.DataFrame,
+              amount_tolerance: float = DEFAULT_AMOUNT_TOLERANCE,
+              days_before: int = DEFAULT_DAYS_BEFORE,
+              days_after: int = DEFAULT_DAYS_AFTER) -> MatchResult:
+        """Assign receipts to transactions one-to-one within the tolerance windows"""
+        amounts = receipts['amount'].to_numpy(dtype='float64')
+        if 'date' in receipts:
+            days = _day_numbers(receipts['date'])
+        else:
+            days = np.full(len(receipts), _NO_DATE, dtype=np.int64)
+
+        receipt_pos, transaction_pos = self.candidates(
+            amounts, days, amount_tolerance, days_before, days_after)
+        transaction_amounts = self.transactions['amount'].to_numpy(dtype='float64')
+        transaction_days = _day_numbers(self.transactions['date'])
+        amount_diff = transaction_amounts[transaction_pos] - amounts[receipt_pos]
+        day_diff = np.where(days[receipt_pos] == _NO_DATE, 0,
+                            transaction_days[transaction_pos] - days[receipt_pos])
+
+        # Greedy assignment, best candidates first
+        order = np.lexsort((transaction_pos, np.abs(day_diff), np.abs(amount_diff)))
+        receipt_used = np.zeros(len(receipts), dtype=bool)
+        transaction_used = np.zeros(len(self.transactions), dtype=bool)
+        chosen = []
+        for i in order:
+            r, t = receipt_pos[i], transaction_pos[i]
+            if not receipt_used[r] and not transaction_used[t]:
+                receipt_used[r] = transaction_used[t] = True
+                chosen.append(i)
+        chosen = np.array(chosen, dtype=np.int64)
+
+        matches = pd.DataFrame({
+            'receipt': receipts.index.to_numpy()[receipt_pos[chosen]],
+            'transaction': self.transactions.index.to_numpy()[transaction_pos[chosen]],
+            'amount_diff': amount_diff[chosen],
+            'days': day_diff[chosen],
+        })
+        return MatchResult(matches, receipts[~receipt_used],
+                           self.transactions[~transaction_used])
+
+
+def match_receipts(transactions: pd.DataFrame, receipts: pd.DataFrame,
+                   **windows) -> MatchResult:
+    """One-off ``TransactionIndex(transactions).match(receipts, **windows)``"""
+    return TransactionIndex(transactions).match(receipts, **windows)
+
+
+def make_receipts(rows: Iterable[Tuple[str, float, Optional[str]]]) -> pd.DataFrame:
+    """Receipts frame from ``(text, amount, date)`` rows; date is ``DD.MM.YYYY`` or None"""
+    frame = pd.DataFrame(list(rows), columns=['text', 'amount', 'date'])
+    frame['date'] = pd.to_datetime(frame['date'], format='%d.%m.%Y')
+    frame['amount'] = frame['amount'].astype('float64')
+    return frame
+
+
+def read_receipts(path: str, encoding: str = 'utf-8') -> pd.DataFrame:
+    """Receipts from a ``Dato;Beløb;Tekst`` CSV (Danish dates and amounts)"""
+    raw = pd.read_csv(path, sep=';', encoding=encoding, dtype=str, keep_default_na=False)
+    missing = {'Dato', 'Beløb'} - set(raw.columns)
+    if missing:
+        raise ValueError(f"{path}: missing column(s) {', '.join(sorted(missing))}")
+    raw.index = raw.index + 2
+
+    # An empty date matches any date; anything else must be a valid date
+    dates = pd.to_datetime(raw['Dato'], format='%d.%m.%Y', errors='coerce')
+    invalid = dates.isna() & (raw['Dato'].str.strip() != '')
+    if invalid.any():
+        rows = ', '.join(f"row {row}: {value!r}" for row, value in raw['Dato'][invalid].items())
+        raise ValueError(f"{path}: invalid date(s) in Dato - {rows}")
+
+    return pd.DataFrame({
+        'date': dates,
+        'amount': parse_danish_amounts(raw['Beløb'], source=f"{path} (Beløb)"),
+        'text': raw['Tekst'] if 'Tekst' in raw else '',
+    }, index=raw.index)
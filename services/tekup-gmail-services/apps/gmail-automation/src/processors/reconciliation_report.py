@@ -4,198 +4,116 @@ Reconciliation Report
 Tjek hvad der mangler ift. afstemming mellem kontobevægelser og sendte bilag
 """
 
-import csv
-import re
-from datetime import datetime
-from collections import defaultdict
+import argparse
+import sys
+from pathlib import Path
 
-def parse_danish_date(date_str):
-    """Parse Danish date format DD.MM.YYYY"""
-    try:
-        return datetime.strptime(date_str.strip('"'), '%d.%m.%Y')
-    except:
-        return None
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.processors.transactions import (
+    by_month, categorize, load_transactions,
+    missing_references, statement_paths, summarize
+)
+from src.processors.matching import make_receipts, match_receipts, read_receipts
 
-def parse_amount(amount_str):
-    """Parse Danish amount format with comma as decimal separator"""
-    try:
-        amount = amount_str.strip('"').replace(',', '.')
-        return float(amount)
-    except:
-        return 0.0
+def reconcile_receipts(transactions, no_reference, receipts_file):
+    """Match a receipts CSV against the bank lines and list what is left on each side"""
+    receipts = read_receipts(receipts_file)
+    result = match_receipts(transactions, receipts)
+    
+    print(f"=== BILAG MATCHET MOD KONTOBEVÆGELSER ({receipts_file}) ===")
+    for match in result.matches.head(20).itertuples():
+        receipt = receipts.loc[match.receipt]
+        t = transactions.loc[match.transaction]
+        print(f"{t['date']:%d.%m.%Y} | {t['text'][:40]:<40} | {t['amount']:>10,.2f} kr"
+              f" <- {receipt['text'][:30]} ({match.days:+d} dage)")
+    print(f"\nMatchede bilag: {len(result.matches)} af {len(receipts)}")
+    print()
+    
+    print("=== BILAG UDEN KONTOBEVÆGELSE ===")
+    for receipt in result.unmatched_receipts.head(20).itertuples():
+        date = f"{receipt.date:%d.%m.%Y}" if receipt.date == receipt.date else "?"
+        print(f"Linje {receipt.Index}: {date} | {receipt.text[:50]:<50} | {receipt.amount:>10,.2f} kr")
+    print(f"\nTotal: {len(result.unmatched_receipts)}")
+    print()
+    
+    still_missing = no_reference[no_reference.index.isin(result.unmatched_transactions.index)]
+    print("=== UDGIFTER UDEN BILAGSREFERENCE OG UDEN MATCHET BILAG ===")
+    for expense in still_missing.sort_values('amount', kind='stable').head(20).itertuples():
+        print(f"{expense.date:%d.%m.%Y} | {expense.text[:50]:<50} | {expense.amount:>10,.2f} kr")
+    print(f"\nTotal: {len(still_missing)}, {still_missing['amount'].abs().sum():,.2f} kr")
+    print()
+    return result
 
-def analyze_reconciliation():
+def analyze_reconciliation(paths=(), receipts_file=None):
     """Analyze what's missing for reconciliation"""
     print("=== AFSTEMNINGSRAPPORT ===\n")
     
     # Load bank transactions
-    transactions = []
-    
-    # Load kontobevaegelser (1).csv
-    print("Loading kontobevaegelser (1).csv...")
-    with open('kontobevaegelser (1).csv', 'r', encoding='latin-1') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        for row in reader:
-            date = parse_danish_date(row['Dato'])
-            if date:
-                transactions.append({
-                    'date': date,
-                    'text': row['Tekst'],
-                    'amount': parse_amount(row['Beløb']),
-                    'balance': parse_amount(row['Saldo']),
-                    'reference': row['Egen bilagsreference']
-                })
-    
-    # Load kontobevaegelser (2).csv
-    print("Loading kontobevaegelser (2).csv...")
-    with open('kontobevaegelser (2).csv', 'r', encoding='latin-1') as f:
-        reader = csv.DictReader(f, delimiter=';')
-        for row in reader:
-            date = parse_danish_date(row['Dato'])
-            if date:
-                transactions.append({
-                    'date': date,
-                    'text': row['Tekst'],
-                    'amount': parse_amount(row['Beløb']),
-                    'balance': parse_amount(row['Saldo']),
-                    'reference': row['Egen bilagsreference']
-                })
+    paths = statement_paths(paths)
+    for path in paths:
+        print(f"Loading {path}...")
+    transactions = load_transactions(paths)
     
     print(f"Loaded {len(transactions)} bank transactions\n")
     
     # Find transactions without bilagsreference
-    no_reference = [t for t in transactions if not t['reference'] and t['amount'] < -100]
+    no_reference = missing_references(transactions)
     
     print("=== TRANSAKTIONER UDEN BILAGSREFERENCE ===")
     print(f"Total: {len(no_reference)} transaktioner")
-    print(f"Total beløb: {sum(abs(t['amount']) for t in no_reference):,.2f} kr")
+    print(f"Total beløb: {no_reference['amount'].abs().sum():,.2f} kr")
     print()
     
     # Categorize by vendor
-    vendor_categories = defaultdict(list)
-    
-    for t in no_reference:
-        text_lower = t['text'].lower()
-        
-        if 'mcd' in text_lower:
-            vendor_categories['Kortbetalinger (MCD)'].append(t)
-        elif 'danfoods' in text_lower:
-            vendor_categories['Danfoods'].append(t)
-        elif 'circle k' in text_lower:
-            vendor_categories['Circle K (Benzin)'].append(t)
-        elif 'ok' in text_lower:
-            vendor_categories['OK (Benzin)'].append(t)
-        elif 'q8' in text_lower:
-            vendor_categories['Q8 (Benzin)'].append(t)
-        elif 'wolt' in text_lower:
-            vendor_categories['Wolt (Mad)'].append(t)
-        elif 'mcdonalds' in text_lower:
-            vendor_categories['McDonald\'s (Mad)'].append(t)
-        elif 'ikea' in text_lower:
-            vendor_categories['IKEA (Inventar)'].append(t)
-        elif 'johs' in text_lower and 'sørensen' in text_lower:
-            vendor_categories['Johs. Sørensen'].append(t)
-        elif 'larsen' in text_lower and 'jakobsen' in text_lower:
-            vendor_categories['Larsen & Jakobsen (Revisor)'].append(t)
-        elif 'telenor' in text_lower:
-            vendor_categories['Telenor'].append(t)
-        elif 'visma' in text_lower or 'economic' in text_lower:
-            vendor_categories['Visma e-conomic'].append(t)
-        elif 'collectia' in text_lower:
-            vendor_categories['Collectia (Inkasso)'].append(t)
-        elif 'viabill' in text_lower:
-            vendor_categories['Viabill (Finansiering)'].append(t)
-        elif 'booking' in text_lower:
-            vendor_categories['Booking (Rejse)'].append(t)
-        elif 'travel' in text_lower:
-            vendor_categories['Travel (Rejse)'].append(t)
-        elif 'europark' in text_lower:
-            vendor_categories['Europark (Parkering)'].append(t)
-        elif 'euroincasso' in text_lower:
-            vendor_categories['EuroIncasso (Inkasso)'].append(t)
-        elif 'feriekonto' in text_lower:
-            vendor_categories['FerieKonto (Løn)'].append(t)
-        elif 'jks' in text_lower:
-            vendor_categories['JKS (Diverse)'].append(t)
-        elif 'bs' in text_lower:
-            vendor_categories['BS (Diverse)'].append(t)
-        elif 'ls' in text_lower:
-            vendor_categories['LS (Diverse)'].append(t)
-        elif 'molslinje' in text_lower:
-            vendor_categories['Molslinje (Transport)'].append(t)
-        elif 'samsø' in text_lower:
-            vendor_categories['Samsø Festival'].append(t)
-        elif 'kundegebyr' in text_lower:
-            vendor_categories['Kundegebyr (Bank)'].append(t)
-        elif 'online banking' in text_lower:
-            vendor_categories['Online Banking (Bank)'].append(t)
-        elif 'lunar' in text_lower:
-            vendor_categories['Lunar (Bank)'].append(t)
-        elif 'revolut' in text_lower:
-            vendor_categories['Revolut (Bank)'].append(t)
-        elif 'mobilepay' in text_lower:
-            vendor_categories['MobilePay (Betaling)'].append(t)
-        elif 'transfer' in text_lower:
-            vendor_categories['Transfer (Overførsel)'].append(t)
-        elif 'overførsel' in text_lower:
-            vendor_categories['Overførsel (Diverse)'].append(t)
-        else:
-            vendor_categories['Ukategoriseret'].append(t)
+    vendors = summarize(no_reference, categorize(no_reference)['label'])
     
     print("=== KATEGORISERET EFTER LEVERANDØR ===")
-    for vendor, items in sorted(vendor_categories.items(), key=lambda x: len(x[1]), reverse=True):
-        if items:
-            total = sum(abs(t['amount']) for t in items)
-            print(f"{vendor}: {len(items)} transaktioner, {total:,.2f} kr")
+    for vendor, count, total in vendors.sort_values('count', ascending=False, kind='stable').itertuples(name=None):
+        print(f"{vendor}: {count} transaktioner, {total:,.2f} kr")
     
     print()
     
     # Find specific missing invoices mentioned by revisor
     print("=== REVISORENS MANGENDE BILAG (April 2025) ===")
-    april_2025 = [t for t in transactions if t['date'].month == 4 and t['date'].year == 2025]
-    
-    missing_invoices = [
-        ("Tilbagebetaling lån af bil", -35000.00),
-        ("Bilkøb", -30000.00),
-        ("Køb af fryser", -5000.00)
-    ]
-    
-    for description, expected_amount in missing_invoices:
-        found = False
-        for t in april_2025:
-            if abs(t['amount'] - expected_amount) < 100:  # Within 100 kr tolerance
-                print(f"FUNDET: {t['date'].strftime('%d.%m.%Y')} | {t['text']} | {t['amount']:,.2f} kr")
-                found = True
-                break
-        
-        if not found:
-            print(f"MANGER: {description} ({expected_amount:,.2f} kr) - IKKE FUNDET I KONTOBEVÆGELSER")
+    missing_invoices = make_receipts([
+        ("Tilbagebetaling lån af bil", -35000.00, "02.04.2025"),
+        ("Bilkøb", -30000.00, "02.04.2025"),
+        ("Køb af fryser", -5000.00, "28.04.2025")
+    ])
+    
+    # Within 100 kr and the default date window, each bank line used once
+    auditor = match_receipts(transactions, missing_invoices, amount_tolerance=100)
+    found = auditor.matches.set_index('receipt')['transaction']
+    for invoice in missing_invoices.itertuples():
+        if invoice.Index in found.index:
+            t = transactions.loc[found[invoice.Index]]
+            print(f"FUNDET: {t['date']:%d.%m.%Y} | {t['text']} | {t['amount']:,.2f} kr ({invoice.text})")
+        else:
+            print(f"MANGER: {invoice.text} ({invoice.amount:,.2f} kr) - IKKE FUNDET I KONTOBEVÆGELSER")
     
     print()
     
+    # Match the receipts we hold, if given, against the bank lines
+    receipt_matches = None
+    if receipts_file:
+        receipt_matches = reconcile_receipts(transactions, no_reference, receipts_file)
+    
     # Find large expenses without bilagsreference
-    large_expenses = [t for t in no_reference if abs(t['amount']) > 1000]
+    large_expenses = no_reference[no_reference['amount'].abs() > 1000].sort_values('amount', kind='stable')
     print("=== STORE UDGIFTER UDEN BILAG (>1000 kr) ===")
-    large_expenses.sort(key=lambda x: x['amount'])
     
-    for expense in large_expenses[:20]:  # Show top 20
-        print(f"{expense['date'].strftime('%d.%m.%Y')} | {expense['text'][:50]:<50} | {expense['amount']:>10,.2f} kr")
+    for expense in large_expenses.head(20).itertuples():  # Show top 20
+        print(f"{expense.date:%d.%m.%Y} | {expense.text[:50]:<50} | {expense.amount:>10,.2f} kr")
     
     print(f"\nTotal store udgifter uden bilag: {len(large_expenses)}")
-    print(f"Total beløb: {sum(abs(t['amount']) for t in large_expenses):,.2f} kr")
+    print(f"Total beløb: {large_expenses['amount'].abs().sum():,.2f} kr")
     print()
     
     # Monthly breakdown
     print("=== MÅNEDLIG OPDELING AF MANGLENDE BILAG ===")
-    monthly = defaultdict(list)
-    for t in no_reference:
-        month_key = f"{t['date'].year}-{t['date'].month:02d}"
-        monthly[month_key].append(t)
-    
-    for month in sorted(monthly.keys()):
-        items = monthly[month]
-        total = sum(abs(t['amount']) for t in items)
-        print(f"{month}: {len(items)} transaktioner, {total:,.2f} kr")
+    for month, count, total in by_month(no_reference).itertuples(name=None):
+        print(f"{month}: {count} transaktioner, {total:,.2f} kr")
     
     print()
     
@@ -204,7 +122,7 @@ def analyze_reconciliation():
     print(f"Total transaktioner: {len(transactions)}")
     print(f"Transaktioner uden bilagsreference: {len(no_reference)}")
     print(f"Store udgifter uden bilag (>1000 kr): {len(large_expenses)}")
-    print(f"Revisorens manglende bilag: 3 (ikke fundet i kontobevægelser)")
+    print(f"Revisorens manglende bilag: {len(auditor.unmatched_receipts)} (ikke fundet i kontobevægelser)")
     print()
     
     print("=== HANDLINGSPLAN FOR AFSTEMNING ===")
@@ -221,8 +139,16 @@ def analyze_reconciliation():
         'transactions': transactions,
         'no_reference': no_reference,
         'large_expenses': large_expenses,
-        'vendor_categories': vendor_categories
+        'vendor_categories': vendors,
+        'auditor_matches': auditor,
+        'receipt_matches': receipt_matches
     }
 
 if __name__ == "__main__":
-    analyze_reconciliation()
+    parser = argparse.ArgumentParser(description="Afstemning af kontobevægelser og bilag")
+    parser.add_argument('statements', nargs='*', metavar='CSV',
+                        help="Kontoudtog (standard: alle importerede, se tekup-gmail import-statements)")
+    parser.add_argument('--receipts', metavar='CSV',
+                        help="Bilag som Dato;Beløb;Tekst CSV, matches mod kontobevægelserne")
+    args = parser.parse_args()
+    analyze_reconciliation(args.statements, args.receipts)
@@ -7,27 +7,40 @@ Intelligent behandling af kvitteringsbilleder fra Google Photos
 import asyncio
 import sys
 import os
-import io
 import json
 import re
 from datetime import datetime, timedelta
-from PIL import Image
 import requests
 import base64
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
+from pathlib import Path
 
 # Add Gmail MCP Server to path
 sys.path.append('gmail-mcp-server/src')
 from gmail_plugin.server import GmailService
 
+# Add src to path for imports
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+from src.utils.attachment_data import decode_attachment
+from src.utils.dedup_store import content_digest, get_dedup_store
+from src.utils.gmail_access import ATTACHMENTS, get_message, header
+from src.utils.gmail_http import execute
+from src.utils.image_pdf import ImageConverter
+from src.utils.mailbox_index import fts_phrase, get_mailbox_index, index_enabled
+
+IMAGE_TYPES = ['image/jpeg', 'image/png', 'image/jpg']
+# Attachments downloaded and converted ahead of the one being sent (at least two per worker)
+PREFETCH = 16
+
 class SmartPhotosProcessor:
     def __init__(self, creds_file, token_file):
         """Initialize Gmail service for sending receipts"""
         self.gmail_service = GmailService(creds_file, token_file)
-        self.processed_photos = set()
+        self.dedup = get_dedup_store()  # Persistent index of sent receipts, shared across runs
+        self.converter = ImageConverter()  # PDF conversion in worker processes (IMAGE_CONVERT_WORKERS)
         self.sent_count = 0
         self.error_count = 0
         
@@ -55,6 +68,20 @@ class SmartPhotosProcessor:
             
             all_emails = []
             
+            if index_enabled():
+                # Sender, subject and filename matches from the local mailbox index
+                index = get_mailbox_index()
+                index.sync(self.gmail_service.service)
+                for keyword in receipt_keywords:
+                    messages = index.search(fts_phrase(keyword), after=start_date, before=end_date,
+                                            mime_types=IMAGE_TYPES, limit=10)
+                    print(f"Found {len(messages)} emails for keyword: {keyword}")
+                    all_emails.extend(message.id for message in messages)
+                
+                unique_emails = list(dict.fromkeys(all_emails))
+                print(f"Total unique emails found: {len(unique_emails)}")
+                return unique_emails
+            
             for keyword in receipt_keywords:
                 query = f'after:{start_date.strftime("%Y/%m/%d")} before:{end_date.strftime("%Y/%m/%d")} "{keyword}" has:attachment'
                 
@@ -85,62 +112,74 @@ class SmartPhotosProcessor:
         print("=== BEHANDLER EMAILS MED KVITTERINGER ===")
         
         processed_count = 0
+        loop = asyncio.get_running_loop()
         
-        for i, email_id in enumerate(email_ids[:50]):  # Limit to 50 emails
-            try:
-                print(f"\nProcessing email {i+1}/{min(len(email_ids), 50)}")
-                
-                # Get email details
-                message = self.gmail_service.service.users().messages().get(
-                    userId='me',
-                    id=email_id,
-                    format='full'
-                ).execute()
-                
-                subject = self._get_header(message, 'Subject')
-                sender = self._get_header(message, 'From')
-                date = self._get_header(message, 'Date')
-                
-                print(f"Subject: {subject}")
-                print(f"From: {sender}")
-                
-                # Check if email has attachments
-                attachments = self._extract_attachments(message)
-                if attachments:
-                    print(f"Found {len(attachments)} attachments")
+        # Image attachments are downloaded and converted in the background while
+        # later emails are read; the PDFs are sent in order afterwards
+        ahead = asyncio.Semaphore(max(PREFETCH, 2 * self.converter.workers))
+        jobs = []
+        
+        try:
+            for i, email_id in enumerate(email_ids[:50]):  # Limit to 50 emails
+                try:
+                    print(f"\nProcessing email {i+1}/{min(len(email_ids), 50)}")
                     
-                    # Process each attachment
-                    for attachment in attachments:
-                        if attachment['mimeType'] in ['image/jpeg', 'image/png', 'image/jpg']:
-                            await self._process_image_attachment(attachment, subject, sender)
-                            processed_count += 1
-                else:
-                    print("No attachments found")
-                
-            except Exception as e:
-                print(f"Error processing email {email_id}: {e}")
-                self.error_count += 1
-                continue
+                    # Get email details
+                    # Attachment structure only - image bodies are downloaded separately
+                    message = await loop.run_in_executor(
+                        None, get_message, self.gmail_service.service, email_id, ATTACHMENTS)
+                    
+                    subject = header(message, 'Subject')
+                    sender = header(message, 'From')
+                    date = header(message, 'Date')
+                    
+                    print(f"Subject: {subject}")
+                    print(f"From: {sender}")
+                    
+                    # Check if email has attachments
+                    attachments = self._extract_attachments(message)
+                    if attachments:
+                        print(f"Found {len(attachments)} attachments")
+                        
+                        # Queue each image attachment
+                        for attachment in attachments:
+                            if attachment['mimeType'] in IMAGE_TYPES:
+                                task = asyncio.ensure_future(
+                                    self._prepare_image_attachment(email_id, attachment, ahead))
+                                jobs.append((task, attachment, subject, sender))
+                                processed_count += 1
+                    else:
+                        print("No attachments found")
+                    
+                except Exception as e:
+                    print(f"Error processing email {email_id}: {e}")
+                    self.error_count += 1
+                    continue
+            
+            for task, attachment, subject, sender in jobs:
+                try:
+                    prepared = await task
+                finally:
+                    ahead.release()
+                if prepared is not None:
+                    await self._process_image_attachment(prepared, attachment, subject, sender)
+        finally:
+            for task, *_ in jobs:
+                task.cancel()
+            self.converter.close()
         
         print(f"\n=== PROCESSING COMPLETE ===")
         print(f"Processed emails: {processed_count}")
         print(f"Sent to e-conomic: {self.sent_count}")
         print(f"Errors: {self.error_count}")
-    
-    def _get_header(self, message, header_name):
-        """Get email header value"""
-        headers = message.get('payload', {}).get('headers', [])
-        for header in headers:
-            if header['name'] == header_name:
-                return header['value']
-        return ""
+        print(f"Images: {self.converter.stats}")
     
     def _extract_attachments(self, message):
         """Extract attachment information from email"""
         attachments = []
         
         def extract_from_part(part):
-            if part.get('mimeType') in ['image/jpeg', 'image/png', 'image/jpg']:
+            if part.get('mimeType') in IMAGE_TYPES:
                 attachment_id = part.get('body', {}).get('attachmentId')
                 filename = part.get('filename', 'unknown.jpg')
                 size = part.get('body', {}).get('size', 0)
@@ -160,42 +199,61 @@ class SmartPhotosProcessor:
         extract_from_part(message.get('payload', {}))
         return attachments
     
-    async def _process_image_attachment(self, attachment, subject, sender):
-        """Process an image attachment"""
+    async def _prepare_image_attachment(self, message_id, attachment, ahead):
+        """Download, claim and convert an image attachment; None if it is skipped.
+        Holds a slot of ``ahead`` until process_receipt_emails has sent the result.
+        """
+        await ahead.acquire()
+        digest = None
         try:
             print(f"Processing attachment: {attachment['filename']}")
             
-            # Download attachment
-            attachment_data = self.gmail_service.service.users().messages().attachments().get(
+            # Download attachment in a thread (execute uses a per-thread transport)
+            request = self.gmail_service.service.users().messages().attachments().get(
                 userId='me',
-                messageId=attachment['id'],
+                messageId=message_id,
                 id=attachment['id']
-            ).execute()
+            )
+            attachment_data = await asyncio.get_running_loop().run_in_executor(None, execute, request)
             
             # Decode attachment data
-            file_data = base64.urlsafe_b64decode(attachment_data['data'])
+            file_data = decode_attachment(attachment_data['data'])
             
-            # Convert to PDF
-            image = Image.open(io.BytesIO(file_data))
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Skip images already sent (the rendered PDF differs per run, so key on the image)
+            digest = content_digest(file_data)
+            if not self.dedup.claim(digest, attachment['filename'], 'smart_photos'):
+                print(f"SKIPPING DUPLICATE: {attachment['filename']} (already sent)")
+                return None
             
-            # Create PDF
-            pdf_buffer = io.BytesIO()
-            image.save(pdf_buffer, format='PDF')
-            pdf_data = pdf_buffer.getvalue()
+            # Convert to PDF in a worker process
+            pdf_data = await self.converter.convert(file_data)
+            return digest, pdf_data
             
+        except Exception as e:
+            if digest:
+                self.dedup.release(digest)
+            print(f"Error processing attachment: {e}")
+            self.error_count += 1
+            return None
+    
+    async def _process_image_attachment(self, prepared, attachment, subject, sender):
+        """Send a converted image attachment"""
+        digest, pdf_data = prepared
+        try:
             # Send to e-conomic
             filename = f"{attachment['filename']}_receipt.pdf"
             success = await self._send_to_economic(pdf_data, filename, subject, sender)
             
             if success:
+                self.dedup.confirm(digest)
                 self.sent_count += 1
                 print(f"SUCCESS: Sent {filename} to e-conomic")
             else:
+                self.dedup.release(digest)
                 self.error_count += 1
                 
         except Exception as e:
+            self.dedup.release(digest)
             print(f"Error processing attachment: {e}")
             self.error_count += 1
     
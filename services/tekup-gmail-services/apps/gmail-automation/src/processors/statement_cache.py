@@ -0,0 +1,141 @@
+"""
+Columnar on-disk cache of parsed bank statements.
+
+Parsing a latin-1 export (dates, Danish amounts, lower-cased texts) is the
+slow part of every report. ``tekup-gmail import-statements`` parses each
+export once and stores the frame as one NumPy ``.npy`` file per column under
+STATEMENT_CACHE_DIR; the reports then open those files memory-mapped
+instead of parsing the CSVs again.
+
+Every export gets its own entry, keyed by its absolute path and validated
+against the file's size and mtime, so importing a folder of statements only
+re-parses the files that changed. Numeric and date columns are stored as-is;
+text columns are dictionary-encoded (int32 codes plus the unique values),
+since bank texts repeat heavily. ``FORMAT_VERSION`` invalidates every entry
+when the stored layout or the parsing changes.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_CACHE_DIR = '.statement_cache'
+FORMAT_VERSION = 1
+
+_META_FILE = 'meta.json'
+
+
+def _key(path: Path) -> str:
+    return hashlib.sha1(str(path).encode('utf-8')).hexdigest()[:16]
+
+
+class StatementCache:
+    """Parsed statements stored per export file, re-parsed when the file changes"""
+
+    def __init__(self, parse: Callable[[str], pd.DataFrame], directory: Optional[str] = None):
+        self.parse = parse
+        self.directory = Path(directory or os.getenv('STATEMENT_CACHE_DIR', DEFAULT_CACHE_DIR))
+
+    def _entry(self, path: Path) -> Path:
+        return self.directory / _key(path)
+
+    def _read_meta(self, entry: Path) -> Optional[Dict]:
+        try:
+            with open(entry / _META_FILE, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def is_fresh(self, path: str) -> bool:
+        """True if ``path`` is cached and unchanged since it was parsed"""
+        source = Path(path).resolve()
+        meta = self._read_meta(self._entry(source))
+        if meta is None or meta.get('version') != FORMAT_VERSION:
+            return False
+        stat = source.stat()
+        return meta['size'] == stat.st_size and meta['mtime_ns'] == stat.st_mtime_ns
+
+    def import_statement(self, path: str, force: bool = False) -> bool:
+        """Parse ``path`` into the cache unless it is up to date; True if it was parsed"""
+        if not force and self.is_fresh(path):
+            return False
+        source = Path(path).resolve()
+        # Stat before parsing, so a change during the parse is picked up next time
+        stat = source.stat()
+        frame = self.parse(str(path))
+
+        entry = self._entry(source)
+        staging = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+
+        columns = {}
+        np.save(staging / 'index.npy', frame.index.to_numpy(dtype=np.int64))
+        for name in frame.columns:
+            column = frame[name]
+            if column.dtype == object or pd.api.types.is_string_dtype(column.dtype):
+                codes, uniques = pd.factorize(column.astype(object))
+                np.save(staging / f"{name}.codes.npy", codes.astype(np.int32))
+                np.save(staging / f"{name}.values.npy", np.asarray(uniques, dtype=str))
+                columns[name] = 'text'
+            else:
+                np.save(staging / f"{name}.npy", column.to_numpy())
+                columns[name] = 'array'
+
+        meta = {
+            'version': FORMAT_VERSION,
+            'path': str(source),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'rows': len(frame),
+            'columns': columns,
+        }
+        with open(staging / _META_FILE, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(staging, entry)
+        return True
+
+    def load(self, path: str) -> pd.DataFrame:
+        """Frame for ``path``, importing it first if it is missing or stale.
+
+        Numeric and date columns are read-only memory maps of the cache files.
+        """
+        self.import_statement(path)
+        entry = self._entry(Path(path).resolve())
+        meta = self._read_meta(entry)
+        if meta is None:
+            raise RuntimeError(f"Statement cache entry for {path} disappeared while loading")
+
+        data = {}
+        for name, kind in meta['columns'].items():
+            if kind == 'text':
+                codes = np.load(entry / f"{name}.codes.npy", mmap_mode='r')
+                values = np.load(entry / f"{name}.values.npy").astype(object)
+                data[name] = values[codes]
+            else:
+                data[name] = np.load(entry / f"{name}.npy", mmap_mode='r')
+        index = np.load(entry / 'index.npy', mmap_mode='r')
+        return pd.DataFrame(data, index=pd.Index(index), copy=False)
+
+    def imported_paths(self) -> List[str]:
+        """Source paths of every cached statement that still exists, sorted"""
+        paths = []
+        if self.directory.is_dir():
+            for entry in self.directory.iterdir():
+                # Skip imports still being written (``<key>.<pid>.tmp``)
+                meta = self._read_meta(entry) if '.' not in entry.name else None
+                if meta is not None and Path(meta['path']).exists():
+                    paths.append(meta['path'])
+        return sorted(paths)
+
+    def import_all(self, paths: Iterable[str], force: bool = False) -> Dict[str, bool]:
+        """``import_statement`` for every path; maps each path to whether it was parsed"""
+        return {path: self.import_statement(path, force=force) for path in paths}
@@ -0,0 +1,128 @@
+"""
+Columnar bank-statement engine for the reconciliation reports.
+
+The ``kontobevaegelser`` exports are loaded once per process into a single
+pandas frame with typed columns (``date`` datetime64, ``amount`` and
+``balance`` float64, ``text``/``reference`` strings, plus a lower-cased
+``text_lower`` for vendor matching). Reports are expressed as boolean masks
+and group-bys on that frame instead of per-row Python loops, so every report
+in a run shares the same parse and multi-year statements stay fast. Parsed
+exports are kept in the on-disk statement cache (see processors.statement_cache),
+so a CSV is only parsed again after it changes.
+"""
+
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from src.processors.amounts import parse_danish_amounts
+from src.processors.categorizer import Categorizer, load_categorizer
+from src.processors.statement_cache import StatementCache
+
+# Default bank exports when none are given or imported, relative to the
+# working directory the reports are run from
+STATEMENT_FILES = ('kontobevaegelser (1).csv', 'kontobevaegelser (2).csv')
+STATEMENT_ENCODING = 'latin-1'
+
+# Export header -> engine column
+_COLUMNS = {
+    'Dato': 'date',
+    'Tekst': 'text',
+    'Beløb': 'amount',
+    'Saldo': 'balance',
+    'Egen bilagsreference': 'reference',
+}
+
+
+def read_statement(path: str) -> pd.DataFrame:
+    """Parse one bank export; rows without a valid date are dropped.
+
+    Raises AmountParseError if an amount or balance is malformed.
+    """
+    raw = pd.read_csv(path, sep=';', encoding=STATEMENT_ENCODING, dtype=str,
+                      keep_default_na=False, usecols=list(_COLUMNS))
+    raw = raw.rename(columns=_COLUMNS)
+    # Label rows by their line in the file (header is line 1) for error messages
+    raw.index = raw.index + 2
+
+    frame = pd.DataFrame({
+        'date': pd.to_datetime(raw['date'], format='%d.%m.%Y', errors='coerce'),
+        'text': raw['text'].astype(str),
+        'amount': parse_danish_amounts(raw['amount'], source=f"{path} (Beløb)"),
+        'balance': parse_danish_amounts(raw['balance'], source=f"{path} (Saldo)"),
+        'reference': raw['reference'].astype(str),
+        'text_lower': raw['text'].astype(str).str.lower(),
+    })
+    return frame[frame['date'].notna()]
+
+
+def statement_cache(directory: Optional[str] = None) -> StatementCache:
+    """Statement cache for ``read_statement`` frames (default STATEMENT_CACHE_DIR)"""
+    return StatementCache(read_statement, directory)
+
+
+def statement_paths(paths: Sequence[str] = ()) -> List[str]:
+    """``paths`` if given, else every imported statement, else STATEMENT_FILES"""
+    return list(paths) or statement_cache().imported_paths() or list(STATEMENT_FILES)
+
+
+@lru_cache(maxsize=None)
+def _load(paths: Tuple[str, ...]) -> pd.DataFrame:
+    cache = statement_cache()
+    frames = [cache.load(path) for path in paths]
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_transactions(paths: Sequence[str] = ()) -> pd.DataFrame:
+    """All transactions from ``paths`` (see ``statement_paths``), loaded once per process.
+
+    The frame is shared between callers - filter or sort into new frames,
+    never modify it in place.
+    """
+    return _load(tuple(statement_paths(paths)))
+
+
+def missing_references(frame: pd.DataFrame, min_amount: float = 100.0) -> pd.DataFrame:
+    """Expenses above ``min_amount`` kr without an own voucher reference"""
+    return frame[(frame['reference'] == '') & (frame['amount'] < -min_amount)]
+
+
+def matching(frame: pd.DataFrame, term: str) -> pd.DataFrame:
+    """Transactions whose text contains ``term`` (case-insensitive)"""
+    return frame[frame['text_lower'].str.contains(term.lower(), regex=False)]
+
+
+def categorize(frame: pd.DataFrame, categorizer: Optional[Categorizer] = None) -> pd.DataFrame:
+    """``vendor``, ``category`` and ``label`` for every transaction (see processors.categorizer)"""
+    categorizer = categorizer or load_categorizer()
+    return categorizer.categorize(frame['text_lower'], frame['amount'])
+
+
+def summarize(frame: pd.DataFrame, keys) -> pd.DataFrame:
+    """Count and absolute amount total per group of ``keys`` (Series aligned with ``frame``)"""
+    grouped = frame['amount'].abs().groupby(keys, sort=True)
+    return pd.DataFrame({'count': grouped.size(), 'total': grouped.sum()})
+
+
+def by_month(frame: pd.DataFrame) -> pd.DataFrame:
+    """``summarize`` per calendar month, indexed ``YYYY-MM``"""
+    summary = summarize(frame, frame['date'].dt.to_period('M').rename('month'))
+    summary.index = summary.index.astype(str)
+    return summary
+
+
+def by_quarter(frame: pd.DataFrame) -> pd.DataFrame:
+    """``summarize`` per calendar quarter, indexed by (year, quarter)"""
+    return summarize(frame, [frame['date'].dt.year.rename('year'),
+                             frame['date'].dt.quarter.rename('quarter')])
+
+
+def by_amount_range(frame: pd.DataFrame,
+                    ranges: Sequence[Tuple[float, float, str]]) -> pd.DataFrame:
+    """``summarize`` per ``(low, high, label)`` range of absolute amount (low < x <= high)"""
+    edges = [low for low, _, _ in ranges] + [ranges[-1][1]]
+    buckets = pd.cut(frame['amount'].abs(), bins=edges,
+                     labels=[label for _, _, label in ranges])
+    grouped = frame['amount'].abs().groupby(buckets, observed=False)
+    return pd.DataFrame({'count': grouped.size(), 'total': grouped.sum()})
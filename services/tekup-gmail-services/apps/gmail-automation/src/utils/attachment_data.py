@@ -0,0 +1,63 @@
+"""
+Single-pass decoding of Gmail attachment bodies.
+
+Gmail returns attachment bodies as base64url text. ``base64.urlsafe_b64decode``
+first copies the whole text to translate the alphabet and then decodes it, and
+the dedup digest needs another full pass over the result. ``decode_attachment``
+instead decodes fixed-size chunks straight into one preallocated buffer and
+feeds each chunk to SHA-256 as it goes, so a PDF is held in memory once and
+its digest is ready when decoding finishes.
+"""
+
+import binascii
+import hashlib
+from typing import Union
+
+# Encoded characters per chunk; must be a multiple of 4
+DECODE_CHUNK_SIZE = 64 * 1024
+
+_URLSAFE_TO_STANDARD = bytes.maketrans(b'-_', b'+/')
+
+
+class DecodedAttachment(bytearray):
+    """Decoded attachment content carrying its precomputed SHA-256 ``digest``"""
+
+    digest = None
+
+
+def decode_attachment(data: Union[str, bytes], chunk_size: int = DECODE_CHUNK_SIZE) -> DecodedAttachment:
+    """Decode base64url ``data`` and hash it in the same pass.
+
+    Only one chunk of ``data`` is ever copied at a time; the result is written
+    into a buffer allocated once at its final size.
+    """
+    padding = '=' if isinstance(data, str) else b'='
+    end = len(data)
+    while end and data[end - 1:end] == padding:
+        end -= 1
+
+    remainder = end % 4
+    if remainder == 1:
+        raise binascii.Error("Invalid base64url attachment data")
+
+    out = DecodedAttachment(end // 4 * 3 + max(0, remainder - 1))
+    hasher = hashlib.sha256()
+    chunk_size = max(4, chunk_size - chunk_size % 4)
+    pos = 0
+
+    with memoryview(out) as view:
+        for start in range(0, end, chunk_size):
+            chunk = data[start:min(start + chunk_size, end)]
+            if isinstance(chunk, str):
+                chunk = chunk.encode('ascii')
+            chunk = chunk.translate(_URLSAFE_TO_STANDARD)
+            if len(chunk) % 4:
+                chunk += b'=' * (4 - len(chunk) % 4)
+
+            decoded = binascii.a2b_base64(chunk)
+            view[pos:pos + len(decoded)] = decoded
+            hasher.update(decoded)
+            pos += len(decoded)
+
+    out.digest = hasher.hexdigest()
+    return out
@@ -0,0 +1,56 @@
+"""
+Size-aware bundling of attachments into as few emails as possible.
+
+Forwarding one email per attachment costs a ``messages.send`` call, a
+base64 encode and a unit of the daily send limit for every PDF. Bundling
+packs the attachments of one source message into emails that stay under a
+size cap (e-conomic accepts up to 10 MB per email). Sizes are estimated as
+they will be sent - base64 with line breaks plus per-email and per-part
+overhead - and bundles are filled first-fit by decreasing size, which keeps
+the number of emails close to the minimum.
+"""
+
+import math
+from typing import Callable, List, Sequence, TypeVar
+
+T = TypeVar('T')
+
+# e-conomic's limit for one email including all attachments
+DEFAULT_BUNDLE_MAX_BYTES = 10 * 1024 * 1024
+
+# Headers and the body text of a forward
+MESSAGE_OVERHEAD = 16 * 1024
+# MIME headers and boundary of one attachment part
+PART_OVERHEAD = 512
+
+
+def encoded_size(size: int) -> int:
+    """Bytes ``size`` bytes take base64-encoded in 76 character lines"""
+    encoded = 4 * math.ceil(size / 3)
+    return encoded + math.ceil(encoded / 76)
+
+
+def plan_bundles(items: Sequence[T], size: Callable[[T], int],
+                 max_bytes: int = DEFAULT_BUNDLE_MAX_BYTES) -> List[List[T]]:
+    """Group ``items`` into bundles whose encoded email size stays within ``max_bytes``.
+
+    An item too large to share an email gets one of its own. Items keep
+    their original order within a bundle, and bundles are ordered by their
+    first item.
+    """
+    capacity = max_bytes - MESSAGE_OVERHEAD
+    costs = [encoded_size(size(item)) + PART_OVERHEAD for item in items]
+    bundles: List[List[int]] = []
+    free: List[int] = []
+
+    for index in sorted(range(len(items)), key=lambda i: -costs[i]):
+        for b, room in enumerate(free):
+            if costs[index] <= room:
+                bundles[b].append(index)
+                free[b] -= costs[index]
+                break
+        else:
+            bundles.append([index])
+            free.append(capacity - costs[index])
+
+    return [[items[i] for i in sorted(bundle)] for bundle in sorted(bundles, key=min)]
@@ -0,0 +1,175 @@
+"""
+Persistent, content-addressed dedup index for documents sent to e-conomic.
+
+Every document is keyed by the SHA-256 of its content, so the same bilag is
+recognised no matter which email, filename or run it arrives in. Entries live
+in a small SQLite database (WAL mode, safe to share between processes); an
+in-memory Bloom filter answers most "never seen" lookups without touching the
+database.
+
+Sending follows a claim -> confirm/release protocol: ``claim`` atomically
+reserves a digest (only one caller across all threads and processes wins),
+``confirm`` records it as sent and ``release`` frees the claim again when the
+send failed. Claims left behind by a crashed process expire after
+``claim_timeout`` seconds.
+"""
+
+import hashlib
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+DEFAULT_DEDUP_DB = 'gmail_dedup.sqlite3'
+
+# Seconds before an unconfirmed claim from a crashed run may be taken over
+DEFAULT_CLAIM_TIMEOUT = 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    digest     TEXT PRIMARY KEY,
+    state      TEXT NOT NULL,
+    filename   TEXT,
+    source     TEXT,
+    claimed_at REAL NOT NULL,
+    sent_at    REAL
+) WITHOUT ROWID
+"""
+
+_stores: Dict[str, 'DedupStore'] = {}
+_stores_lock = threading.Lock()
+
+
+def content_digest(data: bytes) -> str:
+    """Return the dedup key (hex SHA-256) for a document's content.
+
+    Content decoded with ``attachment_data.decode_attachment`` already carries
+    its digest, so it is not hashed a second time.
+    """
+    digest = getattr(data, 'digest', None)
+    if digest is not None:
+        return digest
+    return hashlib.sha256(data).hexdigest()
+
+
+class BloomFilter:
+    """Bloom filter over hex digests; ``False`` means definitely absent"""
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        bits = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.size = max(8, bits)
+        self.hashes = max(1, min(8, round(self.size / capacity * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest: str) -> Iterable[int]:
+        # The digest is already uniformly distributed - slice it into the k indices
+        for i in range(self.hashes):
+            yield int(digest[i * 8:(i + 1) * 8], 16) % self.size
+
+    def add(self, digest: str) -> None:
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest: str) -> bool:
+        return all(self._bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+
+class DedupStore:
+    """SQLite-backed set of sent document digests with a Bloom prefilter"""
+
+    def __init__(self, path: Optional[str] = None, claim_timeout: int = DEFAULT_CLAIM_TIMEOUT):
+        self.path = path or os.getenv('DEDUP_DB', DEFAULT_DEDUP_DB)
+        self.claim_timeout = claim_timeout
+        self._local = threading.local()
+        self._bloom_lock = threading.Lock()
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(_SCHEMA)
+        conn.commit()
+
+        count = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+        self._bloom = BloomFilter(capacity=max(100000, count * 2))
+        for (digest,) in conn.execute('SELECT digest FROM documents'):
+            self._bloom.add(digest)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, digest: str) -> None:
+        with self._bloom_lock:
+            self._bloom.add(digest)
+
+    def __contains__(self, digest: str) -> bool:
+        """True if the document was sent or is claimed by a sender right now"""
+        if digest not in self._bloom:
+            # Entries written by other processes since startup are still
+            # caught by claim(), which always consults the database
+            return False
+        row = self._connection().execute(
+            'SELECT 1 FROM documents WHERE digest = ?', (digest,)).fetchone()
+        return row is not None
+
+    def __len__(self) -> int:
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM documents WHERE state = 'sent'").fetchone()[0]
+
+    def claim(self, digest: str, filename: Optional[str] = None, source: Optional[str] = None) -> bool:
+        """Reserve ``digest`` for sending. Returns False if it is sent or claimed elsewhere."""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO documents (digest, state, filename, source, claimed_at) "
+                "VALUES (?, 'claimed', ?, ?, ?)",
+                (digest, filename, source, now))
+            if cursor.rowcount == 0:
+                # Take over a claim abandoned by a crashed run
+                cursor = conn.execute(
+                    "UPDATE documents SET claimed_at = ?, filename = ?, source = ? "
+                    "WHERE digest = ? AND state = 'claimed' AND claimed_at < ?",
+                    (now, filename, source, digest, now - self.claim_timeout))
+        self._remember(digest)
+        return cursor.rowcount == 1
+
+    def confirm(self, digest: str) -> None:
+        """Record a claimed document as sent"""
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "UPDATE documents SET state = 'sent', sent_at = ? WHERE digest = ?",
+                (time.time(), digest))
+
+    def release(self, digest: str) -> None:
+        """Drop an unconfirmed claim so the document can be sent later"""
+        conn = self._connection()
+        with conn:
+            conn.execute("DELETE FROM documents WHERE digest = ? AND state = 'claimed'", (digest,))
+
+    def add(self, digest: str, filename: Optional[str] = None, source: Optional[str] = None) -> None:
+        """Record a document as already sent (e.g. when seeding from sent mail)"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO documents (digest, state, filename, source, claimed_at, sent_at) "
+                "VALUES (?, 'sent', ?, ?, ?, ?)",
+                (digest, filename, source, now, now))
+        self._remember(digest)
+
+
+def get_dedup_store(path: Optional[str] = None) -> DedupStore:
+    """Return the process-wide DedupStore for ``path`` (default: $DEDUP_DB)"""
+    path = path or os.getenv('DEDUP_DB', DEFAULT_DEDUP_DB)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = DedupStore(path)
+        return _stores[path]
@@ -0,0 +1,73 @@
+"""
+Projected Gmail message access.
+
+``messages.get(format='full')`` returns the whole MIME tree, including every
+inline base64 body, even when the caller only reads a few headers. The
+projections here ask Gmail for just what a caller needs:
+
+``METADATA``     ``format=metadata`` with only the listed headers
+``ATTACHMENTS``  ``format=full`` trimmed by a ``fields`` mask to part headers,
+                 MIME types, filenames and attachment IDs/sizes (no bodies)
+``FULL``         the complete message - only when body text is needed
+"""
+
+from typing import Any, Dict, Optional, Sequence
+
+from src.utils.gmail_http import execute
+
+METADATA = 'metadata'
+ATTACHMENTS = 'attachments'
+FULL = 'full'
+
+DEFAULT_HEADERS = ('Subject', 'From', 'Date')
+
+# Gmail's fields syntax has no recursion, so spell out the nesting explicitly.
+# Five levels covers forwarded mails with attachments inside multipart/mixed.
+_PART_FIELDS = 'partId,mimeType,filename,headers,body(attachmentId,size)'
+_MAX_PART_DEPTH = 5
+
+
+def _parts_mask(depth: int) -> str:
+    if depth == 0:
+        return _PART_FIELDS
+    return f"{_PART_FIELDS},parts({_parts_mask(depth - 1)})"
+
+
+ATTACHMENT_FIELDS = f"id,threadId,labelIds,internalDate,payload({_parts_mask(_MAX_PART_DEPTH)})"
+
+
+def request_kwargs(projection: str = METADATA,
+                   headers: Optional[Sequence[str]] = DEFAULT_HEADERS) -> Dict[str, Any]:
+    """Return the ``messages.get`` keyword arguments for ``projection``"""
+    if projection == METADATA:
+        kwargs: Dict[str, Any] = {'format': 'metadata'}
+        if headers:
+            kwargs['metadataHeaders'] = list(headers)
+        return kwargs
+    if projection == ATTACHMENTS:
+        return {'format': 'full', 'fields': ATTACHMENT_FIELDS}
+    if projection == FULL:
+        return {'format': 'full'}
+    raise ValueError(f"Unknown message projection '{projection}'")
+
+
+def message_request(service: Any, message_id: str, projection: str = METADATA,
+                    headers: Optional[Sequence[str]] = DEFAULT_HEADERS) -> Any:
+    """Build (without executing) a projected ``messages.get`` request"""
+    return service.users().messages().get(
+        userId='me', id=message_id, **request_kwargs(projection, headers))
+
+
+def get_message(service: Any, message_id: str, projection: str = METADATA,
+                headers: Optional[Sequence[str]] = DEFAULT_HEADERS) -> Dict:
+    """Fetch one message using the given projection"""
+    return execute(message_request(service, message_id, projection, headers))
+
+
+def header(message: Dict, name: str, default: str = '') -> str:
+    """Return the value of top-level header ``name`` (case-insensitive)"""
+    name = name.lower()
+    for item in message.get('payload', {}).get('headers', []):
+        if item.get('name', '').lower() == name:
+            return item.get('value', default)
+    return default
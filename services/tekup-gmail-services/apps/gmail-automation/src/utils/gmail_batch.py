@@ -0,0 +1,140 @@
+"""
+Batched Gmail API requests.
+
+Gmail accepts up to 100 calls in one batch HTTP request, so message metadata
+for a whole result page costs a single round trip. Attachment bodies are
+large, so they go in smaller batches that are executed in parallel. Calls that
+fail transiently inside a batch (e.g. 429 rate limiting) are collected and
+sent again in a new batch after a backoff.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from src.utils.gmail_access import DEFAULT_HEADERS, METADATA, message_request
+from src.utils.gmail_http import execute_batch
+from src.utils.resilience import is_transient, max_attempts, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Gmail's hard limit on calls per batch request
+MAX_BATCH_SIZE = 100
+# Attachment responses can be several MB each - keep each batch response moderate
+ATTACHMENT_BATCH_SIZE = 10
+ATTACHMENT_PARALLELISM = 4
+
+
+def chunked(items: Iterable, size: int) -> Iterator[List]:
+    """Split any iterable (including generators) into lists of at most ``size`` items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _run_batch(service: Any, requests: Sequence[Tuple[str, Any]]) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+    pending = list(requests)
+    attempts = max_attempts()
+
+    def callback(request_id, response, exception):
+        if exception is not None:
+            errors[request_id] = exception
+        else:
+            results[request_id] = response
+
+    for attempt in range(1, attempts + 1):
+        batch = service.new_batch_http_request(callback=callback)
+        for request_id, request in pending:
+            batch.add(request, request_id=request_id)
+        execute_batch(batch, service)
+
+        retry = [(request_id, request) for request_id, request in pending
+                 if request_id in errors and is_transient(errors[request_id])]
+        if not retry or attempt == attempts:
+            break
+
+        delay = max(retry_delay(errors[request_id], attempt) for request_id, _ in retry)
+        logger.warning(f"{len(retry)} batched calls failed transiently - retry {attempt} in {delay:.1f}s")
+        time.sleep(delay)
+        for request_id, _ in retry:
+            del errors[request_id]
+        pending = retry
+    return results, errors
+
+
+def execute_batched(service: Any, requests: Sequence[Tuple[str, Any]],
+                    batch_size: int = MAX_BATCH_SIZE,
+                    parallelism: int = 1) -> Tuple[Dict[str, Any], Dict[str, Exception]]:
+    """Execute ``(request_id, HttpRequest)`` pairs in batches of ``batch_size``.
+
+    With ``parallelism`` > 1 the batches run concurrently, each thread on its
+    own transport. Returns ``(results, errors)`` keyed by request id.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    chunks = list(chunked(requests, batch_size))
+    results: Dict[str, Any] = {}
+    errors: Dict[str, Exception] = {}
+
+    if parallelism > 1 and len(chunks) > 1:
+        with ThreadPoolExecutor(max_workers=min(parallelism, len(chunks))) as pool:
+            outcomes = list(pool.map(lambda chunk: _run_batch(service, chunk), chunks))
+    else:
+        outcomes = [_run_batch(service, chunk) for chunk in chunks]
+
+    for chunk_results, chunk_errors in outcomes:
+        results.update(chunk_results)
+        errors.update(chunk_errors)
+    return results, errors
+
+
+def get_messages(service: Any, message_ids: Sequence[str], projection: str = METADATA,
+                 headers: Optional[Sequence[str]] = DEFAULT_HEADERS,
+                 batch_size: int = MAX_BATCH_SIZE) -> Dict[str, Dict]:
+    """Fetch many messages in batches; returns ``{message_id: message}``.
+
+    ``projection`` is one of the gmail_access projections (metadata by default).
+    """
+    requests = [
+        (message_id, message_request(service, message_id, projection, headers))
+        for message_id in message_ids
+    ]
+    results, errors = execute_batched(service, requests, batch_size=batch_size)
+
+    for message_id, error in errors.items():
+        logger.error(f"Error fetching message {message_id}: {error}")
+    return results
+
+
+def get_attachments(service: Any, refs: Sequence[Tuple[str, str]],
+                    batch_size: int = ATTACHMENT_BATCH_SIZE,
+                    parallelism: int = ATTACHMENT_PARALLELISM) -> Dict[Tuple[str, str], str]:
+    """Fetch attachment bodies for ``(message_id, attachment_id)`` pairs.
+
+    Returns ``{(message_id, attachment_id): base64url data}``; failed
+    downloads are logged and left out.
+    """
+    attachments = service.users().messages().attachments()
+    keys: Dict[str, Tuple[str, str]] = {}
+    requests: List[Tuple[str, Any]] = []
+
+    for index, (message_id, attachment_id) in enumerate(refs):
+        request_id = str(index)
+        keys[request_id] = (message_id, attachment_id)
+        requests.append((request_id, attachments.get(
+            userId='me', messageId=message_id, id=attachment_id)))
+
+    results, errors = execute_batched(
+        service, requests, batch_size=batch_size, parallelism=parallelism)
+
+    for request_id, error in errors.items():
+        message_id, _ = keys[request_id]
+        logger.error(f"Error downloading attachment from message {message_id}: {error}")
+
+    return {keys[request_id]: response.get('data', '') for request_id, response in results.items()}
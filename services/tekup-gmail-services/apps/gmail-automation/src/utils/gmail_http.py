@@ -0,0 +1,68 @@
+"""
+Thread-safe request execution for the Google API client.
+
+``httplib2.Http`` objects are not thread-safe, so a service object built once
+must not execute requests from several threads with its own transport. The
+helpers here hand every thread a private authorized transport that shares the
+service's credentials, as recommended by the google-api-python-client docs.
+Every call goes through the resilience layer: transient failures are retried
+with backoff and each API method has its own circuit breaker. Methods that
+must not run twice (sending mail) are only retried when Gmail cannot have
+acted on the request.
+"""
+
+import threading
+from typing import Any
+
+import httplib2
+from google_auth_httplib2 import AuthorizedHttp
+
+from src.utils.resilience import call, is_retry_safe
+
+# Retrying these after a server error or timeout could deliver a message twice
+NON_IDEMPOTENT_METHODS = frozenset({
+    'gmail.users.messages.send',
+    'gmail.users.messages.insert',
+    'gmail.users.messages.import',
+    'gmail.users.drafts.send',
+})
+
+_local = threading.local()
+
+
+def thread_http(http: Any) -> Any:
+    """Return a transport equivalent to ``http`` that is private to the calling thread"""
+    credentials = getattr(http, 'credentials', None)
+    if credentials is None:
+        # Unauthorized or custom transport - nothing we can safely clone
+        return http
+
+    transports = getattr(_local, 'transports', None)
+    if transports is None:
+        transports = _local.transports = {}
+
+    key = id(credentials)
+    if key not in transports:
+        transports[key] = AuthorizedHttp(credentials, http=httplib2.Http())
+    return transports[key]
+
+
+def endpoint_name(request: Any) -> str:
+    """Circuit breaker key for an HttpRequest, e.g. ``gmail.users.messages.send``"""
+    return getattr(request, 'methodId', None) or 'gmail'
+
+
+def execute(request: Any) -> Any:
+    """Execute a single HttpRequest on the calling thread's transport, retrying transient errors"""
+    endpoint = endpoint_name(request)
+    retry = is_retry_safe if endpoint in NON_IDEMPOTENT_METHODS else None
+    return call(endpoint, lambda: request.execute(http=thread_http(request.http)), retry=retry)
+
+
+def execute_batch(batch: Any, service: Any) -> Any:
+    """Execute a BatchHttpRequest on the calling thread's transport.
+
+    Only failures of the batch request itself are retried here; errors of
+    individual calls reach the batch callback (see gmail_batch).
+    """
+    return call('gmail.batch', lambda: batch.execute(http=thread_http(service._http)))
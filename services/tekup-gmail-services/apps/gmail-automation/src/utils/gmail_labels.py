@@ -0,0 +1,172 @@
+"""
+Cached label lookup and batched label application.
+
+Resolving a label by name costs a ``labels.list`` call, and labelling messages
+one ``messages.modify`` at a time costs a request per message. LabelManager
+resolves label IDs once per process (persisted to a small JSON file between
+runs), buffers the messages to label and applies them with
+``messages.batchModify`` - up to 1000 messages per call.
+
+Label IDs differ between Gmail accounts, also for labels with the same name,
+so the cache is kept per account (email address).
+"""
+
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+from googleapiclient.errors import HttpError
+
+from src.utils.gmail_batch import chunked
+from src.utils.gmail_http import execute
+from src.utils.pipeline import GMAIL_QUOTA_COST
+
+logger = logging.getLogger(__name__)
+
+LABEL_CACHE_FILE = 'gmail_labels.json'
+
+# Gmail's limit on message IDs per batchModify call
+MAX_BATCH_MODIFY = 1000
+
+# Label IDs already resolved in this process, per cache file and account
+_resolved: Dict[str, Dict[str, Dict[str, str]]] = {}
+_resolved_lock = threading.Lock()
+
+
+class LabelManager:
+    """Resolve label IDs once and apply labels to messages in bulk"""
+
+    def __init__(self, service: Any, account: Optional[str] = None, cache_path: Optional[str] = None,
+                 flush_size: int = MAX_BATCH_MODIFY, rate_limiter: Any = None):
+        self.service = service
+        # Email address of the mailbox; looked up with getProfile when not given
+        self.account = account
+        self.cache_path = cache_path or os.getenv('LABEL_CACHE', LABEL_CACHE_FILE)
+        self.flush_size = max(1, min(flush_size, MAX_BATCH_MODIFY))
+        self.rate_limiter = rate_limiter
+        self._pending: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+
+        with _resolved_lock:
+            if self.cache_path not in _resolved:
+                _resolved[self.cache_path] = self._load_cache()
+            self._cache = _resolved[self.cache_path]
+
+    def _load_cache(self) -> Dict[str, Dict[str, str]]:
+        if not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = dict(json.load(f))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read label cache {self.cache_path}: {e}")
+            return {}
+        # Entries of the old name -> ID format belong to no known account
+        return {account: dict(ids) for account, ids in cache.items() if isinstance(ids, dict)}
+
+    def _save_cache(self) -> None:
+        tmp_path = f"{self.cache_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._cache, f, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        except OSError as e:
+            logger.warning(f"Could not write label cache {self.cache_path}: {e}")
+
+    def _ids(self) -> Dict[str, str]:
+        """This account's cached label IDs (call with ``_resolved_lock`` held)"""
+        if self.account is None:
+            self.account = execute(self.service.users().getProfile(userId='me'))['emailAddress']
+        return self._cache.setdefault(self.account, {})
+
+    def label_id(self, name: str, create: bool = True) -> Optional[str]:
+        """Return the ID of label ``name``, creating the label if needed"""
+        with _resolved_lock:
+            ids = self._ids()
+            if name in ids:
+                return ids[name]
+
+            # One list call resolves every existing label at once
+            labels = execute(self.service.users().labels().list(userId='me'))
+            for label in labels.get('labels', []):
+                ids[label['name']] = label['id']
+
+            if name not in ids:
+                if not create:
+                    return None
+                created = execute(self.service.users().labels().create(
+                    userId='me',
+                    body={
+                        'name': name,
+                        'labelListVisibility': 'labelShow',
+                        'messageListVisibility': 'show'
+                    }
+                ))
+                ids[name] = created['id']
+                logger.info(f"Created label: {name} (ID: {created['id']})")
+
+            self._save_cache()
+            return ids[name]
+
+    def invalidate(self, name: str) -> None:
+        """Forget a cached ID (e.g. after the label was deleted in Gmail)"""
+        with _resolved_lock:
+            if self._ids().pop(name, None) is not None:
+                self._save_cache()
+
+    def add(self, message_id: str, label_name: str) -> None:
+        """Queue ``message_id`` for labelling; flushes automatically when the buffer is full"""
+        with self._lock:
+            pending = self._pending.setdefault(label_name, [])
+            pending.append(message_id)
+            ready = len(pending) >= self.flush_size
+            if ready:
+                self._pending[label_name] = []
+        if ready:
+            self._apply(label_name, pending)
+
+    def pending(self) -> int:
+        """Number of messages waiting to be labelled"""
+        with self._lock:
+            return sum(len(ids) for ids in self._pending.values())
+
+    def flush(self) -> int:
+        """Apply all queued labels; returns the number of messages labelled"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        labelled = 0
+        for label_name, message_ids in pending.items():
+            labelled += self._apply(label_name, message_ids)
+        return labelled
+
+    def _apply(self, label_name: str, message_ids: List[str]) -> int:
+        labelled = 0
+        for chunk in chunked(message_ids, MAX_BATCH_MODIFY):
+            try:
+                self._batch_modify(label_name, chunk)
+            except HttpError as error:
+                if error.resp.status not in (400, 404):
+                    logger.error(f"Could not label {len(chunk)} messages with {label_name}: {error}")
+                    continue
+                # A cached ID may point to a label deleted since - resolve again once
+                self.invalidate(label_name)
+                try:
+                    self._batch_modify(label_name, chunk)
+                except HttpError as retry_error:
+                    logger.error(f"Could not label {len(chunk)} messages with {label_name}: {retry_error}")
+                    continue
+            labelled += len(chunk)
+        return labelled
+
+    def _batch_modify(self, label_name: str, message_ids: List[str]) -> None:
+        label_id = self.label_id(label_name)
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(GMAIL_QUOTA_COST['messages.batchModify'])
+        execute(self.service.users().messages().batchModify(
+            userId='me',
+            body={'ids': message_ids, 'addLabelIds': [label_id]}
+        ))
+        logger.info(f"Labelled {len(message_ids)} messages with {label_name}")
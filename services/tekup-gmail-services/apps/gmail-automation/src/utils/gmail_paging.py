@@ -0,0 +1,63 @@
+"""
+Paginated, streaming iteration over Gmail list endpoints.
+
+Gmail list calls return at most one page per request and hand back a
+``nextPageToken`` for the rest. These helpers follow the tokens lazily so
+callers can process results page by page without building one big list.
+"""
+
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from src.utils.gmail_http import execute
+
+# Gmail accepts maxResults up to 500 for messages.list and history.list
+MAX_PAGE_SIZE = 500
+DEFAULT_PAGE_SIZE = 100
+
+
+def paginate(list_method: Callable[..., Any], items_key: str,
+             page_size: int = DEFAULT_PAGE_SIZE, limit: Optional[int] = None,
+             **kwargs: Any) -> Iterator[Dict]:
+    """Yield items from a Gmail list endpoint, one page at a time.
+
+    ``list_method`` is e.g. ``service.users().messages().list``; extra
+    keyword arguments are passed on to every page request. ``limit`` caps the
+    total number of items yielded (None = no cap).
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    page_token = None
+    yielded = 0
+
+    while True:
+        max_results = page_size if limit is None else min(page_size, limit - yielded)
+        if max_results <= 0:
+            return
+
+        response = execute(list_method(
+            pageToken=page_token,
+            maxResults=max_results,
+            **kwargs
+        ))
+
+        for item in response.get(items_key, []):
+            yield item
+            yielded += 1
+            if limit is not None and yielded >= limit:
+                return
+
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return
+
+
+def iter_messages(service, query: str, page_size: int = DEFAULT_PAGE_SIZE,
+                  limit: Optional[int] = None) -> Iterator[Dict]:
+    """Yield ``{'id': ..., 'threadId': ...}`` for every message matching ``query``"""
+    return paginate(
+        service.users().messages().list,
+        'messages',
+        page_size=page_size,
+        limit=limit,
+        userId='me',
+        q=query
+    )
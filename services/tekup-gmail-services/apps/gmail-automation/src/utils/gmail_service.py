@@ -0,0 +1,125 @@
+"""
+Process-wide Gmail service factory.
+
+Building a Gmail client costs a discovery document load and, on the OAuth
+path, unpickling and possibly refreshing the stored token. ``get_service``
+does that once per process and key: the client is built from the discovery
+document bundled with google-api-python-client (``static_discovery``, no
+network fetch), and the service and credentials are cached for every later
+caller. A background CredentialsRefresher renews the access token shortly
+before it expires, so requests never wait for a token refresh.
+"""
+
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build
+
+from src.utils.resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+# Refresh the access token this many seconds before it expires
+REFRESH_MARGIN_SECONDS = 300
+
+_services: Dict[str, Any] = {}
+_refreshers: Dict[str, 'CredentialsRefresher'] = {}
+_lock = threading.Lock()
+
+
+def build_gmail(credentials: Any) -> Any:
+    """Build a Gmail v1 client from the bundled discovery document"""
+    return build('gmail', 'v1', credentials=credentials,
+                 static_discovery=True, cache_discovery=False)
+
+
+class CredentialsRefresher:
+    """Background thread that refreshes ``credentials`` before they expire.
+
+    ``on_refresh(credentials)`` is called after every successful refresh,
+    e.g. to persist an OAuth token. Credentials without a token yet are
+    refreshed right away, so the first API call does not pay for it.
+    """
+
+    def __init__(self, credentials: Any, margin: float = REFRESH_MARGIN_SECONDS,
+                 on_refresh: Optional[Callable[[Any], None]] = None):
+        self.credentials = credentials
+        self.margin = margin
+        self.on_refresh = on_refresh
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def seconds_until_refresh(self) -> float:
+        expiry = getattr(self.credentials, 'expiry', None)
+        if not getattr(self.credentials, 'token', None) or expiry is None:
+            return 0.0
+        # google-auth stores expiry as naive UTC
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return max(0.0, (expiry - now).total_seconds() - self.margin)
+
+    def refresh(self) -> None:
+        self.credentials.refresh(Request())
+        logger.debug(f"Gmail access token refreshed (expires {self.credentials.expiry})")
+        if self.on_refresh is not None:
+            self.on_refresh(self.credentials)
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name='gmail-token-refresh', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._stop.is_set():
+            delay = self.seconds_until_refresh()
+            if delay > 0 and self._stop.wait(delay):
+                return
+            try:
+                self.refresh()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Proactive token refresh failed: {e}")
+                if self._stop.wait(backoff_delay(failures, 5, self.margin)):
+                    return
+
+
+def get_service(key: str, load_credentials: Callable[[], Any],
+                on_refresh: Optional[Callable[[Any], None]] = None,
+                refresh_in_background: bool = True) -> Any:
+    """Return the cached Gmail service for ``key``, building it on first use.
+
+    ``load_credentials`` is only called when the service is not cached yet.
+    """
+    with _lock:
+        service = _services.get(key)
+        if service is not None:
+            return service
+
+        credentials = load_credentials()
+        service = build_gmail(credentials)
+        _services[key] = service
+
+        if refresh_in_background:
+            refresher = CredentialsRefresher(credentials, on_refresh=on_refresh)
+            refresher.start()
+            _refreshers[key] = refresher
+        return service
+
+
+def reset_service(key: Optional[str] = None) -> None:
+    """Drop cached services (all, or the one for ``key``), e.g. after revoked credentials"""
+    with _lock:
+        keys = [key] if key is not None else list(_services)
+        for k in keys:
+            _services.pop(k, None)
+            refresher = _refreshers.pop(k, None)
+            if refresher is not None:
+                refresher.stop()
@@ -0,0 +1,210 @@
+"""
+Image to PDF conversion in a process pool.
+
+Decoding a phone-camera JPEG, converting it to RGB and encoding it as PDF is
+CPU-bound PIL work, and done inline it blocks the photo processors' event
+loop one image at a time. ``ImageConverter`` runs ``image_to_pdf`` in a
+``ProcessPoolExecutor`` with IMAGE_CONVERT_WORKERS processes (default: one
+per core), so a batch of receipt photos uses every core while the event loop
+keeps downloading and sending.
+
+Phone photos are also far larger than a receipt needs: a 12 MP JPEG wrapped
+as-is makes a PDF of several MB, close to e-conomic's 10 MB limit and slow
+to send. An ``ImageProfile`` (IMAGE_PROFILE) normalizes every image before
+it is wrapped: JPEGs are decoded at reduced size with ``Image.draft``, the
+rest is shrunk with ``reduce`` to a pixel budget, the EXIF orientation is
+applied and the result is stored as colour or grayscale JPEG at a set
+quality, or as bilevel (CCITT G4) for plain text. ``ImageConverter``
+reports the bytes saved.
+"""
+
+import asyncio
+import io
+import math
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, NamedTuple, Optional
+
+from PIL import Image, ImageChops, ImageFilter, ImageOps
+
+
+class ImageProfile(NamedTuple):
+    # Largest image kept, in pixels (width * height)
+    max_pixels: int
+    # 'RGB' colour, 'L' grayscale or '1' bilevel
+    mode: str
+    # JPEG quality (not used for bilevel)
+    quality: int
+    # Page resolution, so the PDF page gets a sensible paper size
+    dpi: int
+
+
+# An A4 page is about 3.9 MP at 200 dpi and 8.7 MP at 300 dpi
+PROFILES: Dict[str, Optional[ImageProfile]] = {
+    # Wrap the image unchanged
+    'original': None,
+    'color': ImageProfile(max_pixels=4_000_000, mode='RGB', quality=70, dpi=200),
+    'document': ImageProfile(max_pixels=4_000_000, mode='L', quality=60, dpi=200),
+    # Printed receipts without photos or stamps; text needs more pixels in black and white
+    'bilevel': ImageProfile(max_pixels=8_000_000, mode='1', quality=0, dpi=300),
+}
+DEFAULT_PROFILE = 'document'
+
+# Bilevel mode keeps a pixel as ink when it is this many gray levels darker
+# than the mean of its surroundings (box radius in pixels), so uneven light
+# and the table around the receipt do not turn black
+BILEVEL_RADIUS = 20
+BILEVEL_OFFSET = 18
+
+
+def image_profile(name: Optional[str] = None) -> Optional[ImageProfile]:
+    """Profile ``name`` (default: $IMAGE_PROFILE, else 'document'); None means 'original'"""
+    name = (name or os.getenv('IMAGE_PROFILE', DEFAULT_PROFILE)).lower()
+    if name not in PROFILES:
+        raise ValueError(f"Unknown image profile '{name}' (choose from {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+
+def normalize_image(image: Image.Image, profile: ImageProfile) -> Image.Image:
+    """Orient, shrink and convert ``image`` as ``profile`` prescribes"""
+    width, height = image.size
+    scale = min(1.0, math.sqrt(profile.max_pixels / (width * height)))
+    if image.format == 'JPEG':
+        # libjpeg decodes at 1/2, 1/4 or 1/8 size (and straight to grayscale) for
+        # a fraction of the cost of a full decode; the result stays >= the target
+        image.draft('RGB' if profile.mode == 'RGB' else 'L',
+                    (math.ceil(width * scale), math.ceil(height * scale)))
+
+    image = ImageOps.exif_transpose(image)
+
+    width, height = image.size
+    if width * height > profile.max_pixels:
+        scale = math.sqrt(profile.max_pixels / (width * height))
+        factor = int(1 / scale)
+        if factor >= 2:
+            # Fast box reduction by the whole factor, the rest is resampled
+            image = image.reduce(factor)
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if image.size != target:
+            image = image.resize(target, Image.BICUBIC)
+
+    if profile.mode == '1':
+        gray = image.convert('L')
+        ink = ImageChops.subtract(gray.filter(ImageFilter.BoxBlur(BILEVEL_RADIUS)), gray)
+        return ink.point(lambda darker: 0 if darker > BILEVEL_OFFSET else 255, mode='1')
+    if image.mode != profile.mode:
+        image = image.convert(profile.mode)
+    return image
+
+
+def image_to_pdf(image_data: bytes, profile: Optional[ImageProfile] = None) -> bytes:
+    """Render an image (any format PIL reads) as a one-page PDF, normalized by ``profile``"""
+    pdf_buffer = io.BytesIO()
+    with Image.open(io.BytesIO(image_data)) as image:
+        if profile is None:
+            if image.mode != 'RGB':
+                image = image.convert('RGB')
+            image.save(pdf_buffer, format='PDF')
+        else:
+            image = normalize_image(image, profile)
+            options = {'resolution': profile.dpi}
+            if image.mode != '1':
+                # Bilevel pages are stored with CCITT G4, which has no quality setting
+                options['quality'] = profile.quality
+            image.save(pdf_buffer, format='PDF', **options)
+    return pdf_buffer.getvalue()
+
+
+def default_workers() -> int:
+    """Conversion processes: IMAGE_CONVERT_WORKERS, else one per core"""
+    return int(os.getenv('IMAGE_CONVERT_WORKERS', '0')) or os.cpu_count() or 1
+
+
+class ConversionStats(NamedTuple):
+    images: int
+    image_bytes: int
+    pdf_bytes: int
+
+    @property
+    def saved(self) -> int:
+        return self.image_bytes - self.pdf_bytes
+
+    def __str__(self) -> str:
+        if not self.images:
+            return "0 images converted"
+        ratio = self.image_bytes / self.pdf_bytes if self.pdf_bytes else 0
+        return (f"{self.images} images, {self.image_bytes / 1e6:.1f} MB -> {self.pdf_bytes / 1e6:.1f} MB PDF "
+                f"({self.saved / 1e6:.1f} MB saved, {ratio:.1f}x smaller)")
+
+
+class ImageConverter:
+    """Process pool that converts image bytes to PDF bytes.
+
+    The pool is started on first use; ``close`` (or leaving a ``with`` block)
+    shuts it down. ``stats`` totals the input and PDF sizes of every
+    successful conversion.
+    """
+
+    def __init__(self, workers: Optional[int] = None, profile: Optional[str] = None):
+        self.workers = workers or default_workers()
+        self.profile = image_profile(profile)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._stats = ConversionStats(0, 0, 0)
+        self._stats_lock = threading.Lock()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, image_data: bytes) -> Future:
+        """Start converting ``image_data``; the future's result is the PDF"""
+        future = self._executor().submit(image_to_pdf, image_data, self.profile)
+        size = len(image_data)
+        future.add_done_callback(lambda done: self._record(size, done))
+        return future
+
+    def _record(self, image_size: int, future: Future) -> None:
+        # Runs on the pool's result thread
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._stats_lock:
+            images, image_bytes, pdf_bytes = self._stats
+            self._stats = ConversionStats(images + 1, image_bytes + image_size,
+                                          pdf_bytes + len(future.result()))
+
+    @property
+    def stats(self) -> ConversionStats:
+        return self._stats
+
+    async def convert(self, image_data: bytes) -> bytes:
+        """Convert ``image_data`` without blocking the event loop"""
+        return await asyncio.wrap_future(self.submit(image_data))
+
+    def imap(self, images: Iterable[bytes], prefetch: Optional[int] = None) -> Iterator[Future]:
+        """Submit ``images`` in order, yielding each one's future in the same order.
+
+        At most ``prefetch`` (default: two per worker) conversions run ahead of
+        the caller, so a lazy ``images`` keeps memory bounded for large batches.
+        """
+        prefetch = prefetch or 2 * self.workers
+        pending: Deque[Future] = deque()
+        for image_data in images:
+            pending.append(self.submit(image_data))
+            if len(pending) >= prefetch:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def __enter__(self) -> 'ImageConverter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
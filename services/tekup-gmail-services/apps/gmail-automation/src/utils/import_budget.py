@@ -0,0 +1,114 @@
+"""
+Startup import-time budget for the tekup-gmail CLI.
+
+Runs ``python -X importtime`` in a fresh interpreter and takes the
+cumulative time of the CLI module itself, i.e. everything importing it pulls
+in - interpreter startup (site, encodings, ...) is not counted. A change
+that pulls a heavy dependency (googleapiclient, PIL, pandas, ...) into CLI
+startup shows up as a failed budget check; tests/test_import_budget.py runs
+the check with the test suite. Also usable without the CLI:
+
+    python -m src.utils.import_budget --budget-ms 250
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, NamedTuple, Optional, Tuple
+
+DEFAULT_MODULE = 'src.core.main'
+DEFAULT_BUDGET_MS = 250.0
+
+# App root, so ``import src...`` resolves in the child interpreter
+_APP_ROOT = Path(__file__).resolve().parent.parent.parent
+
+
+class ImportTiming(NamedTuple):
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def budget_from_env() -> float:
+    """Budget in ms from IMPORT_BUDGET_MS (default 250)"""
+    return float(os.getenv('IMPORT_BUDGET_MS', str(DEFAULT_BUDGET_MS)))
+
+
+def parse_importtime(output: str) -> List[ImportTiming]:
+    """Parse the stderr of ``python -X importtime``"""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = line[len('import time:'):].split('|')
+        if len(parts) != 3:
+            continue
+        try:
+            self_us, cumulative_us = int(parts[0]), int(parts[1])
+        except ValueError:
+            continue  # column header
+        name = parts[2].rstrip()
+        # One space after the separator, plus two per nesting level
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append(ImportTiming(name.strip(), self_us, cumulative_us, depth))
+    return timings
+
+
+def measure_imports(module: str = DEFAULT_MODULE, python: str = sys.executable) -> List[ImportTiming]:
+    """Import ``module`` in a fresh interpreter and return every import's timing"""
+    result = subprocess.run(
+        [python, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, cwd=str(_APP_ROOT)
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+def subtree(timings: List[ImportTiming], module: str) -> List[ImportTiming]:
+    """Timings of ``module`` and everything imported while importing it.
+
+    ``-X importtime`` reports a module after its imports, indented one level
+    deeper, so the subtree is the run of deeper lines right before it.
+    """
+    for end, timing in enumerate(timings):
+        if timing.module == module:
+            start = end
+            while start > 0 and timings[start - 1].depth > timing.depth:
+                start -= 1
+            return timings[start:end + 1]
+    raise RuntimeError(f"{module} does not appear in the import timings")
+
+
+def check_budget(module: str = DEFAULT_MODULE) -> Tuple[float, List[ImportTiming]]:
+    """Return the time importing ``module`` took in ms and its direct imports, heaviest first"""
+    timings = subtree(measure_imports(module), module)
+    root = timings[-1]
+    imports = [t for t in timings if t.depth == root.depth + 1]
+    return root.cumulative_us / 1000, sorted(imports, key=lambda t: t.cumulative_us, reverse=True)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget-ms', type=float, default=None)
+    parser.add_argument('--module', default=DEFAULT_MODULE)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args(argv)
+    budget_ms = args.budget_ms if args.budget_ms is not None else budget_from_env()
+
+    total_ms, heaviest = check_budget(args.module)
+    for timing in heaviest[:args.top]:
+        print(f"{timing.cumulative_us / 1000:8.1f} ms  {timing.module}")
+
+    if total_ms > budget_ms:
+        print(f"FAIL: importing {args.module} took {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+        return 1
+    print(f"OK: importing {args.module} took {total_ms:.1f} ms (budget {budget_ms:.0f} ms)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
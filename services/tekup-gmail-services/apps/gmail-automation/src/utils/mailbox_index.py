@@ -0,0 +1,468 @@
+"""
+Local, searchable index of Gmail message metadata.
+
+The receipt finders, the sender check and the photo processor used to ask
+Gmail the same search questions on every run, one ``messages.list`` per
+vendor or keyword and one ``messages.get`` per hit. MailboxIndex keeps the
+metadata they need - message and thread ID, date, sender, subject, label IDs
+and the attachment manifest (filename, MIME type, size, attachment ID) - in
+a SQLite database with an FTS5 full-text index over sender, subject and
+attachment filenames, so those analyses become local queries.
+
+``sync`` keeps the index current: the first run (or a run after Gmail's
+history for the stored cursor expired) lists the last ``days_back`` days and
+fetches them in batches; later runs read only the mailbox history since the
+stored ``historyId`` - added and deleted messages and label changes. Gmail
+is then only needed for message bodies and attachment data. Messages whose
+fetch failed are kept in a pending table and fetched again by the next sync,
+so moving the cursor past them does not drop them from the index.
+
+The index matches sender, subject and filenames only, not body text, so
+callers use it when ``index_enabled`` says so - by default only after the
+index has been built with ``tekup-gmail index-mailbox``.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from googleapiclient.errors import HttpError
+
+from src.utils.gmail_access import ATTACHMENTS, header
+from src.utils.gmail_batch import chunked, get_messages
+from src.utils.gmail_paging import MAX_PAGE_SIZE, iter_messages, paginate
+from src.utils.sync_state import HistoryExpiredError, get_current_history_id
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_DB = 'gmail_mailbox_index.sqlite3'
+# Days of mail listed by a full scan
+DEFAULT_SCAN_DAYS = 365
+
+# Messages fetched and written per transaction during a sync
+_SYNC_CHUNK = 500
+
+_HISTORY_TYPES = ['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved']
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    rowid         INTEGER PRIMARY KEY,
+    id            TEXT NOT NULL UNIQUE,
+    thread_id     TEXT,
+    internal_date INTEGER NOT NULL,
+    sender        TEXT NOT NULL,
+    subject       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_date ON messages (internal_date);
+CREATE TABLE IF NOT EXISTS labels (
+    label_id      TEXT NOT NULL,
+    message_rowid INTEGER NOT NULL,
+    PRIMARY KEY (label_id, message_rowid)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS labels_message ON labels (message_rowid);
+CREATE TABLE IF NOT EXISTS attachments (
+    message_rowid INTEGER NOT NULL,
+    attachment_id TEXT NOT NULL,
+    filename      TEXT NOT NULL,
+    mime_type     TEXT NOT NULL,
+    size          INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attachments_message ON attachments (message_rowid);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+    sender, subject, filenames, tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS pending (
+    id            TEXT PRIMARY KEY
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sync_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+) WITHOUT ROWID;
+"""
+
+_indexes: Dict[str, 'MailboxIndex'] = {}
+_indexes_lock = threading.Lock()
+
+
+class IndexedAttachment(NamedTuple):
+    filename: str
+    mime_type: str
+    size: int
+    attachment_id: str
+
+
+class IndexedMessage(NamedTuple):
+    id: str
+    thread_id: str
+    # Gmail's internalDate, in local time
+    date: datetime
+    sender: str
+    subject: str
+    labels: Tuple[str, ...]
+    attachments: Tuple[IndexedAttachment, ...]
+
+    def as_message(self) -> Dict:
+        """The message shaped like a ``messages.get`` response in the attachments projection"""
+        return {
+            'id': self.id,
+            'threadId': self.thread_id,
+            'labelIds': list(self.labels),
+            'internalDate': str(int(self.date.timestamp() * 1000)),
+            'payload': {
+                'headers': [{'name': 'From', 'value': self.sender},
+                            {'name': 'Subject', 'value': self.subject},
+                            {'name': 'Date', 'value': format_datetime(self.date)}],
+                'parts': [{'filename': a.filename, 'mimeType': a.mime_type,
+                           'body': {'attachmentId': a.attachment_id, 'size': a.size}}
+                          for a in self.attachments],
+            },
+        }
+
+
+class SyncResult(NamedTuple):
+    full_scan: bool
+    updated: int
+    deleted: int
+    # Messages that could not be fetched; retried by the next sync
+    pending: int = 0
+
+
+def fts_phrase(text: str) -> str:
+    """FTS5 query matching ``text`` as a phrase (punctuation is ignored by the tokenizer)"""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _manifest(part: Dict) -> Iterator[IndexedAttachment]:
+    body = part.get('body', {})
+    if part.get('filename') and body.get('attachmentId'):
+        yield IndexedAttachment(part['filename'], part.get('mimeType', ''),
+                                int(body.get('size', 0)), body['attachmentId'])
+    for subpart in part.get('parts', []):
+        yield from _manifest(subpart)
+
+
+class MailboxIndex:
+    """SQLite/FTS5 index of message metadata, synced incrementally from Gmail history"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('MAILBOX_INDEX_DB', DEFAULT_INDEX_DB)
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        try:
+            conn.executescript(_SCHEMA)
+        except sqlite3.OperationalError as e:
+            raise RuntimeError(f"Mailbox index needs SQLite with FTS5: {e}") from e
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    # Sync state
+
+    def _meta(self, key: str) -> Optional[str]:
+        row = self._connection().execute(
+            'SELECT value FROM sync_meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn: sqlite3.Connection, key: str, value: str) -> None:
+        conn.execute('INSERT OR REPLACE INTO sync_meta (key, value) VALUES (?, ?)', (key, value))
+
+    @property
+    def history_id(self) -> Optional[str]:
+        return self._meta('history_id')
+
+    def pending(self) -> List[str]:
+        """IDs of messages a sync could not fetch yet"""
+        return [row[0] for row in self._connection().execute('SELECT id FROM pending ORDER BY id')]
+
+    # Writes
+
+    def _delete(self, conn: sqlite3.Connection, rowids: Sequence[int]) -> None:
+        for rowid in rowids:
+            conn.execute('DELETE FROM messages WHERE rowid = ?', (rowid,))
+            conn.execute('DELETE FROM labels WHERE message_rowid = ?', (rowid,))
+            conn.execute('DELETE FROM attachments WHERE message_rowid = ?', (rowid,))
+            conn.execute('DELETE FROM messages_fts WHERE rowid = ?', (rowid,))
+
+    def _rowids(self, conn: sqlite3.Connection, message_ids: Iterable[str]) -> Dict[str, int]:
+        rowids = {}
+        for chunk in chunked(message_ids, 500):
+            placeholders = ','.join('?' * len(chunk))
+            rowids.update(conn.execute(
+                f'SELECT id, rowid FROM messages WHERE id IN ({placeholders})', chunk).fetchall())
+        return rowids
+
+    def upsert(self, messages: Iterable[Dict]) -> int:
+        """Add or replace messages fetched with the attachments (or full) projection"""
+        conn = self._connection()
+        count = 0
+        with conn:
+            for message in messages:
+                self._delete(conn, list(self._rowids(conn, [message['id']]).values()))
+                sender, subject = header(message, 'From'), header(message, 'Subject')
+                manifest = list(_manifest(message.get('payload', {})))
+                rowid = conn.execute(
+                    'INSERT INTO messages (id, thread_id, internal_date, sender, subject) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    (message['id'], message.get('threadId'), int(message.get('internalDate', 0)),
+                     sender, subject)).lastrowid
+                conn.executemany(
+                    'INSERT OR IGNORE INTO labels (label_id, message_rowid) VALUES (?, ?)',
+                    [(label, rowid) for label in message.get('labelIds', [])])
+                conn.executemany(
+                    'INSERT INTO attachments (message_rowid, attachment_id, filename, mime_type, size) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(rowid, a.attachment_id, a.filename, a.mime_type, a.size) for a in manifest])
+                conn.execute(
+                    'INSERT INTO messages_fts (rowid, sender, subject, filenames) VALUES (?, ?, ?, ?)',
+                    (rowid, sender, subject, ' '.join(a.filename for a in manifest)))
+                count += 1
+        return count
+
+    def delete(self, message_ids: Iterable[str]) -> int:
+        """Remove messages from the index; returns how many were indexed"""
+        message_ids = list(message_ids)
+        conn = self._connection()
+        with conn:
+            rowids = list(self._rowids(conn, message_ids).values())
+            self._delete(conn, rowids)
+            conn.executemany('DELETE FROM pending WHERE id = ?', [(message_id,) for message_id in message_ids])
+        return len(rowids)
+
+    def _apply_labels(self, changes: List[Tuple[str, str, bool]]) -> None:
+        """Apply ``(message_id, label_id, added)`` changes in history order"""
+        conn = self._connection()
+        with conn:
+            rowids = self._rowids(conn, {message_id for message_id, _, _ in changes})
+            for message_id, label_id, added in changes:
+                rowid = rowids.get(message_id)
+                if rowid is None:
+                    continue
+                if added:
+                    conn.execute('INSERT OR IGNORE INTO labels (label_id, message_rowid) VALUES (?, ?)',
+                                 (label_id, rowid))
+                else:
+                    conn.execute('DELETE FROM labels WHERE label_id = ? AND message_rowid = ?',
+                                 (label_id, rowid))
+
+    def clear(self) -> None:
+        """Drop every indexed message and the sync cursor"""
+        conn = self._connection()
+        with conn:
+            for table in ('messages', 'labels', 'attachments', 'messages_fts', 'pending', 'sync_meta'):
+                conn.execute(f'DELETE FROM {table}')
+
+    # Sync
+
+    def _fetch(self, service: Any, message_ids: Sequence[str]) -> Tuple[int, int]:
+        """Fetch and index ``message_ids``; returns ``(updated, failed)``.
+        Failed messages are recorded as pending, fetched ones leave the pending table.
+        """
+        updated = failed = 0
+        for chunk in chunked(message_ids, _SYNC_CHUNK):
+            messages = get_messages(service, chunk, ATTACHMENTS)
+            updated += self.upsert(messages[message_id] for message_id in chunk if message_id in messages)
+            missing = [(message_id,) for message_id in chunk if message_id not in messages]
+            conn = self._connection()
+            with conn:
+                conn.executemany('DELETE FROM pending WHERE id = ?',
+                                 [(message_id,) for message_id in chunk if message_id in messages])
+                conn.executemany('INSERT OR IGNORE INTO pending (id) VALUES (?)', missing)
+            failed += len(missing)
+        if failed:
+            logger.warning(f"Could not fetch {failed} messages - they are retried by the next sync")
+        return updated, failed
+
+    def _history(self, service: Any, start_history_id: str) -> Tuple[Set[str], Set[str], List[Tuple[str, str, bool]]]:
+        """``(added, deleted, label changes)`` since ``start_history_id``"""
+        added: Set[str] = set()
+        deleted: Set[str] = set()
+        label_changes: List[Tuple[str, str, bool]] = []
+        records = paginate(
+            service.users().history().list,
+            'history',
+            page_size=MAX_PAGE_SIZE,
+            userId='me',
+            startHistoryId=start_history_id,
+            historyTypes=_HISTORY_TYPES
+        )
+
+        try:
+            for record in records:
+                for item in record.get('messagesAdded', []):
+                    added.add(item['message']['id'])
+                    deleted.discard(item['message']['id'])
+                for item in record.get('messagesDeleted', []):
+                    deleted.add(item['message']['id'])
+                    added.discard(item['message']['id'])
+                for key, is_added in (('labelsAdded', True), ('labelsRemoved', False)):
+                    for item in record.get(key, []):
+                        label_changes.extend((item['message']['id'], label, is_added)
+                                             for label in item.get('labelIds', []))
+        except HttpError as error:
+            if error.resp.status == 404:
+                raise HistoryExpiredError(
+                    f"historyId {start_history_id} is no longer available") from error
+            raise
+
+        return added, deleted, label_changes
+
+    def sync(self, service: Any, days_back: int = DEFAULT_SCAN_DAYS, full: bool = False) -> SyncResult:
+        """Bring the index up to date with the mailbox.
+
+        Reads the history since the stored cursor; without a cursor, with
+        ``full`` or when the history has expired, rebuilds the index from the
+        last ``days_back`` days instead.
+        """
+        # Read the cursor first: changes made while syncing are replayed next time
+        current_history_id = get_current_history_id(service)
+        start_history_id = None if full else self.history_id
+
+        result = None
+        if start_history_id:
+            try:
+                added, deleted, label_changes = self._history(service, start_history_id)
+                deleted_count = self.delete(deleted)
+                # Added messages are fetched in their current state, labels included;
+                # so are messages an earlier sync could not fetch
+                added.update(self.pending())
+                self._apply_labels([c for c in label_changes if c[0] not in added])
+                updated, failed = self._fetch(service, sorted(added))
+                result = SyncResult(False, updated, deleted_count, failed)
+            except HistoryExpiredError as e:
+                logger.warning(f"{e} - rebuilding the mailbox index")
+
+        if result is None:
+            since = (datetime.now() - timedelta(days=days_back)).strftime('%Y/%m/%d')
+            message_ids = [ref['id'] for ref in iter_messages(
+                service, f"after:{since}", page_size=MAX_PAGE_SIZE)]
+            self.clear()
+            updated, failed = self._fetch(service, message_ids)
+            result = SyncResult(True, updated, 0, failed)
+
+        conn = self._connection()
+        with conn:
+            self._set_meta(conn, 'history_id', current_history_id)
+            self._set_meta(conn, 'last_sync', str(time.time()))
+        logger.info(f"Mailbox index synced ({'full scan' if result.full_scan else 'history'}): "
+                    f"{result.updated} updated, {result.deleted} deleted, {result.pending} pending")
+        return result
+
+    # Queries
+
+    def search(self, text: Optional[str] = None, label_id: Optional[str] = None,
+               after: Optional[datetime] = None, before: Optional[datetime] = None,
+               mime_types: Optional[Sequence[str]] = None,
+               limit: Optional[int] = None) -> List[IndexedMessage]:
+        """Indexed messages, newest first.
+
+        ``text`` is an FTS5 query over sender, subject and attachment
+        filenames (use ``fts_phrase`` for literal text); ``mime_types`` keeps
+        messages with at least one attachment of those types.
+        """
+        sql = ['SELECT m.rowid, m.id, m.thread_id, m.internal_date, m.sender, m.subject FROM messages m']
+        where: List[str] = []
+        params: List[Any] = []
+        if text:
+            sql.append('JOIN messages_fts f ON f.rowid = m.rowid')
+            where.append('messages_fts MATCH ?')
+            params.append(text)
+        if label_id:
+            where.append('EXISTS (SELECT 1 FROM labels l WHERE l.label_id = ? AND l.message_rowid = m.rowid)')
+            params.append(label_id)
+        if after:
+            where.append('m.internal_date >= ?')
+            params.append(int(after.timestamp() * 1000))
+        if before:
+            where.append('m.internal_date < ?')
+            params.append(int(before.timestamp() * 1000))
+        if mime_types:
+            placeholders = ','.join('?' * len(mime_types))
+            where.append(f'EXISTS (SELECT 1 FROM attachments a WHERE a.message_rowid = m.rowid '
+                         f'AND a.mime_type IN ({placeholders}))')
+            params.extend(mime_types)
+        if where:
+            sql.append('WHERE ' + ' AND '.join(where))
+        sql.append('ORDER BY m.internal_date DESC')
+        if limit is not None:
+            sql.append('LIMIT ?')
+            params.append(limit)
+
+        conn = self._connection()
+        rows = conn.execute(' '.join(sql), params).fetchall()
+        return self._messages(conn, rows)
+
+    def _messages(self, conn: sqlite3.Connection, rows: List[Tuple]) -> List[IndexedMessage]:
+        labels: Dict[int, List[str]] = {}
+        attachments: Dict[int, List[IndexedAttachment]] = {}
+        for chunk in chunked([row[0] for row in rows], 500):
+            placeholders = ','.join('?' * len(chunk))
+            for rowid, label in conn.execute(
+                    f'SELECT message_rowid, label_id FROM labels WHERE message_rowid IN ({placeholders})',
+                    chunk):
+                labels.setdefault(rowid, []).append(label)
+            for rowid, *fields in conn.execute(
+                    f'SELECT message_rowid, filename, mime_type, size, attachment_id FROM attachments '
+                    f'WHERE message_rowid IN ({placeholders}) ORDER BY rowid', chunk):
+                attachments.setdefault(rowid, []).append(IndexedAttachment(*fields))
+
+        return [
+            IndexedMessage(message_id, thread_id or '',
+                           datetime.fromtimestamp(internal_date / 1000).astimezone(),
+                           sender, subject, tuple(sorted(labels.get(rowid, ()))),
+                           tuple(attachments.get(rowid, ())))
+            for rowid, message_id, thread_id, internal_date, sender, subject in rows
+        ]
+
+    def vendor_hits(self, vendors: Sequence[str], per_vendor: int = 5,
+                    **filters: Any) -> Dict[str, List[IndexedMessage]]:
+        """Newest ``per_vendor`` messages whose sender, subject or a filename names each vendor"""
+        return {vendor: self.search(fts_phrase(vendor), limit=per_vendor, **filters)
+                for vendor in vendors}
+
+    def stats(self) -> Dict[str, Any]:
+        """Message and attachment counts and the sync cursor"""
+        conn = self._connection()
+        return {
+            'messages': conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0],
+            'attachments': conn.execute('SELECT COUNT(*) FROM attachments').fetchone()[0],
+            'pending': conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0],
+            'history_id': self.history_id,
+            'last_sync': self._meta('last_sync'),
+        }
+
+
+def index_enabled(path: Optional[str] = None) -> bool:
+    """True if searches should be answered from the local index.
+
+    MAILBOX_INDEX=true or false forces the choice. By default (``auto``) the
+    index is only used once ``tekup-gmail index-mailbox`` has built it, so
+    nobody gets a full mailbox scan - or loses Gmail's body-text matches -
+    without asking for it.
+    """
+    setting = os.getenv('MAILBOX_INDEX', 'auto').lower()
+    if setting != 'auto':
+        return setting in ('1', 'true', 'yes')
+    path = path or os.getenv('MAILBOX_INDEX_DB', DEFAULT_INDEX_DB)
+    return os.path.exists(path) and get_mailbox_index(path).history_id is not None
+
+
+def get_mailbox_index(path: Optional[str] = None) -> MailboxIndex:
+    """Return the process-wide MailboxIndex for ``path`` (default: $MAILBOX_INDEX_DB)"""
+    path = path or os.getenv('MAILBOX_INDEX_DB', DEFAULT_INDEX_DB)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = MailboxIndex(path)
+        return _indexes[path]
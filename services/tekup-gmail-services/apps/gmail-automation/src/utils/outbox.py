@@ -0,0 +1,308 @@
+"""
+Durable outbox between building forwards and sending them.
+
+Built forwards are written to a SQLite table (WAL mode, shared between
+processes) before anything is sent, and every entry moves through
+``extracted -> sent -> labelled``:
+
+``extracted``  the RFC 822 message is stored and waits to be sent
+``sent``       Gmail accepted it; the body is dropped, the source email
+               still needs its processed label
+``labelled``   the source email is labelled - nothing left to do
+
+A crash therefore never loses or repeats work that was recorded: queued
+forwards are sent by the next run (or ``tekup-gmail drain-outbox``), and
+emails whose forwards went out are labelled without being sent again.
+Senders take entries with a time-limited lease, so several processes can
+drain the same outbox concurrently without sending an entry twice; a lease
+left behind by a crashed process expires after ``lease_seconds``. A sender
+renews its lease right before sending and only records the result while it
+still holds the lease, so an entry another process has taken over is left
+to that process. Only the moment between Gmail accepting a message and
+``mark_sent`` is unprotected.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTBOX_DB = 'gmail_outbox.sqlite3'
+
+EXTRACTED = 'extracted'
+SENT = 'sent'
+LABELLED = 'labelled'
+# Gave up after MAX_ATTEMPTS failed sends; ``retry_failed`` queues them again
+FAILED = 'failed'
+
+# Seconds a sender may hold an entry before another process may take it over
+DEFAULT_LEASE_SECONDS = 600
+MAX_ATTEMPTS = 5
+# Seconds before a failed entry is retried, multiplied by its attempt count
+RETRY_DELAY = 60
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id          INTEGER PRIMARY KEY,
+    message_id  TEXT NOT NULL,
+    digests     TEXT NOT NULL,
+    filenames   TEXT NOT NULL,
+    destination TEXT NOT NULL,
+    body        BLOB,
+    state       TEXT NOT NULL,
+    lease_owner TEXT,
+    lease_until REAL,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    last_error  TEXT,
+    sent_id     TEXT,
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL,
+    UNIQUE (message_id, digests)
+);
+CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, lease_until);
+CREATE INDEX IF NOT EXISTS outbox_message ON outbox (message_id, state);
+"""
+
+_outboxes: Dict[str, 'Outbox'] = {}
+_outboxes_lock = threading.Lock()
+
+
+class OutboxEntry(NamedTuple):
+    id: int
+    message_id: str
+    digests: List[str]
+    filenames: List[str]
+    destination: str
+    body: bytes
+    attempts: int
+
+
+class DrainResult(NamedTuple):
+    sent: int
+    failed: int
+    labelled: int
+
+
+def outbox_enabled() -> bool:
+    """True unless OUTBOX turns the durable outbox off"""
+    return os.getenv('OUTBOX', 'true').lower() in ('1', 'true', 'yes')
+
+
+class Outbox:
+    """SQLite-backed queue of built forwards, drained under leases"""
+
+    def __init__(self, path: Optional[str] = None, lease_seconds: int = DEFAULT_LEASE_SECONDS):
+        self.path = path or os.getenv('OUTBOX_DB', DEFAULT_OUTBOX_DB)
+        self.lease_seconds = lease_seconds
+        # Identifies this process' leases, also across hosts sharing the file
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript(_SCHEMA)
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _write(self, sql: str, params: Sequence = ()) -> int:
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rowcount = conn.execute(sql, params).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return rowcount
+
+    def enqueue(self, message_id: str, destination: str, digests: Sequence[str],
+                filenames: Sequence[str], body: bytes) -> bool:
+        """Store a built forward; False if this forward of ``message_id`` is already queued or sent"""
+        now = time.time()
+        return self._write(
+            "INSERT OR IGNORE INTO outbox "
+            "(message_id, digests, filenames, destination, body, state, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (message_id, json.dumps(sorted(digests)), json.dumps(list(filenames)),
+             destination, body, EXTRACTED, now, now)) == 1
+
+    def lease(self, limit: Optional[int] = None, message_id: Optional[str] = None) -> List[OutboxEntry]:
+        """Take up to ``limit`` (default all) unsent entries, only those of ``message_id`` if given"""
+        now = time.time()
+        where = "state = ? AND (lease_until IS NULL OR lease_until < ?)"
+        params: List = [EXTRACTED, now]
+        if message_id is not None:
+            where += " AND message_id = ?"
+            params.append(message_id)
+
+        conn = self._connection()
+        # Select and lease in one write transaction, so no other process leases the same rows
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            rows = conn.execute(
+                "SELECT id, message_id, digests, filenames, destination, body, attempts "
+                f"FROM outbox WHERE {where} ORDER BY id LIMIT ?",
+                params + [-1 if limit is None else limit]).fetchall()
+            conn.executemany(
+                "UPDATE outbox SET lease_owner = ?, lease_until = ?, updated_at = ? WHERE id = ?",
+                [(self.owner, now + self.lease_seconds, now, row[0]) for row in rows])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+        return [OutboxEntry(row[0], row[1], json.loads(row[2]), json.loads(row[3]), row[4], row[5], row[6])
+                for row in rows]
+
+    def renew(self, entry_id: int) -> bool:
+        """Extend this sender's lease on an entry; False if another sender has taken it over"""
+        now = time.time()
+        return self._write(
+            "UPDATE outbox SET lease_until = ?, updated_at = ? "
+            "WHERE id = ? AND state = ? AND lease_owner = ?",
+            (now + self.lease_seconds, now, entry_id, EXTRACTED, self.owner)) == 1
+
+    def mark_sent(self, entry_id: int, sent_id: Optional[str] = None) -> bool:
+        """Record a leased entry as sent and drop its stored message.
+        False if the lease was lost to another sender, which then owns the entry.
+        """
+        return self._write(
+            "UPDATE outbox SET state = ?, body = NULL, sent_id = ?, lease_owner = NULL, "
+            "lease_until = NULL, updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+            (SENT, sent_id, time.time(), entry_id, EXTRACTED, self.owner)) == 1
+
+    def fail(self, entry_id: int, error: str) -> bool:
+        """Give a leased entry back after a failed send; True if it will be retried.
+        A lease lost to another sender is left alone (and counts as retried).
+        """
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT attempts FROM outbox WHERE id = ?", (entry_id,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            state = EXTRACTED if attempts < MAX_ATTEMPTS else FAILED
+            updated = conn.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, last_error = ?, lease_owner = NULL, "
+                "lease_until = ?, updated_at = ? WHERE id = ? AND state = ? AND lease_owner = ?",
+                (state, attempts, str(error), now + RETRY_DELAY * attempts, now, entry_id, EXTRACTED,
+                 self.owner)).rowcount
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return state == EXTRACTED or not updated
+
+    def has_entries(self, message_id: str) -> bool:
+        """True if any forward of ``message_id`` went through the outbox"""
+        row = self._connection().execute(
+            "SELECT 1 FROM outbox WHERE message_id = ? LIMIT 1", (message_id,)).fetchone()
+        return row is not None
+
+    def ready_to_label(self, limit: Optional[int] = None) -> List[str]:
+        """Source emails whose forwards are all sent but which are not labelled yet"""
+        rows = self._connection().execute(
+            "SELECT message_id FROM outbox GROUP BY message_id "
+            "HAVING SUM(state = ?) > 0 AND SUM(state IN (?, ?)) = 0 "
+            "ORDER BY MIN(id) LIMIT ?",
+            (SENT, EXTRACTED, FAILED, -1 if limit is None else limit)).fetchall()
+        return [row[0] for row in rows]
+
+    def mark_labelled(self, message_ids: Iterable[str]) -> None:
+        """Record source emails as labelled"""
+        now = time.time()
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.executemany(
+                "UPDATE outbox SET state = ?, updated_at = ? WHERE message_id = ? AND state = ?",
+                [(LABELLED, now, message_id, SENT) for message_id in message_ids])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def retry_failed(self) -> int:
+        """Queue entries that gave up after MAX_ATTEMPTS again; returns how many"""
+        return self._write(
+            "UPDATE outbox SET state = ?, attempts = 0, lease_until = NULL, updated_at = ? WHERE state = ?",
+            (EXTRACTED, time.time(), FAILED))
+
+    def purge(self, older_than_days: int = 30) -> int:
+        """Delete labelled entries last touched more than ``older_than_days`` ago"""
+        return self._write(
+            "DELETE FROM outbox WHERE state = ? AND updated_at < ?",
+            (LABELLED, time.time() - older_than_days * 86400))
+
+    def counts(self) -> Dict[str, int]:
+        """Number of entries per state"""
+        counts = {EXTRACTED: 0, SENT: 0, LABELLED: 0, FAILED: 0}
+        counts.update(self._connection().execute(
+            "SELECT state, COUNT(*) FROM outbox GROUP BY state").fetchall())
+        return counts
+
+    def drain(self, send: Callable[[OutboxEntry], Optional[str]],
+              label: Callable[[List[str]], None],
+              batch_size: int = 10, limit: Optional[int] = None) -> DrainResult:
+        """Send queued entries, then label every source email whose forwards are all sent.
+
+        ``send`` returns the Gmail ID of the sent message and raises on
+        failure; ``label`` applies the processed label to a list of emails.
+        Stops after ``limit`` send attempts, or when nothing is left to lease.
+        """
+        sent = failed = 0
+        while limit is None or sent + failed < limit:
+            size = batch_size if limit is None else min(batch_size, limit - sent - failed)
+            entries = self.lease(size)
+            if not entries:
+                break
+            for entry in entries:
+                if not self.renew(entry.id):
+                    # Earlier sends of the batch outlasted the lease and another sender took over
+                    logger.warning(f"Outbox entry {entry.id} lost its lease - left to the new holder")
+                    continue
+                try:
+                    sent_id = send(entry)
+                except Exception as e:
+                    retry = self.fail(entry.id, str(e))
+                    logger.warning(f"Outbox entry {entry.id} ({', '.join(entry.filenames)}) failed"
+                                   f"{'' if retry else ' for good'}: {e}")
+                    failed += 1
+                    continue
+                if not self.mark_sent(entry.id, sent_id):
+                    logger.warning(f"Outbox entry {entry.id} was sent after its lease was taken over")
+                sent += 1
+
+        labelled = self.label_sent(label)
+        return DrainResult(sent, failed, labelled)
+
+    def label_sent(self, label: Callable[[List[str]], None]) -> int:
+        """Label every source email whose forwards are all sent; returns how many"""
+        message_ids = self.ready_to_label()
+        if message_ids:
+            label(message_ids)
+            self.mark_labelled(message_ids)
+        return len(message_ids)
+
+
+def get_outbox(path: Optional[str] = None) -> Outbox:
+    """Return the process-wide Outbox for ``path`` (default: $OUTBOX_DB)"""
+    path = path or os.getenv('OUTBOX_DB', DEFAULT_OUTBOX_DB)
+    with _outboxes_lock:
+        if path not in _outboxes:
+            _outboxes[path] = Outbox(path)
+        return _outboxes[path]
@@ -0,0 +1,197 @@
+"""
+Staged worker pipeline with bounded queues and a shared rate limiter.
+
+Each stage runs a configurable number of worker threads that take items from
+a bounded input queue, call the stage function and hand the result to the
+next stage. A stage function returns the (possibly updated) item, or None to
+drop it. Bounded queues keep memory flat: a slow stage back-pressures the
+stages before it instead of letting work pile up.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Gmail per-user limit: 250 quota units per second
+GMAIL_QUOTA_UNITS_PER_SECOND = 250
+
+# Quota units per Gmail API method
+GMAIL_QUOTA_COST = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'attachments.get': 5,
+    'messages.send': 100,
+    'messages.modify': 5,
+    'messages.batchModify': 50,
+    'history.list': 2,
+}
+
+_DONE = object()
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float = 1) -> None:
+        """Block until ``units`` tokens are available and take them.
+
+        Requests larger than ``capacity`` are paid for in capacity-sized
+        slices, so they still cost their full amount.
+        """
+        while units > 0:
+            part = min(units, self.capacity)
+            self._take(part)
+            units -= part
+
+    def _take(self, units: float) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= units:
+                    self._tokens -= units
+                    return
+
+                wait = (units - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Counters:
+    """Thread-safe named counters for pipeline statistics"""
+
+    def __init__(self, *names: str):
+        self._values = {name: 0 for name in names}
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + amount
+
+    def __getitem__(self, name: str) -> int:
+        return self._values.get(name, 0)
+
+    def as_dict(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._values)
+
+
+class Stage:
+    """One pipeline step: ``func(item) -> item | None`` run by ``workers`` threads"""
+
+    def __init__(self, name: str, func: Callable[[Any], Any], workers: int = 1):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+
+
+class Pipeline:
+    """Run items through stages connected by bounded queues.
+
+    ``on_error(stage_name, item, error)`` is called for every item a stage
+    raised on, e.g. to dead-letter it.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 10,
+                 on_error: Optional[Callable[[str, Any, Exception], None]] = None):
+        if not stages:
+            raise ValueError("Pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.on_error = on_error
+
+    def run(self, items: Iterable[Any]) -> Dict[str, int]:
+        """Feed ``items`` through all stages and block until everything is done.
+
+        Returns counts of items that completed, were dropped by a stage
+        (returned None) or failed with an exception.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        counters = Counters('completed', 'dropped', 'failed')
+        finished = [0] * len(self.stages)
+        finished_lock = threading.Lock()
+        threads = []
+
+        def worker(index: int) -> None:
+            stage = self.stages[index]
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(self.stages) else None
+
+            while True:
+                item = inbox.get()
+                if item is _DONE:
+                    break
+
+                try:
+                    result = stage.func(item)
+                except Exception as e:
+                    logger.error(f"Pipeline stage '{stage.name}' failed: {e}", exc_info=True)
+                    counters.incr('failed')
+                    if self.on_error is not None:
+                        try:
+                            self.on_error(stage.name, item, e)
+                        except Exception:
+                            logger.exception(f"Pipeline error handler failed for stage '{stage.name}'")
+                    continue
+
+                if result is None:
+                    counters.incr('dropped')
+                elif outbox is not None:
+                    outbox.put(result)
+                else:
+                    counters.incr('completed')
+
+            # The last worker of a stage to finish shuts down the next stage
+            with finished_lock:
+                finished[index] += 1
+                last = finished[index] == stage.workers
+            if last and outbox is not None:
+                for _ in range(self.stages[index + 1].workers):
+                    outbox.put(_DONE)
+
+        for index, stage in enumerate(self.stages):
+            for n in range(stage.workers):
+                thread = threading.Thread(
+                    target=worker, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                queues[0].put(item)
+        finally:
+            for _ in range(self.stages[0].workers):
+                queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        return counters.as_dict()
+
+
+def parse_workers(value: Optional[str], defaults: Dict[str, int]) -> Dict[str, int]:
+    """Parse ``"fetch=4,send=2"`` into per-stage worker counts on top of ``defaults``"""
+    workers = dict(defaults)
+    if not value:
+        return workers
+
+    for entry in value.split(','):
+        if not entry.strip():
+            continue
+        name, _, count = entry.partition('=')
+        name = name.strip()
+        if name not in workers:
+            raise ValueError(f"Unknown pipeline stage '{name}' (expected one of {', '.join(workers)})")
+        workers[name] = max(1, int(count))
+    return workers
@@ -0,0 +1,356 @@
+"""
+Push-driven processing for Gmail mailbox changes.
+
+``users.watch`` makes Gmail publish a Pub/Sub message whenever the mailbox
+changes; a push subscription delivers it as an HTTP POST to PushReceiver.
+Notifications only carry the new ``historyId``, so bursts are coalesced in a
+NotificationQueue and PushRunner runs one incremental sync per burst, within
+seconds of the mail arriving. A low-frequency poll stays as a safety net for
+lost notifications, and the watch (valid for 7 days) is renewed daily.
+
+Without a Pub/Sub topic the receiver still runs and accepts notifications
+from anything that POSTs the same envelope (see ``encode_notification``),
+which makes a local stand-in for testing.
+"""
+
+import base64
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, Optional, Sequence
+from urllib.parse import parse_qs, urlsplit
+
+from src.utils.gmail_http import execute
+from src.utils.resilience import backoff_delay
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PUSH_PATH = '/gmail/push'
+DEFAULT_PUSH_PORT = 8085
+
+# Gmail watches expire after 7 days; Google recommends renewing daily
+WATCH_RENEW_SECONDS = 24 * 3600
+DEFAULT_POLL_HOURS = 6.0
+# Wait this long after a notification so a burst becomes one run
+DEFAULT_DEBOUNCE_SECONDS = 5.0
+
+_MAX_BODY_BYTES = 64 * 1024
+
+
+def start_watch(service: Any, topic_name: str,
+                label_ids: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """Start (or renew) push notifications to ``topic_name``; returns historyId and expiration"""
+    body: Dict[str, Any] = {'topicName': topic_name}
+    if label_ids:
+        body['labelIds'] = list(label_ids)
+        body['labelFilterBehavior'] = 'include'
+    response = execute(service.users().watch(userId='me', body=body))
+    logger.info(f"Gmail watch on {topic_name} active from historyId {response.get('historyId')}")
+    return response
+
+
+def stop_watch(service: Any) -> None:
+    """Stop push notifications for the mailbox"""
+    execute(service.users().stop(userId='me'))
+
+
+def encode_notification(email_address: str, history_id: Any, message_id: str = 'local') -> bytes:
+    """Build a Pub/Sub push body as Gmail would send it"""
+    data = json.dumps({'emailAddress': email_address, 'historyId': int(history_id)})
+    return json.dumps({
+        'message': {
+            'data': base64.b64encode(data.encode('utf-8')).decode('ascii'),
+            'messageId': message_id,
+        },
+        'subscription': 'local',
+    }).encode('utf-8')
+
+
+def decode_notification(body: bytes) -> Dict[str, Any]:
+    """Return ``{'email_address', 'history_id'}`` from a Pub/Sub push body.
+
+    Raises ValueError for anything that is not a Gmail notification.
+    """
+    try:
+        envelope = json.loads(body)
+        data = json.loads(base64.b64decode(envelope['message']['data']))
+        return {
+            'email_address': data.get('emailAddress'),
+            'history_id': int(data['historyId']),
+        }
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Not a Gmail push notification: {e}") from e
+
+
+class NotificationQueue:
+    """Coalescing queue of mailbox history IDs.
+
+    Only the highest pending ``historyId`` is kept, and IDs at or below the
+    last processed one are ignored, so any number of notifications between
+    two runs costs one run.
+    """
+
+    def __init__(self):
+        self._pending: Optional[int] = None
+        self._processed = 0
+        self._woken = False
+        self._cond = threading.Condition()
+
+    def put(self, history_id: int) -> bool:
+        """Queue a change; returns False if it is already covered"""
+        with self._cond:
+            if history_id <= self._processed or (self._pending or 0) >= history_id:
+                return False
+            self._pending = history_id
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: Optional[float] = None) -> Optional[int]:
+        """Wait up to ``timeout`` seconds for a change; returns its historyId or None"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending is not None or self._woken, timeout)
+            self._woken = False
+            history_id, self._pending = self._pending, None
+            return history_id
+
+    def mark_processed(self, history_id: int) -> None:
+        """Changes up to ``history_id`` are handled - drop notifications for them"""
+        with self._cond:
+            self._processed = max(self._processed, int(history_id))
+            if self._pending is not None and self._pending <= self._processed:
+                self._pending = None
+
+    def wake(self) -> None:
+        """Return from a blocked ``get`` without a change (used on shutdown)"""
+        with self._cond:
+            self._woken = True
+            self._cond.notify_all()
+
+
+class _PushHandler(BaseHTTPRequestHandler):
+    server: '_PushServer'
+
+    def do_POST(self) -> None:
+        url = urlsplit(self.path)
+        if url.path != self.server.push_path:
+            self.send_error(404)
+            return
+
+        if self.server.token is not None:
+            token = parse_qs(url.query).get('token', [''])[0]
+            if not hmac.compare_digest(token, self.server.token):
+                self.send_error(403)
+                return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > _MAX_BODY_BYTES:
+            self.send_error(413)
+            return
+
+        try:
+            notification = decode_notification(self.rfile.read(length))
+        except ValueError as e:
+            logger.warning(f"Rejected push request: {e}")
+            self.send_error(400)
+            return
+
+        if self.server.queue.put(notification['history_id']):
+            logger.info(f"Push notification for {notification['email_address']} "
+                        f"(historyId {notification['history_id']})")
+        # Any 2xx acknowledges the message to Pub/Sub
+        self.send_response(204)
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        # Health check for load balancers / uptime probes
+        if urlsplit(self.path).path == '/healthz':
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(b'ok')
+        else:
+            self.send_error(404)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+
+class _PushServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, queue: NotificationQueue, push_path: str, token: Optional[str]):
+        super().__init__(address, _PushHandler)
+        self.queue = queue
+        self.push_path = push_path
+        self.token = token
+
+
+class PushReceiver:
+    """HTTP endpoint for Pub/Sub push deliveries, feeding a NotificationQueue.
+
+    If ``token`` is set, requests must carry it as ``?token=...`` (configure
+    the push subscription endpoint with the same query parameter).
+    """
+
+    def __init__(self, queue: NotificationQueue, host: str = '0.0.0.0',
+                 port: int = DEFAULT_PUSH_PORT, path: str = DEFAULT_PUSH_PATH,
+                 token: Optional[str] = None):
+        self.queue = queue
+        self.host = host
+        self.port = port
+        self.path = path
+        self.token = token or None
+        self._server: Optional[_PushServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def address(self):
+        """``(host, port)`` actually bound (port 0 picks a free one)"""
+        return self._server.server_address if self._server else (self.host, self.port)
+
+    def start(self) -> None:
+        """Serve in a background thread"""
+        self._server = _PushServer((self.host, self.port), self.queue, self.path, self.token)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='push-receiver', daemon=True)
+        self._thread.start()
+        host, port = self.address[:2]
+        logger.info(f"Push receiver listening on http://{host}:{port}{self.path}")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+
+
+class PushRunner:
+    """Run ``process`` once per burst of notifications, with polling as a safety net.
+
+    ``renew_watch`` (optional) starts/renews the Gmail watch and returns the
+    mailbox historyId at that moment; it is called at startup and every
+    ``renew_interval`` seconds. A failed run is retried with backoff.
+    """
+
+    def __init__(self, process: Callable[[], Any], queue: NotificationQueue,
+                 poll_interval: float = DEFAULT_POLL_HOURS * 3600,
+                 debounce: float = DEFAULT_DEBOUNCE_SECONDS,
+                 renew_watch: Optional[Callable[[], Optional[int]]] = None,
+                 renew_interval: float = WATCH_RENEW_SECONDS):
+        self.process = process
+        self.queue = queue
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.renew_watch = renew_watch
+        self.renew_interval = renew_interval
+        self.runs = 0
+        self._failures = 0
+        self._stop = threading.Event()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self.queue.wake()
+
+    def _renew(self) -> Optional[int]:
+        if self.renew_watch is None:
+            return None
+        try:
+            return self.renew_watch()
+        except Exception as e:
+            logger.error(f"Could not renew Gmail watch: {e}", exc_info=True)
+            return None
+
+    def _run(self, reason: str, history_id: Optional[int] = None) -> bool:
+        logger.info(f"Processing mailbox ({reason})")
+        try:
+            self.process()
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Processing failed ({reason}): {e}", exc_info=True)
+            return False
+        self.runs += 1
+        self._failures = 0
+        if history_id is not None:
+            self.queue.mark_processed(history_id)
+        return True
+
+    def run_forever(self) -> None:
+        """Block until ``stop`` is called"""
+        watch_history_id = self._renew()
+        next_renew = time.monotonic() + self.renew_interval
+
+        ok = self._run('startup', watch_history_id)
+        next_poll = time.monotonic() + (
+            self.poll_interval if ok else backoff_delay(self._failures, 60, self.poll_interval))
+
+        while not self._stop.is_set():
+            timeout = max(0.0, min(next_poll, next_renew) - time.monotonic())
+            history_id = self.queue.get(timeout)
+            if self._stop.is_set():
+                break
+
+            if history_id is not None:
+                # Let the rest of a burst arrive, then handle it in one run
+                if self._stop.wait(self.debounce):
+                    break
+                history_id = max(history_id, self.queue.get(0) or 0)
+                ok = self._run(f"push, historyId {history_id}", history_id)
+                if not ok:
+                    next_poll = min(next_poll, time.monotonic() + backoff_delay(
+                        self._failures, 60, self.poll_interval))
+
+            now = time.monotonic()
+            if now >= next_poll:
+                ok = self._run('safety-net poll')
+                next_poll = now + (self.poll_interval if ok else backoff_delay(
+                    self._failures, 60, self.poll_interval))
+
+            if now >= next_renew:
+                self._renew()
+                next_renew = now + self.renew_interval
+
+
+def run_push_service(service: Any, process: Callable[[], Any],
+                     topic_name: Optional[str] = None) -> None:
+    """Serve push notifications and run ``process`` on changes until interrupted.
+
+    Settings come from the environment: GMAIL_PUSH_TOPIC, PUSH_HOST, PUSH_PORT,
+    PUSH_PATH, PUSH_TOKEN, PUSH_POLL_INTERVAL_HOURS, PUSH_DEBOUNCE_SECONDS.
+    Without a topic no watch is registered and only the receiver (a local
+    stand-in) and the safety-net poll drive processing.
+    """
+    topic_name = topic_name or os.getenv('GMAIL_PUSH_TOPIC')
+    queue = NotificationQueue()
+    receiver = PushReceiver(
+        queue,
+        host=os.getenv('PUSH_HOST', '0.0.0.0'),
+        port=int(os.getenv('PUSH_PORT', str(DEFAULT_PUSH_PORT))),
+        path=os.getenv('PUSH_PATH', DEFAULT_PUSH_PATH),
+        token=os.getenv('PUSH_TOKEN'),
+    )
+
+    renew_watch = None
+    if topic_name:
+        def renew_watch() -> int:
+            return int(start_watch(service, topic_name)['historyId'])
+    else:
+        logger.warning("GMAIL_PUSH_TOPIC not set - no Gmail watch, relying on local "
+                       "notifications and the safety-net poll")
+
+    runner = PushRunner(
+        process, queue,
+        poll_interval=float(os.getenv('PUSH_POLL_INTERVAL_HOURS', str(DEFAULT_POLL_HOURS))) * 3600,
+        debounce=float(os.getenv('PUSH_DEBOUNCE_SECONDS', str(DEFAULT_DEBOUNCE_SECONDS))),
+        renew_watch=renew_watch,
+    )
+
+    receiver.start()
+    try:
+        runner.run_forever()
+    finally:
+        runner.stop()
+        receiver.stop()
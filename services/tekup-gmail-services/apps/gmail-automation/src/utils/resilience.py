@@ -0,0 +1,397 @@
+"""
+Retries, circuit breakers and a dead-letter queue for Gmail and e-conomic calls.
+
+Transient failures - 429 quota errors, 5xx responses, dropped connections -
+are retried with exponential backoff and jitter, honouring the server's
+``Retry-After`` header when it sends one. Every endpoint has its own circuit
+breaker: after ``failure_threshold`` consecutive transient failures it opens
+and calls fail fast with CircuitOpenError for ``reset_timeout`` seconds, then
+a single trial call decides whether it closes again. Work items that still
+fail are appended to a dead-letter queue so a later run can pick them up
+instead of losing them.
+
+Calls that must not run twice - sending a message, creating a voucher - pass
+``retry=is_retry_safe``: after a 5xx or a read timeout the server may already
+have acted, so only rate limiting and failures to connect are retried.
+"""
+
+import email.utils
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httplib2
+import httpx
+from googleapiclient.errors import HttpError
+from tenacity import AsyncRetrying, Retrying, retry_if_exception, stop_after_attempt
+from tenacity.wait import wait_base
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+
+# Gmail reports per-user rate limiting as 403 with one of these reasons
+_RATE_LIMIT_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+_TRANSIENT_ERRORS = (
+    httpx.TransportError,
+    httplib2.HttpLib2Error,
+    ConnectionError,
+    TimeoutError,
+    socket.timeout,
+)
+
+# Failures to reach the server at all, so the request cannot have been acted on
+_CONNECT_ERRORS = (
+    httpx.ConnectError,
+    httpx.ConnectTimeout,
+    httplib2.ServerNotFoundError,
+    ConnectionRefusedError,
+    socket.gaierror,
+)
+
+DEFAULT_MAX_ATTEMPTS = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+# Upper bound on a server-requested Retry-After wait
+MAX_RETRY_AFTER = 300.0
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT = 60.0
+
+DEAD_LETTER_FILE = 'gmail_dead_letters.jsonl'
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit breaker is open"""
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Circuit for {endpoint} is open - retry in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+def max_attempts() -> int:
+    """Attempts per call, including the first (RETRY_MAX_ATTEMPTS)"""
+    return max(1, int(os.getenv('RETRY_MAX_ATTEMPTS', str(DEFAULT_MAX_ATTEMPTS))))
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of a Gmail, httpx or e-conomic error (None if there was no response)"""
+    if isinstance(error, HttpError):
+        return int(error.resp.status)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return getattr(error, 'status_code', None)
+
+
+def is_rate_limited(error: BaseException) -> bool:
+    """True for 429 responses and Gmail's rate-limit 403s"""
+    status = status_code(error)
+    if status == 403 and isinstance(error, HttpError):
+        content = error.content if isinstance(error.content, bytes) else str(error.content).encode()
+        return any(reason in content for reason in _RATE_LIMIT_REASONS)
+    return status == 429
+
+
+def is_transient(error: BaseException) -> bool:
+    """True for errors worth retrying: quota, server and connection failures"""
+    if isinstance(error, _TRANSIENT_ERRORS) or is_rate_limited(error):
+        return True
+    return status_code(error) in RETRYABLE_STATUS
+
+
+def is_retry_safe(error: BaseException) -> bool:
+    """Retry test for non-idempotent calls: only errors the server cannot have acted on"""
+    return isinstance(error, _CONNECT_ERRORS) or is_rate_limited(error)
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the server asked us to wait before retrying, if it said so"""
+    value = getattr(error, 'retry_after', None)
+    if value is None:
+        if isinstance(error, HttpError):
+            value = error.resp.get('retry-after')
+        elif isinstance(error, httpx.HTTPStatusError):
+            value = error.response.headers.get('retry-after')
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    # Retry-After may also be an HTTP date
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_CAP) -> float:
+    """Exponential backoff with jitter for the ``attempt``-th retry (1-based).
+
+    The delay is drawn from the upper half of ``base * 2**(attempt-1)``
+    (capped), so concurrent workers spread out but never retry immediately.
+    """
+    delay = min(cap, base * 2 ** max(0, attempt - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def retry_delay(error: BaseException, attempt: int) -> float:
+    """Delay before retrying after ``error``: Retry-After if given, else backoff"""
+    delay = retry_after(error)
+    if delay is not None:
+        return min(delay, MAX_RETRY_AFTER)
+    return backoff_delay(attempt)
+
+
+class wait_retry_after(wait_base):
+    """tenacity wait strategy built on ``retry_delay``"""
+
+    def __call__(self, retry_state: Any) -> float:
+        return retry_delay(retry_state.outcome.exception(), retry_state.attempt_number)
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker for one endpoint (thread-safe)"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, failure_threshold: Optional[int] = None,
+                 reset_timeout: Optional[float] = None):
+        self.name = name
+        self.failure_threshold = failure_threshold or int(
+            os.getenv('CIRCUIT_FAILURE_THRESHOLD', str(DEFAULT_FAILURE_THRESHOLD)))
+        self.reset_timeout = reset_timeout or float(
+            os.getenv('CIRCUIT_RESET_SECONDS', str(DEFAULT_RESET_TIMEOUT)))
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def before_call(self) -> None:
+        """Raise CircuitOpenError unless a call may go through now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self.state = self.HALF_OPEN
+                self._trial_running = False
+
+            if self.state == self.HALF_OPEN:
+                # Only one trial call at a time while half-open
+                if self._trial_running:
+                    raise CircuitOpenError(self.name, self.reset_timeout)
+                self._trial_running = True
+
+    def record_success(self) -> None:
+        """The endpoint answered (any non-transient outcome counts)"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit for {self.name} closed again")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        """The endpoint failed transiently"""
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(f"Circuit for {self.name} opened after {self.failures} failures "
+                                   f"- pausing calls for {self.reset_timeout:.0f}s")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint: str) -> CircuitBreaker:
+    """Return the process-wide circuit breaker for ``endpoint``"""
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+
+def _log_retry(endpoint: str) -> Callable[[Any], None]:
+    def log(retry_state: Any) -> None:
+        logger.warning(f"{endpoint}: {retry_state.outcome.exception()} - retry "
+                       f"{retry_state.attempt_number} in {retry_state.next_action.sleep:.1f}s")
+    return log
+
+
+def _policy(endpoint: str, attempts: Optional[int],
+            retry: Optional[Callable[[BaseException], bool]]) -> Dict[str, Any]:
+    return {
+        'stop': stop_after_attempt(attempts or max_attempts()),
+        'wait': wait_retry_after(),
+        'retry': retry_if_exception(retry or is_transient),
+        'before_sleep': _log_retry(endpoint),
+        'reraise': True,
+    }
+
+
+def _attempt(breaker: CircuitBreaker, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    breaker.before_call()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as error:
+        if is_transient(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+
+async def _async_attempt(breaker: CircuitBreaker, func: Callable[..., Awaitable[Any]],
+                         *args: Any, **kwargs: Any) -> Any:
+    breaker.before_call()
+    try:
+        result = await func(*args, **kwargs)
+    except Exception as error:
+        if is_transient(error):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        raise
+    breaker.record_success()
+    return result
+
+
+def call(endpoint: str, func: Callable[..., Any], *args: Any,
+         attempts: Optional[int] = None,
+         retry: Optional[Callable[[BaseException], bool]] = None, **kwargs: Any) -> Any:
+    """Call ``func(*args, **kwargs)`` behind ``endpoint``'s breaker, retrying transient errors.
+
+    ``retry`` replaces ``is_transient`` as the test for which errors are retried.
+    """
+    retrying = Retrying(**_policy(endpoint, attempts, retry))
+    return retrying(_attempt, get_breaker(endpoint), func, *args, **kwargs)
+
+
+async def acall(endpoint: str, func: Callable[..., Awaitable[Any]], *args: Any,
+                attempts: Optional[int] = None,
+                retry: Optional[Callable[[BaseException], bool]] = None, **kwargs: Any) -> Any:
+    """Async counterpart of ``call`` for coroutine functions"""
+    retrying = AsyncRetrying(**_policy(endpoint, attempts, retry))
+    return await retrying(_async_attempt, get_breaker(endpoint), func, *args, **kwargs)
+
+
+# Entry fields written by the queue itself; the rest identifies the work item
+_ENTRY_FIELDS = ('failed_at', 'source', 'error', 'attempts')
+
+
+def _entry_key(source: str, entry: Dict[str, Any]) -> str:
+    item = {k: v for k, v in entry.items() if k not in _ENTRY_FIELDS}
+    return json.dumps([source, item], sort_keys=True, ensure_ascii=False, default=str)
+
+
+class DeadLetterQueue:
+    """JSON-lines file of work items that failed after all retries.
+
+    A run takes the queued items with ``claim`` and calls ``release`` once it
+    has finished with them; until then they stay on disk, so a crash mid-run
+    loses nothing. Every failure of a claimed item is recorded with its
+    attempt count, and after ``max_attempts()`` failed runs an item is parked
+    in the file for inspection instead of being retried again.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('DEAD_LETTER_FILE', DEAD_LETTER_FILE)
+        self._lock = threading.Lock()
+        # Attempts of the items claimed by this run, by entry key
+        self._claimed: Dict[str, int] = {}
+
+    def push(self, source: str, item: Dict[str, Any], error: Any) -> None:
+        """Record a failed item; ``item`` should hold identifiers, not content"""
+        entry = {'failed_at': datetime.now().isoformat(), 'source': source, 'error': str(error)}
+        entry.update(item)
+        with self._lock:
+            entry['attempts'] = self._claimed.get(_entry_key(source, entry), 0) + 1
+            line = json.dumps(entry, ensure_ascii=False, default=str)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        if entry['attempts'] >= max_attempts():
+            logger.error(f"Giving up on {source} item {item} after {entry['attempts']} attempts: {error}")
+        else:
+            logger.warning(f"Dead-lettered {source} item {item}: {error}")
+
+    def _read(self) -> List[Dict[str, Any]]:
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logger.warning(f"Skipping unreadable dead-letter entry in {self.path}")
+        return entries
+
+    def _write(self, entries: List[Dict[str, Any]]) -> None:
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in entries:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def entries(self, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Queued entries (only those from ``source`` if given)"""
+        with self._lock:
+            entries = self._read()
+        return [e for e in entries if source is None or e.get('source') == source]
+
+    def __len__(self) -> int:
+        return len(self.entries())
+
+    def claim(self, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Entries to retry in this run (only those from ``source`` if given).
+
+        Each item is returned once, with its latest error and attempt count;
+        parked items are left out. The entries stay on disk until ``release``.
+        """
+        limit = max_attempts()
+        with self._lock:
+            latest: Dict[str, Dict[str, Any]] = {}
+            for entry in self._read():
+                if source is None or entry.get('source') == source:
+                    key = _entry_key(entry.get('source'), entry)
+                    if entry.get('attempts', 1) >= latest.get(key, {}).get('attempts', 1):
+                        latest[key] = entry
+            taken = {key: entry for key, entry in latest.items() if entry.get('attempts', 1) < limit}
+            self._claimed.update((key, entry.get('attempts', 1)) for key, entry in taken.items())
+        return list(taken.values())
+
+    def release(self) -> None:
+        """Remove the entries claimed by this run; failures recorded since are kept"""
+        with self._lock:
+            if not self._claimed:
+                return
+            entries = self._read()
+            kept = [e for e in entries
+                    if e.get('attempts', 1) > self._claimed.get(_entry_key(e.get('source'), e), 0)]
+            self._claimed.clear()
+            if len(kept) != len(entries):
+                self._write(kept)
@@ -0,0 +1,121 @@
+"""
+Persistent Gmail sync cursor for incremental mailbox sync.
+
+Gmail assigns every mailbox change a monotonically increasing ``historyId``.
+Storing the last seen id between runs lets a forwarder ask Gmail only for the
+messages added since then instead of re-listing the whole search window.
+"""
+
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional, Set
+
+from googleapiclient.errors import HttpError
+
+from src.utils.gmail_http import execute
+from src.utils.gmail_paging import MAX_PAGE_SIZE, paginate
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryExpiredError(Exception):
+    """Gmail no longer holds history for the stored historyId (typically after ~1 week)."""
+
+
+class SyncState:
+    """Sync cursor (last historyId and sync times) persisted as JSON between runs"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.history_id: Optional[str] = None
+        self.last_sync: Optional[datetime] = None
+        self.last_full_scan: Optional[datetime] = None
+        self.load()
+
+    def load(self) -> None:
+        """Load the cursor from disk if it exists"""
+        if not os.path.exists(self.path):
+            return
+
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read sync state {self.path}: {e} - starting without cursor")
+            return
+
+        self.history_id = data.get('history_id')
+        self.last_sync = _parse_datetime(data.get('last_sync'))
+        self.last_full_scan = _parse_datetime(data.get('last_full_scan'))
+
+    def save(self, history_id: str, synced_at: datetime, full_scan: bool = False) -> None:
+        """Persist a new cursor atomically (write temp file, then replace)"""
+        self.history_id = str(history_id)
+        self.last_sync = synced_at
+        if full_scan:
+            self.last_full_scan = synced_at
+
+        data = {
+            'history_id': self.history_id,
+            'last_sync': self.last_sync.isoformat(),
+            'last_full_scan': self.last_full_scan.isoformat() if self.last_full_scan else None,
+        }
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def reset(self) -> None:
+        """Forget the cursor so the next run does a full scan"""
+        self.history_id = None
+        self.last_sync = None
+        self.last_full_scan = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def get_current_history_id(service) -> str:
+    """Return the mailbox's current historyId"""
+    profile = execute(service.users().getProfile(userId='me'))
+    return str(profile['historyId'])
+
+
+def get_added_message_ids(service, start_history_id: str) -> Set[str]:
+    """Return IDs of all messages added to the mailbox after ``start_history_id``.
+
+    Raises HistoryExpiredError when Gmail answers 404 for the cursor, in which
+    case the caller must fall back to a full scan.
+    """
+    message_ids: Set[str] = set()
+    records = paginate(
+        service.users().history().list,
+        'history',
+        page_size=MAX_PAGE_SIZE,
+        userId='me',
+        startHistoryId=start_history_id,
+        historyTypes=['messageAdded']
+    )
+
+    try:
+        for record in records:
+            for added in record.get('messagesAdded', []):
+                message_ids.add(added['message']['id'])
+    except HttpError as error:
+        if error.resp.status == 404:
+            raise HistoryExpiredError(
+                f"historyId {start_history_id} is no longer available") from error
+        raise
+
+    return message_ids
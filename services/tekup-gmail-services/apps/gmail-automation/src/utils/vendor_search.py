@@ -0,0 +1,170 @@
+"""
+Gmail search for many vendors with few API calls.
+
+Searching vendor by vendor costs one ``messages.list`` per vendor plus one
+``messages.get`` per hit. ``plan_queries`` instead packs the vendor terms
+into ``(a OR b OR ...)`` groups, with as many terms per query as
+``max_length`` allows. ``search_vendors`` pages through each query, fetches
+the hits in batches (attachment structure only) and attributes each message
+to vendors locally by matching the terms against From, Subject and the
+attachment filenames. Broad terms can use up a packed query's message
+budget on their own, so a vendor still short of hits after a query that
+was cut off at ``limit`` gets a query of its own, whose results all count
+for that vendor (including matches on body text). A query Gmail answered
+in full already holds every match for its vendors and needs no follow-up.
+Messages of the packed queries that match no vendor locally are left
+unattributed.
+"""
+
+import logging
+import re
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Pattern, Sequence
+
+from src.utils.gmail_access import ATTACHMENTS, header
+from src.utils.gmail_batch import MAX_BATCH_SIZE, chunked, get_messages
+from src.utils.gmail_paging import iter_messages
+
+logger = logging.getLogger(__name__)
+
+# Gmail does not document a limit for ``q``; long queries are rejected or
+# silently truncated, so stay well inside the URL length limits
+MAX_QUERY_LENGTH = 1024
+# Messages read per query at most, so a broad query cannot page the whole mailbox
+DEFAULT_QUERY_LIMIT = 500
+
+
+class VendorQuery(NamedTuple):
+    query: str
+    vendors: List[str]
+
+
+class VendorSearchResult(NamedTuple):
+    # vendor -> messages (newest first, at most ``per_vendor`` each)
+    hits: Dict[str, List[Dict]]
+    # Messages matched by Gmail that no vendor term was found in locally
+    unattributed: List[Dict]
+    queries: int
+
+
+def search_term(vendor: str) -> str:
+    """Gmail search term for ``vendor``; multi-word and punctuated names become phrases"""
+    term = vendor.replace('"', '').strip()
+    return term if re.fullmatch(r'\w+', term) else f'"{term}"'
+
+
+def plan_queries(vendors: Sequence[str], base_query: str = '',
+                 max_length: int = MAX_QUERY_LENGTH) -> List[VendorQuery]:
+    """Pack vendor terms into as few ``base (a OR b ...)`` queries as ``max_length`` allows.
+
+    A term too long to share a query still gets a query of its own.
+    """
+    def build(terms: List[str]) -> str:
+        group = f"({' OR '.join(terms)})"
+        return f"{base_query} {group}" if base_query else group
+
+    plans: List[VendorQuery] = []
+    terms: List[str] = []
+    group: List[str] = []
+    for vendor in dict.fromkeys(vendors):
+        term = search_term(vendor)
+        if terms and len(build(terms + [term])) > max_length:
+            plans.append(VendorQuery(build(terms), group))
+            terms, group = [], []
+        terms.append(term)
+        group.append(vendor)
+    if terms:
+        plans.append(VendorQuery(build(terms), group))
+    return plans
+
+
+def _vendor_pattern(vendor: str) -> Pattern:
+    words = [re.escape(word) for word in vendor.lower().split()]
+    return re.compile(r'(?<!\w)' + r'\s+'.join(words) + r'(?!\w)')
+
+
+def _filenames(part: Dict) -> Iterable[str]:
+    if part.get('filename'):
+        yield part['filename']
+    for subpart in part.get('parts', []):
+        yield from _filenames(subpart)
+
+
+def attribute(message: Dict, patterns: Dict[str, Pattern]) -> List[str]:
+    """Vendors whose name appears in the From, Subject or an attachment filename"""
+    fields = [header(message, 'From'), header(message, 'Subject')]
+    fields.extend(_filenames(message.get('payload', {})))
+    text = '\n'.join(fields).lower()
+    return [vendor for vendor, pattern in patterns.items() if pattern.search(text)]
+
+
+def search_vendors(service: Any, vendors: Sequence[str], base_query: str = '',
+                   per_vendor: int = 5, max_length: int = MAX_QUERY_LENGTH,
+                   limit: Optional[int] = DEFAULT_QUERY_LIMIT) -> VendorSearchResult:
+    """Find up to ``per_vendor`` messages for every vendor with packed OR queries.
+
+    Each query is read one page at a time and every page is fetched in one
+    batch; a query stops paging once all of its vendors have ``per_vendor``
+    hits, or after ``limit`` messages. Vendors left with fewer hits by a
+    query that reached ``limit`` (or whose messages could not all be
+    fetched) are then searched one by one.
+    """
+    hits: Dict[str, List[Dict]] = {vendor: [] for vendor in vendors}
+    fetched: Dict[str, Dict] = {}
+    attributed = set()
+    # Vendors whose packed query returned, and fetched, every match
+    exhausted = set()
+    plans = plan_queries(vendors, base_query, max_length)
+
+    for plan in plans:
+        patterns = {vendor: _vendor_pattern(vendor) for vendor in plan.vendors}
+        message_ids = (ref['id'] for ref in iter_messages(
+            service, plan.query, page_size=MAX_BATCH_SIZE, limit=limit))
+        read = 0
+        complete = True
+
+        for page in chunked(message_ids, MAX_BATCH_SIZE):
+            read += len(page)
+            # Messages already fetched for an earlier query are attributed again, not refetched
+            fetched.update(get_messages(
+                service, [message_id for message_id in page if message_id not in fetched], ATTACHMENTS))
+
+            for message_id in page:
+                message = fetched.get(message_id)
+                if message is None:
+                    complete = False
+                    continue
+                for vendor in attribute(message, patterns):
+                    attributed.add(message_id)
+                    if len(hits[vendor]) < per_vendor:
+                        hits[vendor].append(message)
+
+            if all(len(hits[vendor]) >= per_vendor for vendor in plan.vendors):
+                break
+
+        if complete and (limit is None or read < limit):
+            exhausted.update(plan.vendors)
+
+    followups = 0
+    for vendor, messages in hits.items():
+        if len(messages) >= per_vendor or vendor in exhausted:
+            continue
+        followups += 1
+        term = search_term(vendor)
+        query = f"{base_query} {term}" if base_query else term
+        known = {message['id'] for message in messages}
+        message_ids = [ref['id'] for ref in iter_messages(
+            service, query, page_size=per_vendor + len(known), limit=per_vendor + len(known))
+            if ref['id'] not in known][:per_vendor - len(messages)]
+
+        fetched.update(get_messages(
+            service, [message_id for message_id in message_ids if message_id not in fetched], ATTACHMENTS))
+        for message_id in message_ids:
+            if message_id in fetched:
+                attributed.add(message_id)
+                messages.append(fetched[message_id])
+
+    queries = len(plans) + followups
+    unattributed = [message for message_id, message in fetched.items() if message_id not in attributed]
+    logger.info(f"Searched {len(hits)} vendors with {queries} queries "
+                f"({followups} for single vendors), {len(fetched)} messages")
+    return VendorSearchResult(hits, unattributed, queries)
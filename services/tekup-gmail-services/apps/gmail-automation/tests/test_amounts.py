@@ -0,0 +1,75 @@
+"""
+Danish amount parsing (src/processors/amounts.py).
+"""
+
+import math
+import re
+
+import pandas as pd
+import pytest
+
+from src.processors.amounts import AMOUNT_PATTERN, AmountParseError, parse_danish_amount, parse_danish_amounts
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('0', 0.0),
+    ('12', 12.0),
+    ('-13.208,39', -13208.39),
+    ('+1.000', 1000.0),
+    ('1.234.567,5', 1234567.5),
+    ('999,99', 999.99),
+    ('  -42,00 ', -42.0),
+    ('"1.500,25"', 1500.25),
+    ('1234', 1234.0),
+])
+def test_valid_amounts(text, expected):
+    assert parse_danish_amount(text) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize('text', [
+    '', '-', ',5', '5,', '1,2,3', '1.23', '12.345.67', '1.2345', '.123', '1.000.', '--5',
+    '5-', '1 000', '1e5', 'abc', '12,5 kr', '-13.208.39', '1234.567', 'æ1',
+    '1234567890123456789',
+])
+def test_invalid_amounts(text):
+    with pytest.raises(AmountParseError):
+        parse_danish_amount(text)
+
+
+def test_column_matches_the_single_cell_pattern():
+    cells = ['1', '1.000', '10.000,5', '100.00', '1.0000', '-0,01', '+7', '7,', ',7',
+             '1..000', '12.345.678,901', '00.000', '-', '1.000,', '123.456.7']
+    parsed = {}
+    for cell in cells:
+        try:
+            parsed[cell] = parse_danish_amount(cell)
+        except AmountParseError:
+            parsed[cell] = None
+    for cell in cells:
+        assert (parsed[cell] is not None) == bool(re.fullmatch(AMOUNT_PATTERN, cell)), cell
+
+
+def test_error_names_every_bad_row():
+    values = pd.Series(['1,00', 'x', '2,00', '3.4'], index=[2, 3, 4, 5], name='Beløb')
+
+    with pytest.raises(AmountParseError) as error:
+        parse_danish_amounts(values, source='statement.csv (Beløb)')
+
+    assert error.value.invalid == {3: 'x', 5: '3.4'}
+    assert 'statement.csv (Beløb)' in str(error.value)
+
+
+def test_empty_cells_are_nan_when_allowed():
+    parsed = parse_danish_amounts(pd.Series(['1,5', '', '  ']), allow_empty=True)
+
+    assert parsed[0] == 1.5
+    assert math.isnan(parsed[1]) and math.isnan(parsed[2])
+
+
+def test_keeps_index_and_name():
+    values = pd.Series(['1', '2'], index=[10, 11], name='Saldo')
+    parsed = parse_danish_amounts(values)
+
+    assert parsed.index.tolist() == [10, 11]
+    assert parsed.name == 'Saldo'
+    assert parse_danish_amounts(pd.Series([], dtype=str)).empty
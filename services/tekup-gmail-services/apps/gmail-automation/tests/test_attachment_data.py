@@ -0,0 +1,38 @@
+"""
+Single-pass attachment decoding (src/utils/attachment_data.py).
+"""
+
+import base64
+import binascii
+import hashlib
+import os
+
+import pytest
+
+from src.utils.attachment_data import decode_attachment
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 4, 100, 4095, 4096, 70_000])
+@pytest.mark.parametrize('padded', [True, False])
+def test_decodes_and_hashes_like_the_stdlib(size, padded):
+    data = os.urandom(size)
+    encoded = base64.urlsafe_b64encode(data).decode('ascii')
+    if not padded:
+        encoded = encoded.rstrip('=')
+
+    for chunk_size in (4, 6, 1024, 64 * 1024):
+        decoded = decode_attachment(encoded, chunk_size=chunk_size)
+        assert bytes(decoded) == data
+        assert decoded.digest == hashlib.sha256(data).hexdigest()
+
+
+def test_accepts_bytes():
+    data = b'\xfb\xff\xfe%PDF'
+    decoded = decode_attachment(base64.urlsafe_b64encode(data))
+
+    assert bytes(decoded) == data
+
+
+def test_rejects_impossible_length():
+    with pytest.raises(binascii.Error):
+        decode_attachment('abcde')
@@ -0,0 +1,49 @@
+"""
+Size-aware attachment bundling (src/utils/bundling.py).
+"""
+
+import base64
+
+import pytest
+
+from src.utils.bundling import MESSAGE_OVERHEAD, PART_OVERHEAD, encoded_size, plan_bundles
+
+MB = 1024 * 1024
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 56, 57, 58, 1000, 123457])
+def test_encoded_size_matches_mime_base64(size):
+    assert encoded_size(size) == len(base64.encodebytes(b'x' * size))
+
+
+def bundle_cost(sizes):
+    return MESSAGE_OVERHEAD + sum(encoded_size(size) + PART_OVERHEAD for size in sizes)
+
+
+def test_bundles_stay_under_the_limit():
+    sizes = [3 * MB, 1 * MB, 4 * MB, 2 * MB, 500_000, 2 * MB, 100_000]
+
+    bundles = plan_bundles(sizes, lambda size: size, max_bytes=10 * MB)
+
+    assert sorted(size for bundle in bundles for size in bundle) == sorted(sizes)
+    assert all(bundle_cost(bundle) <= 10 * MB for bundle in bundles)
+    # 12.6 MB of PDFs is 17 MB encoded: two emails
+    assert len(bundles) == 2
+
+
+def test_oversized_item_gets_its_own_bundle():
+    bundles = plan_bundles([20 * MB, 1000, 2000], lambda size: size, max_bytes=10 * MB)
+
+    assert bundles == [[20 * MB], [1000, 2000]]
+
+
+def test_items_keep_their_order():
+    items = [('a', 6 * MB), ('b', 1000), ('c', 6 * MB), ('d', 2000)]
+
+    bundles = plan_bundles(items, lambda item: item[1], max_bytes=10 * MB)
+
+    assert [[name for name, _ in bundle] for bundle in bundles] == [['a', 'b', 'd'], ['c']]
+
+
+def test_no_items():
+    assert plan_bundles([], len) == []
@@ -0,0 +1,79 @@
+"""
+Vendor categorization of statement texts (src/processors/categorizer.py).
+"""
+
+import pandas as pd
+import pytest
+
+from src.processors.categorizer import Categorizer, VendorRule
+
+CATEGORIES = {'fuel': 'Benzin', 'food': 'Mad', 'ferry': 'Færge', 'payment': 'Betaling',
+              'own_invoice': 'Egen faktura', 'refund': 'Refusion'}
+
+
+@pytest.fixture
+def categorizer():
+    return Categorizer([
+        VendorRule('own_invoice', 'Egen faktura', 'own_invoice', ('ftf-',), 'income'),
+        VendorRule('circle_k', 'Circle K', 'fuel', ('circle k',)),
+        VendorRule('ok', 'OK', 'fuel', ('ok',)),
+        VendorRule('booking', 'Booking', 'food', ('booking',)),
+        VendorRule('molslinjen', 'Molslinjen', 'ferry', ('molslinje*',)),
+        VendorRule('refund', 'Refusion', 'refund', ('circle k',), 'income'),
+        VendorRule('ls', 'LS', 'payment', ('ls',)),
+    ], CATEGORIES)
+
+
+def vendors(categorizer, texts, amounts=None):
+    texts = pd.Series(texts)
+    return categorizer.categorize(texts, None if amounts is None else pd.Series(amounts))['vendor'].tolist()
+
+
+def test_patterns_match_whole_words_only(categorizer):
+    assert vendors(categorizer, ['OK Plus Aarhus', 'Booking.com', 'Hotel booking', 'Tokyo']) == \
+        ['ok', 'booking', 'booking', 'unknown']
+
+
+def test_prefix_pattern_matches_longer_words(categorizer):
+    assert vendors(categorizer, ['MOLSLINJEN A/S', 'Molslinje', 'xmolslinjen']) == \
+        ['molslinjen', 'molslinjen', 'unknown']
+
+
+def test_first_listed_rule_wins(categorizer):
+    # 'ls' is a generic fallback listed after the actual vendors
+    assert vendors(categorizer, ['LS Circle K Vejle', 'LS 12345']) == ['circle_k', 'ls']
+
+
+def test_applies_to_limits_rules_by_amount_sign(categorizer):
+    texts = ['FTF-1001 betaling', 'FTF-1001 betaling', 'Circle K', 'Circle K']
+    amounts = [500.0, -500.0, -300.0, 300.0]
+
+    assert vendors(categorizer, texts, amounts) == ['own_invoice', 'unknown', 'circle_k', 'circle_k']
+    # Without amounts every rule applies
+    assert vendors(categorizer, texts[:1]) == ['own_invoice']
+
+
+def test_result_keeps_index_and_labels(categorizer):
+    result = categorizer.categorize(pd.Series(['Circle K', 'ukendt'], index=[7, 9]))
+
+    assert result.index.tolist() == [7, 9]
+    assert result['category'].tolist() == ['fuel', 'uncategorized']
+    assert result['label'].tolist() == ['Circle K (Benzin)', 'Ukategoriseret']
+    assert categorizer.categorize(pd.Series([], dtype=str)).empty
+
+
+@pytest.mark.parametrize('rule, message', [
+    (VendorRule('x', 'X', 'nope', ('x',)), 'unknown category'),
+    (VendorRule('x', 'X', 'fuel', ('x',), 'both'), 'applies_to'),
+    (VendorRule('x', 'X', 'fuel', ('*',)), 'empty pattern'),
+])
+def test_invalid_rules_are_rejected(rule, message):
+    with pytest.raises(ValueError, match=message):
+        Categorizer([rule], CATEGORIES)
+
+
+def test_bundled_rules_load():
+    categorizer = Categorizer.from_file()
+
+    assert categorizer.rules
+    assert vendors(categorizer, ['Telenor A/S']) == ['telenor']
@@ -0,0 +1,116 @@
+"""
+Persistent dedup index of sent documents (src/utils/dedup_store.py).
+"""
+
+import hashlib
+
+import pytest
+
+from src.utils import dedup_store
+from src.utils.attachment_data import decode_attachment
+from src.utils.dedup_store import BloomFilter, DedupStore, content_digest
+
+
+def digest(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'dedup.sqlite3')
+
+
+@pytest.fixture
+def store(path):
+    return DedupStore(path)
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(capacity=1000)
+    added = [digest(f'doc{i}') for i in range(1000)]
+    for d in added:
+        bloom.add(d)
+
+    assert all(d in bloom for d in added)
+
+
+def test_bloom_filter_false_positive_rate_is_near_its_target():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for i in range(1000):
+        bloom.add(digest(f'doc{i}'))
+
+    false_positives = sum(digest(f'other{i}') in bloom for i in range(10000))
+    assert false_positives < 300
+
+
+def test_content_digest_reuses_the_digest_computed_while_decoding():
+    data = decode_attachment('JVBERi0xLjQ=')
+
+    assert content_digest(data) == hashlib.sha256(b'%PDF-1.4').hexdigest()
+    assert content_digest(b'%PDF-1.4') == content_digest(data)
+
+
+def test_claim_is_exclusive_until_released(path, store):
+    other = DedupStore(path)
+    d = digest('bilag')
+
+    assert store.claim(d, 'bilag.pdf', 'test')
+    assert not other.claim(d)
+    assert d in other
+
+    store.release(d)
+    assert other.claim(d)
+
+
+def test_confirmed_document_is_never_claimed_again(path, store):
+    d = digest('bilag')
+    store.claim(d)
+    store.confirm(d)
+
+    assert not store.claim(d)
+    store.release(d)
+    assert not DedupStore(path).claim(d)
+    assert len(store) == 1
+
+
+def test_abandoned_claim_expires(path, store):
+    d = digest('bilag')
+    store.claim(d)
+
+    assert not DedupStore(path, claim_timeout=3600).claim(d)
+    assert DedupStore(path, claim_timeout=-1).claim(d)
+
+
+def test_bloom_filter_answers_for_unseen_digests_without_the_database(store, monkeypatch):
+    queries = []
+    connection = store._connection()
+    monkeypatch.setattr(store, '_connection', lambda: queries.append(1) or connection)
+
+    assert digest('never sent') not in store
+    assert queries == []
+
+
+def test_store_seeds_its_bloom_filter_from_the_database(path, store):
+    d = digest('bilag')
+    store.add(d, 'bilag.pdf', 'seed')
+
+    reopened = DedupStore(path)
+
+    assert d in reopened._bloom
+    assert d in reopened
+    assert not reopened.claim(d)
+
+
+def test_documents_claimed_by_another_process_after_startup_are_caught(path, store):
+    # ``store`` was opened before the other process wrote, so its Bloom filter misses the digest
+    d = digest('bilag')
+    DedupStore(path).claim(d)
+
+    assert not store.claim(d)
+
+
+def test_get_dedup_store_shares_one_store_per_path(path, monkeypatch):
+    monkeypatch.setattr(dedup_store, '_stores', {})
+
+    assert dedup_store.get_dedup_store(path) is dedup_store.get_dedup_store(path)
+
@@ -0,0 +1,117 @@
+"""
+Pooled async e-conomic client (src/integrations/economic_client.py).
+"""
+
+import asyncio
+import functools
+
+import httpx
+import pytest
+
+from src.integrations import economic_client
+from src.integrations.economic_client import EconomicApiError, EconomicClient
+from src.utils import resilience
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setattr(resilience, '_breakers', {})
+    monkeypatch.setenv('RETRY_MAX_ATTEMPTS', '3')
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """Route the client's requests to ``handler(request) -> httpx.Response``"""
+    def install(handler):
+        transport = httpx.MockTransport(handler)
+        monkeypatch.setattr(economic_client.httpx, 'AsyncClient',
+                            functools.partial(httpx.AsyncClient, transport=transport))
+    return install
+
+
+def client(**kwargs):
+    return EconomicClient('secret', 'grant', base_url='https://economic.test', **kwargs)
+
+
+def test_create_voucher_sends_the_tokens(serve):
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        return httpx.Response(201, json={'voucherNumber': 7})
+
+    serve(handler)
+
+    async def run():
+        async with client() as economic:
+            return await economic.create_voucher({'entries': {}})
+
+    assert asyncio.run(run()) == {'voucherNumber': 7}
+    (request,) = seen
+    assert (request.method, request.url.path) == ('POST', '/vouchers')
+    assert request.headers['X-AppSecretToken'] == 'secret'
+    assert request.headers['X-AgreementGrantToken'] == 'grant'
+
+
+def test_requests_in_flight_are_capped(serve):
+    in_flight = []
+    peak = []
+
+    async def handler(request):
+        in_flight.append(1)
+        peak.append(len(in_flight))
+        await asyncio.sleep(0.01)
+        in_flight.pop()
+        return httpx.Response(200, json={})
+
+    serve(handler)
+
+    async def run():
+        async with client(max_concurrency=2) as economic:
+            await asyncio.gather(*(economic.request('GET', '/customers') for _ in range(8)))
+
+    asyncio.run(run())
+    assert len(peak) == 8
+    assert max(peak) == 2
+
+
+def test_get_is_retried_after_a_server_error(serve):
+    statuses = iter([503, 200])
+    serve(lambda request: httpx.Response(next(statuses), json={}))
+
+    async def run():
+        async with client() as economic:
+            return await economic.request('GET', '/customers')
+
+    assert asyncio.run(run()).status_code == 200
+
+
+def test_post_is_not_retried_after_a_server_error(serve):
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(503, text='unavailable')
+
+    serve(handler)
+
+    async def run():
+        async with client() as economic:
+            await economic.create_voucher({'entries': {}})
+
+    with pytest.raises(EconomicApiError) as error:
+        asyncio.run(run())
+    assert error.value.status_code == 503
+    assert len(calls) == 1
+
+
+def test_post_is_retried_when_rate_limited(serve):
+    statuses = iter([429, 201])
+    serve(lambda request: httpx.Response(next(statuses), json={'voucherNumber': 1}))
+
+    async def run():
+        async with client() as economic:
+            return await economic.create_voucher({'entries': {}})
+
+    assert asyncio.run(run()) == {'voucherNumber': 1}
@@ -0,0 +1,62 @@
+"""
+Projected Gmail message access (src/utils/gmail_access.py).
+"""
+
+import pytest
+
+from src.utils.gmail_access import (
+    ATTACHMENT_FIELDS,
+    ATTACHMENTS,
+    FULL,
+    METADATA,
+    header,
+    message_request,
+    request_kwargs,
+)
+
+
+class FakeMessages:
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def get(self, **kwargs):
+        return kwargs
+
+
+def test_metadata_projection_asks_only_for_the_listed_headers():
+    assert request_kwargs(METADATA, ['Subject', 'From']) == {
+        'format': 'metadata', 'metadataHeaders': ['Subject', 'From']}
+    assert request_kwargs(METADATA, None) == {'format': 'metadata'}
+
+
+def test_attachments_projection_masks_out_bodies():
+    kwargs = request_kwargs(ATTACHMENTS)
+
+    assert kwargs == {'format': 'full', 'fields': ATTACHMENT_FIELDS}
+    assert 'body(attachmentId,size)' in ATTACHMENT_FIELDS
+    assert 'data' not in ATTACHMENT_FIELDS
+    # Nested parts are spelled out five levels deep, with balanced parentheses
+    assert ATTACHMENT_FIELDS.count('parts(') == 5
+    assert ATTACHMENT_FIELDS.count('(') == ATTACHMENT_FIELDS.count(')')
+
+
+def test_full_projection_and_unknown_projection():
+    assert request_kwargs(FULL) == {'format': 'full'}
+    with pytest.raises(ValueError):
+        request_kwargs('raw')
+
+
+def test_message_request_builds_a_projected_get():
+    assert message_request(FakeMessages(), 'm1', ATTACHMENTS) == {
+        'userId': 'me', 'id': 'm1', 'format': 'full', 'fields': ATTACHMENT_FIELDS}
+
+
+def test_header_lookup_is_case_insensitive():
+    message = {'payload': {'headers': [{'name': 'SUBJECT', 'value': 'Faktura'}]}}
+
+    assert header(message, 'Subject') == 'Faktura'
+    assert header(message, 'From', 'Ukendt') == 'Ukendt'
+    assert header({}, 'Subject') == ''
@@ -0,0 +1,107 @@
+"""
+GmailPDFForwarder pipeline stages (src/core/gmail_forwarder.py).
+"""
+
+import pytest
+
+from src.core import gmail_forwarder
+from src.core.gmail_forwarder import STAT_NAMES, GmailPDFForwarder
+from src.utils.dedup_store import DedupStore, content_digest
+from src.utils.outbox import EXTRACTED, Outbox
+from src.utils.pipeline import Counters, TokenBucket
+from src.utils.resilience import DeadLetterQueue
+
+
+class FakeLabels:
+    def __init__(self):
+        self.added = []
+
+    def add(self, message_id, label):
+        self.added.append(message_id)
+
+
+def pdf_message(message_id):
+    return {'id': message_id, 'payload': {'headers': [], 'parts': [
+        {'filename': 'faktura.pdf', 'body': {'attachmentId': f'att-{message_id}'}},
+    ]}}
+
+
+def text_message(message_id):
+    return {'id': message_id, 'payload': {'headers': [], 'parts': [
+        {'filename': '', 'body': {'size': 10}},
+    ]}}
+
+
+@pytest.fixture
+def forwarder(tmp_path):
+    # Uden __init__: ingen .env, logfil eller Gmail login
+    forwarder = GmailPDFForwarder.__new__(GmailPDFForwarder)
+    forwarder.config = {'batch_size': 100, 'processed_label': 'Videresendt_econ',
+                        'bundle_attachments': False, 'gmail_user_email': 'me@example.com'}
+    forwarder.service = object()
+    forwarder.labels = FakeLabels()
+    forwarder.rate_limiter = TokenBucket(10_000)
+    forwarder.stats = Counters(*STAT_NAMES)
+    forwarder.dead_letters = DeadLetterQueue(str(tmp_path / 'dead_letters.jsonl'))
+    forwarder.dedup = DedupStore(str(tmp_path / 'dedup.sqlite3'))
+    forwarder.outbox = None
+    return forwarder
+
+
+def test_email_whose_metadata_fetch_failed_is_dead_lettered_not_labelled(forwarder, monkeypatch):
+    # get_messages udelader beskeder hvis batch-del fejlede
+    monkeypatch.setattr(gmail_forwarder, 'get_messages', lambda service, ids, **kw: {
+        'with-pdf': pdf_message('with-pdf'), 'no-pdf': text_message('no-pdf')})
+    forwarder.find_message_ids = lambda: iter(['with-pdf', 'failed', 'no-pdf'])
+
+    items = list(forwarder.iter_work_items())
+
+    assert [item['message_id'] for item in items] == ['with-pdf']
+    assert forwarder.labels.added == ['no-pdf']
+    assert [entry['message_id'] for entry in forwarder.dead_letters.claim('gmail_forwarder')] == ['failed']
+    assert forwarder.stats['errors'] == 1
+    assert forwarder.stats['skipped'] == 1
+
+
+def decoded_item(message_id, *contents):
+    return {'message_id': message_id, 'attachments': [
+        {'filename': f'{i}.pdf', 'data': data, 'size': len(data)} for i, data in enumerate(contents)]}
+
+
+def test_build_failure_dead_letters_the_email_and_frees_its_claims(forwarder, monkeypatch):
+    def create_bundle_email(bundle, destination):
+        if bundle[0]['data'] == b'bad':
+            raise ValueError('template')
+        return b'message'
+    monkeypatch.setattr(forwarder, 'create_bundle_email', create_bundle_email)
+
+    assert forwarder.build_stage(decoded_item('m1', b'good', b'bad'), 'bilag@example.com') is None
+
+    assert [entry['message_id'] for entry in forwarder.dead_letters.claim('gmail_forwarder')] == ['m1']
+    # Begge bilag kan bygges igen ved genforsøget
+    assert forwarder.dedup.claim(content_digest(b'good'))
+    assert forwarder.dedup.claim(content_digest(b'bad'))
+
+
+def test_send_queued_leaves_entries_taken_over_by_another_process(forwarder, tmp_path, monkeypatch):
+    path = str(tmp_path / 'outbox.sqlite3')
+    forwarder.outbox = Outbox(path, lease_seconds=-1)
+    other = Outbox(path)
+    for digest in ('d1', 'd2'):
+        forwarder.outbox.enqueue('m1', 'bilag@example.com', [digest], [f'{digest}.pdf'], b'message')
+    sent = []
+
+    def send_outbox_entry(entry):
+        # Den første afsendelse er langsom - en anden proces overtager begge udløbne leases
+        if not sent:
+            other.lease()
+        sent.append(entry.digests)
+        return 'gmail-id'
+    monkeypatch.setattr(forwarder, 'send_outbox_entry', send_outbox_entry)
+
+    assert forwarder.send_queued({'message_id': 'm1', 'forwards': []}) is not None
+
+    # d1 blev sendt, men registreres af den nye ejer; d2 sendes slet ikke herfra
+    assert sent == [['d1']]
+    assert forwarder.outbox.counts()[EXTRACTED] == 2
+    assert [entry.digests for entry in other.lease()] == []
@@ -0,0 +1,92 @@
+"""
+Cached label IDs and batched labelling (src/utils/gmail_labels.py).
+"""
+
+import json
+
+import pytest
+
+from src.utils import gmail_labels
+from src.utils.gmail_labels import LabelManager
+
+
+class FakeGmail:
+    """One account's label endpoints; requests are executed by the patched ``execute``"""
+
+    def __init__(self, email, labels):
+        self.email = email
+        self.labels_by_name = dict(labels)
+        self.calls = []
+
+    def users(self):
+        return self
+
+    def getProfile(self, userId):
+        self.calls.append('getProfile')
+        return {'emailAddress': self.email}
+
+    def labels(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId):
+        self.calls.append('labels.list')
+        return {'labels': [{'name': name, 'id': label_id} for name, label_id in self.labels_by_name.items()]}
+
+    def batchModify(self, userId, body):
+        self.calls.append(('batchModify', tuple(body['addLabelIds']), len(body['ids'])))
+        return {}
+
+
+@pytest.fixture
+def cache_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(gmail_labels, 'execute', lambda request: request)
+    monkeypatch.setattr(gmail_labels, '_resolved', {})
+    return str(tmp_path / 'gmail_labels.json')
+
+
+def test_label_ids_are_cached_per_account(cache_path):
+    first = FakeGmail('a@example.com', {'Videresendt_econ': 'Label_A'})
+    second = FakeGmail('b@example.com', {'Videresendt_econ': 'Label_B'})
+
+    assert LabelManager(first, 'a@example.com', cache_path).label_id('Videresendt_econ') == 'Label_A'
+    assert LabelManager(second, 'b@example.com', cache_path).label_id('Videresendt_econ') == 'Label_B'
+    assert LabelManager(first, 'a@example.com', cache_path).label_id('Videresendt_econ') == 'Label_A'
+
+    assert first.calls == ['labels.list']
+    with open(cache_path, encoding='utf-8') as f:
+        assert json.load(f) == {'a@example.com': {'Videresendt_econ': 'Label_A'},
+                                'b@example.com': {'Videresendt_econ': 'Label_B'}}
+
+
+def test_account_is_looked_up_when_not_given(cache_path):
+    gmail = FakeGmail('a@example.com', {'Videresendt_econ': 'Label_A'})
+
+    labels = LabelManager(gmail, cache_path=cache_path)
+
+    assert labels.label_id('Videresendt_econ') == 'Label_A'
+    assert labels.account == 'a@example.com'
+    assert gmail.calls == ['getProfile', 'labels.list']
+
+
+def test_unkeyed_cache_from_older_versions_is_ignored(cache_path):
+    with open(cache_path, 'w', encoding='utf-8') as f:
+        json.dump({'Videresendt_econ': 'Label_stale'}, f)
+    gmail = FakeGmail('a@example.com', {'Videresendt_econ': 'Label_A'})
+
+    assert LabelManager(gmail, 'a@example.com', cache_path).label_id('Videresendt_econ') == 'Label_A'
+
+
+def test_flush_labels_in_batches_of_1000(cache_path):
+    gmail = FakeGmail('a@example.com', {'Videresendt_econ': 'Label_A'})
+    labels = LabelManager(gmail, 'a@example.com', cache_path)
+
+    for i in range(1500):
+        labels.add(f'm{i}', 'Videresendt_econ')
+    assert labels.pending() == 500
+    assert labels.flush() == 500
+
+    assert [call for call in gmail.calls if call != 'labels.list'] == [
+        ('batchModify', ('Label_A',), 1000), ('batchModify', ('Label_A',), 500)]
@@ -0,0 +1,78 @@
+"""
+Process-wide Gmail service cache and token refresher (src/utils/gmail_service.py).
+"""
+
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.utils import gmail_service
+from src.utils.gmail_service import CredentialsRefresher, get_service, reset_service
+
+
+def utcnow():
+    # google-auth stores expiry as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class FakeCredentials:
+    def __init__(self, token='token', expires_in=3600):
+        self.token = token
+        self.expiry = utcnow() + timedelta(seconds=expires_in)
+        self.refreshed = threading.Event()
+
+    def refresh(self, request):
+        self.token = 'fresh'
+        self.expiry = utcnow() + timedelta(hours=1)
+        self.refreshed.set()
+
+
+@pytest.fixture(autouse=True)
+def fake_build(monkeypatch):
+    monkeypatch.setattr(gmail_service, 'build_gmail', lambda credentials: ('service', credentials))
+    yield
+    reset_service()
+
+
+def test_service_is_built_once_per_key():
+    loads = []
+
+    def load():
+        loads.append(1)
+        return FakeCredentials()
+
+    first = get_service('gmail:a', load, refresh_in_background=False)
+    assert get_service('gmail:a', load, refresh_in_background=False) is first
+    get_service('gmail:b', load, refresh_in_background=False)
+
+    assert len(loads) == 2
+
+
+def test_reset_builds_the_service_again():
+    credentials = [FakeCredentials(), FakeCredentials()]
+
+    first = get_service('gmail:a', credentials.pop, refresh_in_background=False)
+    reset_service('gmail:a')
+
+    assert get_service('gmail:a', credentials.pop, refresh_in_background=False) is not first
+
+
+def test_refresh_is_scheduled_a_margin_before_expiry():
+    refresher = CredentialsRefresher(FakeCredentials(expires_in=3600), margin=300)
+
+    assert 3290 < refresher.seconds_until_refresh() <= 3300
+    assert CredentialsRefresher(FakeCredentials(expires_in=60), margin=300).seconds_until_refresh() == 0
+    assert CredentialsRefresher(FakeCredentials(token=None)).seconds_until_refresh() == 0
+
+
+def test_credentials_without_a_token_are_refreshed_in_the_background():
+    credentials = FakeCredentials(token=None)
+    saved = []
+
+    get_service('gmail:a', lambda: credentials, on_refresh=saved.append)
+
+    assert credentials.refreshed.wait(5)
+    reset_service('gmail:a')
+    assert credentials.token == 'fresh'
+    assert saved == [credentials]
@@ -0,0 +1,148 @@
+"""
+Image to PDF conversion in a process pool (src/utils/image_pdf.py).
+"""
+
+import asyncio
+import io
+import re
+
+import pytest
+from PIL import Image
+
+from src.utils.image_pdf import (
+    PROFILES,
+    ConversionStats,
+    ImageConverter,
+    ImageProfile,
+    image_profile,
+    image_to_pdf,
+    normalize_image,
+)
+
+
+def photo(size=(300, 200), color=(200, 180, 160), format='JPEG', exif=None):
+    buffer = io.BytesIO()
+    options = {'exif': exif} if exif is not None else {}
+    Image.new('RGB', size, color).save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def opened(data):
+    return Image.open(io.BytesIO(data))
+
+
+def page_size(pdf):
+    # The page's content stream scales the image to the page: 'q <w> 0 0 <h> 0 0 cm'
+    width, height = re.search(rb'q ([\d.]+) 0 0 ([\d.]+) 0 0 cm', pdf).groups()
+    return round(float(width)), round(float(height))
+
+
+def test_original_profile_wraps_the_image_as_a_pdf():
+    pdf = image_to_pdf(photo(format='PNG'))
+
+    assert pdf.startswith(b'%PDF')
+    assert page_size(pdf) == (300, 200)
+
+
+def test_converter_yields_results_in_submission_order():
+    images = [photo(size=(100 + 10 * i, 100)) for i in range(6)]
+
+    with ImageConverter(workers=2, profile='original') as converter:
+        pdfs = [future.result() for future in converter.imap(iter(images), prefetch=2)]
+        stats = converter.stats
+
+    assert [page_size(pdf) for pdf in pdfs] == [(100 + 10 * i, 100) for i in range(6)]
+    assert stats.images == 6
+    assert stats.image_bytes == sum(map(len, images))
+    assert stats.pdf_bytes == sum(map(len, pdfs))
+
+
+def test_failed_conversions_are_not_counted():
+    with ImageConverter(workers=1, profile='original') as converter:
+        with pytest.raises(Exception):
+            converter.submit(b'not an image').result()
+        converter.submit(photo()).result()
+
+    assert converter.stats.images == 1
+
+
+def test_convert_does_not_block_the_event_loop():
+    async def run(converter):
+        return await asyncio.gather(*(converter.convert(photo()) for _ in range(3)))
+
+    with ImageConverter(workers=2, profile='original') as converter:
+        pdfs = asyncio.run(run(converter))
+
+    assert all(pdf.startswith(b'%PDF') for pdf in pdfs)
+
+
+def test_conversion_stats_report():
+    assert str(ConversionStats(0, 0, 0)) == '0 images converted'
+    stats = ConversionStats(2, 4_000_000, 1_000_000)
+    assert stats.saved == 3_000_000
+    assert str(stats) == '2 images, 4.0 MB -> 1.0 MB PDF (3.0 MB saved, 4.0x smaller)'
+
+
+@pytest.mark.parametrize('format', ['JPEG', 'PNG'])
+def test_large_images_are_shrunk_to_the_pixel_budget(format):
+    profile = ImageProfile(max_pixels=100_000, mode='RGB', quality=70, dpi=200)
+
+    image = normalize_image(opened(photo(size=(1200, 900), format=format)), profile)
+
+    width, height = image.size
+    assert width * height <= profile.max_pixels
+    assert width * height > 0.9 * profile.max_pixels
+    assert abs(width / height - 1200 / 900) < 0.02
+
+
+def test_small_images_keep_their_size():
+    profile = PROFILES['color']
+
+    assert normalize_image(opened(photo()), profile).size == (300, 200)
+
+
+@pytest.mark.parametrize('name, mode', [('color', 'RGB'), ('document', 'L'), ('bilevel', '1')])
+def test_profile_sets_the_image_mode(name, mode):
+    assert normalize_image(opened(photo(format='PNG')), PROFILES[name]).mode == mode
+
+
+def test_bilevel_keeps_dark_text_and_drops_uneven_light():
+    image = Image.new('L', (200, 100), 200)
+    # Shadow across the right half, darker than the paper but without ink
+    image.paste(120, (100, 0, 200, 100))
+    image.paste(20, (20, 40, 60, 60))
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+
+    bilevel = normalize_image(opened(buffer.getvalue()), PROFILES['bilevel'])
+
+    assert bilevel.getpixel((40, 50)) == 0
+    assert bilevel.getpixel((150, 50)) == 255
+    assert bilevel.getpixel((10, 10)) == 255
+
+
+def test_exif_orientation_is_applied():
+    exif = Image.Exif()
+    exif[0x0112] = 6  # Rotated 90 degrees clockwise
+
+    image = normalize_image(opened(photo(size=(300, 200), exif=exif)), PROFILES['color'])
+
+    assert image.size == (200, 300)
+
+
+def test_profile_page_resolution_and_size():
+    pdf = image_to_pdf(photo(size=(1200, 900), format='PNG'), PROFILES['document'])
+
+    # 200 dpi: 1200 pixels are 6 inches, 432 points
+    assert page_size(pdf) == (432, 324)
+    assert len(pdf) < len(image_to_pdf(photo(size=(1200, 900), format='PNG')))
+
+
+def test_image_profile_from_the_environment(monkeypatch):
+    monkeypatch.delenv('IMAGE_PROFILE', raising=False)
+    assert image_profile() == PROFILES['document']
+    monkeypatch.setenv('IMAGE_PROFILE', 'Original')
+    assert image_profile() is None
+    assert image_profile('bilevel') == PROFILES['bilevel']
+    with pytest.raises(ValueError):
+        image_profile('sepia')
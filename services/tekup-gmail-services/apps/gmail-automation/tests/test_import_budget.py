@@ -0,0 +1,39 @@
+"""
+CLI startup import-time budget - fails the suite when importing the CLI gets
+slower than IMPORT_BUDGET_MS (see src/utils/import_budget.py).
+"""
+
+from src.utils.import_budget import budget_from_env, check_budget, parse_importtime, subtree
+
+IMPORTTIME_OUTPUT = """\
+import time: self [us] | cumulative | imported package
+import time:       900 |        900 | site
+import time:       300 |        300 |     json.decoder
+import time:       200 |        500 |   json
+import time:       100 |        100 |   click
+import time:        50 |        650 | src.core.main
+import time:        40 |         40 | atexit
+"""
+
+
+def test_parse_importtime_reads_depth_and_times():
+    timings = parse_importtime(IMPORTTIME_OUTPUT)
+    assert [(t.module, t.depth) for t in timings] == [
+        ('site', 0), ('json.decoder', 2), ('json', 1), ('click', 1),
+        ('src.core.main', 0), ('atexit', 0),
+    ]
+    assert timings[4].self_us == 50
+    assert timings[4].cumulative_us == 650
+
+
+def test_subtree_leaves_out_interpreter_startup():
+    timings = subtree(parse_importtime(IMPORTTIME_OUTPUT), 'src.core.main')
+    assert [t.module for t in timings] == ['json.decoder', 'json', 'click', 'src.core.main']
+
+
+def test_cli_imports_within_budget():
+    total_ms, heaviest = check_budget()
+    budget_ms = budget_from_env()
+    slowest = ', '.join(f"{t.module} {t.cumulative_us / 1000:.0f} ms" for t in heaviest[:5])
+    assert total_ms <= budget_ms, (
+        f"importing the CLI took {total_ms:.0f} ms (budget {budget_ms:.0f} ms): {slowest}")
@@ -0,0 +1,153 @@
+"""
+Local mailbox metadata index (src/utils/mailbox_index.py).
+"""
+
+import pytest
+
+from src.utils import mailbox_index
+from src.utils.mailbox_index import MailboxIndex, fts_phrase, index_enabled
+
+
+def message(message_id, sender, subject='Faktura', labels=('INBOX',), filename='faktura.pdf'):
+    return {'id': message_id, 'threadId': f't{message_id}', 'labelIds': list(labels),
+            'internalDate': str(1_700_000_000_000 + int(message_id[1:]) * 1000),
+            'payload': {'headers': [{'name': 'From', 'value': sender},
+                                    {'name': 'Subject', 'value': subject}],
+                        'parts': [{'filename': filename, 'mimeType': 'application/pdf',
+                                   'body': {'attachmentId': f'a{message_id}', 'size': 100}}]}}
+
+
+class FakeGmail:
+    """Mailbox with a history log; ``unavailable`` messages fail to fetch"""
+
+    def __init__(self, messages):
+        self.messages = {m['id']: m for m in messages}
+        self.history = []
+        self.history_id = 100
+        self.unavailable = set()
+
+    def record(self, **changes):
+        self.history_id += 1
+        self.history.append((self.history_id, changes))
+
+    def add(self, m):
+        self.messages[m['id']] = m
+        self.record(messagesAdded=[{'message': {'id': m['id']}}])
+
+    def get_current_history_id(self, service):
+        return str(self.history_id)
+
+    def iter_messages(self, service, query, page_size=100, limit=None):
+        return iter([{'id': message_id} for message_id in self.messages])
+
+    def get_messages(self, service, message_ids, projection=None, **kwargs):
+        return {message_id: self.messages[message_id] for message_id in message_ids
+                if message_id in self.messages and message_id not in self.unavailable}
+
+    def paginate(self, list_method, items_key, startHistoryId, **kwargs):
+        return iter([changes for history_id, changes in self.history if history_id > int(startHistoryId)])
+
+
+@pytest.fixture
+def gmail(monkeypatch):
+    fake = FakeGmail([message('m1', 'Netto <bon@netto.dk>'), message('m2', 'Circle K <k@circlek.dk>')])
+    for name in ('get_current_history_id', 'iter_messages', 'get_messages', 'paginate'):
+        monkeypatch.setattr(mailbox_index, name, getattr(fake, name))
+    return fake
+
+
+class FakeService:
+    def users(self):
+        return self
+
+    def history(self):
+        return self
+
+    def list(self, **kwargs):
+        raise AssertionError('paginate is faked')
+
+
+@pytest.fixture
+def index(tmp_path):
+    return MailboxIndex(str(tmp_path / 'index.sqlite3'))
+
+
+def ids(messages):
+    return sorted(m.id for m in messages)
+
+
+def test_first_sync_is_a_full_scan(index, gmail):
+    result = index.sync(FakeService())
+
+    assert (result.full_scan, result.updated, result.pending) == (True, 2, 0)
+    assert index.history_id == '100'
+    (netto,) = index.search(fts_phrase('netto'))
+    assert netto.as_message()['payload']['parts'][0]['filename'] == 'faktura.pdf'
+
+
+def test_history_replays_adds_deletes_and_label_changes(index, gmail):
+    index.sync(FakeService())
+    gmail.add(message('m3', 'Rema 1000 <kvittering@rema1000.dk>'))
+    gmail.record(messagesDeleted=[{'message': {'id': 'm2'}}])
+    gmail.record(labelsAdded=[{'message': {'id': 'm1'}, 'labelIds': ['Label_1']}])
+    gmail.record(labelsRemoved=[{'message': {'id': 'm1'}, 'labelIds': ['INBOX']}])
+
+    result = index.sync(FakeService())
+
+    assert (result.full_scan, result.updated, result.deleted) == (False, 1, 1)
+    assert ids(index.search()) == ['m1', 'm3']
+    assert ids(index.search(label_id='Label_1')) == ['m1']
+    assert index.search(fts_phrase('rema 1000'))[0].id == 'm3'
+    assert index.history_id == '104'
+
+
+def test_message_added_then_deleted_is_not_fetched(index, gmail):
+    index.sync(FakeService())
+    gmail.add(message('m3', 'Rema 1000 <kvittering@rema1000.dk>'))
+    gmail.record(messagesDeleted=[{'message': {'id': 'm3'}}])
+
+    result = index.sync(FakeService())
+
+    assert result.updated == 0
+    assert ids(index.search()) == ['m1', 'm2']
+
+
+def test_failed_fetch_is_retried_by_the_next_sync(index, gmail):
+    index.sync(FakeService())
+    gmail.add(message('m3', 'Rema 1000 <kvittering@rema1000.dk>'))
+    gmail.unavailable.add('m3')
+
+    result = index.sync(FakeService())
+
+    assert (result.updated, result.pending) == (0, 1)
+    assert index.pending() == ['m3']
+    # The cursor moves on, the message is not forgotten
+    gmail.unavailable.clear()
+    result = index.sync(FakeService())
+    assert (result.updated, result.pending) == (1, 0)
+    assert index.pending() == []
+    assert ids(index.search()) == ['m1', 'm2', 'm3']
+
+
+def test_pending_message_deleted_meanwhile_is_dropped(index, gmail):
+    index.sync(FakeService())
+    gmail.add(message('m3', 'Rema 1000 <kvittering@rema1000.dk>'))
+    gmail.unavailable.add('m3')
+    index.sync(FakeService())
+    gmail.record(messagesDeleted=[{'message': {'id': 'm3'}}])
+
+    index.sync(FakeService())
+
+    assert index.pending() == []
+
+
+def test_index_enabled_auto_waits_for_a_built_index(index, gmail, monkeypatch):
+    monkeypatch.delenv('MAILBOX_INDEX', raising=False)
+    assert not index_enabled(index.path + '.missing')
+    monkeypatch.setattr(mailbox_index, '_indexes', {index.path: index})
+    assert not index_enabled(index.path)
+
+    index.sync(FakeService())
+    assert index_enabled(index.path)
+    monkeypatch.setenv('MAILBOX_INDEX', 'false')
+    assert not index_enabled(index.path)
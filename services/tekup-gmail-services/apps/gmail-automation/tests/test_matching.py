@@ -0,0 +1,141 @@
+"""
+Receipt to bank-line matching (src/processors/matching.py).
+"""
+
+import numpy as np
+import pandas as pd
+
+from src.processors.matching import TransactionIndex, make_receipts, match_receipts
+
+
+def transactions(rows):
+    """Transactions frame from ``(amount, date)`` rows; date is ``DD.MM.YYYY`` or None"""
+    frame = pd.DataFrame(list(rows), columns=['amount', 'date'])
+    frame['date'] = pd.to_datetime(frame['date'], format='%d.%m.%Y')
+    frame['amount'] = frame['amount'].astype('float64')
+    return frame
+
+
+def matched_pairs(result):
+    return sorted(zip(result.matches['receipt'], result.matches['transaction']))
+
+
+def test_amount_tolerance_is_inclusive():
+    bank = transactions([(-101.0, '10.03.2024'), (-98.99, '10.03.2024')])
+    receipts = make_receipts([('a', -100.0, '10.03.2024')])
+
+    result = match_receipts(bank, receipts, amount_tolerance=1.0)
+
+    assert matched_pairs(result) == [(0, 0)]
+    assert result.matches['amount_diff'].tolist() == [-1.0]
+    assert result.unmatched_transactions.index.tolist() == [1]
+
+
+def test_date_window_edges():
+    bank = transactions([
+        (-50.0, '07.03.2024'),   # 3 days before: inside
+        (-50.0, '06.03.2024'),   # 4 days before: outside
+        (-50.0, '24.03.2024'),   # 14 days after: inside
+        (-50.0, '25.03.2024'),   # 15 days after: outside
+    ])
+    index = TransactionIndex(bank)
+    receipt_days = pd.to_datetime(pd.Series(['10.03.2024']), format='%d.%m.%Y')
+    days = receipt_days.to_numpy(dtype='datetime64[D]').astype(np.int64)
+
+    receipts, found = index.candidates(np.array([-50.0]), days, days_before=3, days_after=14)
+
+    assert receipts.tolist() == [0, 0]
+    assert sorted(found.tolist()) == [0, 2]
+
+
+def test_receipt_without_date_matches_any_date():
+    bank = transactions([(-20.0, '01.01.2020'), (-20.0, None)])
+    receipts = make_receipts([('a', -20.0, None), ('b', -20.0, None)])
+
+    result = match_receipts(bank, receipts)
+
+    assert matched_pairs(result) == [(0, 0), (1, 1)]
+    assert result.matches['days'].tolist() == [0, 0]
+
+
+def test_transaction_without_date_never_matches_a_dated_receipt():
+    bank = transactions([(-20.0, None)])
+    receipts = make_receipts([('a', -20.0, '01.01.2020')])
+
+    result = match_receipts(bank, receipts)
+
+    assert result.matches.empty
+    assert len(result.unmatched_receipts) == 1
+
+
+def test_receipts_without_date_column():
+    bank = transactions([(-5.0, '01.01.2020')])
+    receipts = pd.DataFrame({'amount': [-5.0]})
+
+    assert matched_pairs(match_receipts(bank, receipts)) == [(0, 0)]
+
+
+def test_assignment_is_one_to_one_closest_amount_first():
+    bank = transactions([(-100.0, '10.03.2024'), (-100.5, '10.03.2024')])
+    receipts = make_receipts([
+        ('near', -100.4, '10.03.2024'),
+        ('exact', -100.0, '10.03.2024'),
+        ('third', -100.2, '10.03.2024'),
+    ])
+
+    result = match_receipts(bank, receipts)
+
+    # 'exact' takes the -100.0 line, 'near' is closest to -100.5, 'third' is left over
+    assert matched_pairs(result) == [(0, 1), (1, 0)]
+    assert result.unmatched_receipts['text'].tolist() == ['third']
+    assert result.unmatched_transactions.empty
+
+
+def test_closest_date_breaks_amount_ties():
+    bank = transactions([(-30.0, '20.03.2024'), (-30.0, '11.03.2024')])
+    receipts = make_receipts([('a', -30.0, '10.03.2024')])
+
+    result = match_receipts(bank, receipts)
+
+    assert matched_pairs(result) == [(0, 1)]
+    assert result.matches['days'].tolist() == [1]
+
+
+def test_candidates_match_brute_force():
+    rng = np.random.default_rng(7)
+    bank = pd.DataFrame({
+        'amount': rng.integers(-40, 40, 300).astype('float64') / 2,
+        'date': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 60, 300), unit='D'),
+    })
+    bank.loc[rng.choice(300, 20, replace=False), 'date'] = pd.NaT
+    amounts = rng.integers(-40, 40, 50).astype('float64') / 2
+    dates = pd.Series(pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 60, 50), unit='D'))
+    dates[rng.choice(50, 5, replace=False)] = pd.NaT
+    days = dates.to_numpy(dtype='datetime64[D]')
+
+    receipts, found = TransactionIndex(bank).candidates(
+        amounts, np.where(np.isnat(days), np.iinfo(np.int64).min, days.astype(np.int64)),
+        amount_tolerance=1.0, days_before=3, days_after=14)
+
+    bank_days = bank['date'].to_numpy(dtype='datetime64[D]')
+    expected = set()
+    for r, (amount, day) in enumerate(zip(amounts, days)):
+        for t, (bank_amount, bank_day) in enumerate(zip(bank['amount'], bank_days)):
+            if abs(bank_amount - amount) > 1.0:
+                continue
+            if np.isnat(day) or (not np.isnat(bank_day)
+                                 and -3 <= (bank_day - day).astype(int) <= 14):
+                expected.add((r, t))
+    assert set(zip(receipts.tolist(), found.tolist())) == expected
+    assert len(receipts) == len(expected)
+
+
+def test_no_candidates():
+    bank = transactions([(-10.0, '01.01.2024')])
+    receipts = make_receipts([('a', 500.0, '01.01.2024')])
+
+    result = match_receipts(bank, receipts)
+
+    assert result.matches.empty
+    assert len(result.unmatched_receipts) == 1
+    assert len(result.unmatched_transactions) == 1
@@ -0,0 +1,70 @@
+"""
+Precompiled MIME templates for forward emails (src/utils/mime_builder.py).
+"""
+
+import email
+from email import policy
+
+from src.utils.mime_builder import Attachment, MessageTemplate, encode_attachment, encode_header
+
+PDF = b'%PDF-1.4\n' + bytes(range(256)) * 20
+
+
+def parse(raw):
+    return email.message_from_bytes(raw, policy=policy.default)
+
+
+def render(template, attachments=(), **fields):
+    return parse(template.render('Bilag <bilag@example.com>', 'Regnskab <kontor@example.com>',
+                                 attachments, **fields))
+
+
+def test_rendered_message_parses_with_the_stdlib():
+    template = MessageTemplate('Bilag: {filename}', 'Fra {sender}\nDato {date}\n')
+
+    message = render(template, [Attachment('faktura.pdf', encode_attachment(PDF))],
+                     filename='faktura.pdf', sender='netto@example.com', date='2024-05-01')
+
+    assert message['Subject'] == 'Bilag: faktura.pdf'
+    assert message['From'].addresses[0].addr_spec == 'bilag@example.com'
+    assert message['To'].addresses[0].addr_spec == 'kontor@example.com'
+    assert message.get_content_type() == 'multipart/mixed'
+    assert message.defects == []
+    text, pdf = message.iter_parts()
+    assert text.get_content() == 'Fra netto@example.com\nDato 2024-05-01\n'
+    assert pdf.get_content_type() == 'application/pdf'
+    assert pdf.get_filename() == 'faktura.pdf'
+    assert pdf.get_content() == PDF
+
+
+def test_several_attachments_keep_their_order():
+    template = MessageTemplate('Bundt', '{count} bilag')
+    files = {f'bilag{i}.pdf': PDF + bytes([i]) for i in range(3)}
+
+    message = render(template, [Attachment(name, encode_attachment(data)) for name, data in files.items()],
+                     count=3)
+
+    parts = list(message.iter_attachments())
+    assert [part.get_filename() for part in parts] == list(files)
+    assert [part.get_content() for part in parts] == list(files.values())
+
+
+def test_non_ascii_fields_are_encoded():
+    template = MessageTemplate('Kvittering fra {vendor}', 'Beløb: {amount} kr.')
+
+    message = render(template, [Attachment('kvittering æøå.pdf', encode_attachment(PDF))],
+                     vendor='Føtex', amount='129,95')
+
+    assert message['Subject'] == 'Kvittering fra Føtex'
+    assert next(message.iter_parts()).get_content() == 'Beløb: 129,95 kr.'
+    assert next(message.iter_attachments()).get_filename() == 'kvittering æøå.pdf'
+
+
+def test_field_values_cannot_inject_headers():
+    template = MessageTemplate('Bilag: {filename}', '')
+
+    message = render(template, filename='x.pdf\nBcc: evil@example.com')
+
+    assert message['Bcc'] is None
+    assert message['Subject'] == 'Bilag: x.pdf Bcc: evil@example.com'
+    assert '\n' not in encode_header('a\r\nb')
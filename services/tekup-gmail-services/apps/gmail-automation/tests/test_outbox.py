@@ -0,0 +1,206 @@
+"""
+Durable outbox of built forwards (src/utils/outbox.py).
+"""
+
+import multiprocessing
+import time
+
+import pytest
+
+from src.utils import outbox as outbox_module
+from src.utils.outbox import EXTRACTED, FAILED, LABELLED, MAX_ATTEMPTS, SENT, Outbox
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'outbox.sqlite3')
+
+
+@pytest.fixture
+def outbox(path):
+    return Outbox(path)
+
+
+def enqueue(outbox, message_id, digest, body=b'message'):
+    return outbox.enqueue(message_id, 'bilag@example.com', [digest], [f'{digest}.pdf'], body)
+
+
+def test_enqueue_ignores_a_forward_already_queued(outbox):
+    assert enqueue(outbox, 'm1', 'd1')
+    assert not enqueue(outbox, 'm1', 'd1')
+    assert enqueue(outbox, 'm1', 'd2')
+    assert outbox.counts()[EXTRACTED] == 2
+
+
+def test_lease_hands_out_each_entry_once(path, outbox):
+    for i in range(3):
+        enqueue(outbox, f'm{i}', f'd{i}')
+    other = Outbox(path)
+
+    first = outbox.lease(2)
+    second = other.lease()
+
+    assert [e.message_id for e in first] == ['m0', 'm1']
+    assert [e.message_id for e in second] == ['m2']
+    assert other.lease() == []
+
+
+def test_expired_lease_can_be_taken_over(path, outbox):
+    enqueue(outbox, 'm1', 'd1')
+    crashed = Outbox(path, lease_seconds=-1)
+
+    assert len(crashed.lease()) == 1
+    assert [e.message_id for e in outbox.lease()] == ['m1']
+
+
+def test_sender_that_lost_its_lease_records_nothing(path, outbox):
+    enqueue(outbox, 'm1', 'd1')
+    slow = Outbox(path, lease_seconds=-1)
+    (entry,) = slow.lease()
+    (taken,) = outbox.lease()
+
+    assert not slow.renew(entry.id)
+    assert slow.mark_sent(entry.id, 'slow-id') is False
+    assert slow.fail(entry.id, 'boom') is True
+    assert outbox.counts()[EXTRACTED] == 1
+
+    assert outbox.mark_sent(taken.id, 'gmail-id') is True
+    assert outbox._connection().execute("SELECT sent_id, attempts FROM outbox").fetchone() == ('gmail-id', 0)
+
+
+def test_drain_skips_entries_whose_lease_was_taken_over(path, outbox, monkeypatch):
+    enqueue(outbox, 'm1', 'd1')
+    enqueue(outbox, 'm2', 'd2')
+    slow = Outbox(path, lease_seconds=-1)
+    other_sent = []
+
+    def send(entry):
+        # While the first send is slow, another process takes over the expired second lease
+        if not other_sent:
+            (taken,) = outbox.lease(message_id='m2')
+            other_sent.append(taken.message_id)
+        return 'gmail-id'
+
+    result = slow.drain(send, lambda message_ids: None)
+
+    assert other_sent == ['m2']
+    assert result.sent == 1
+    assert outbox.counts()[EXTRACTED] == 1
+
+
+def test_lease_by_message_id(outbox):
+    enqueue(outbox, 'm1', 'd1')
+    enqueue(outbox, 'm2', 'd2')
+
+    assert [e.message_id for e in outbox.lease(message_id='m2')] == ['m2']
+
+
+def test_sent_entries_drop_their_body_and_are_labelled(outbox):
+    enqueue(outbox, 'm1', 'd1')
+    (entry,) = outbox.lease()
+    outbox.mark_sent(entry.id, 'gmail-id')
+
+    assert outbox.counts()[SENT] == 1
+    assert outbox.ready_to_label() == ['m1']
+    outbox.mark_labelled(['m1'])
+    assert outbox.ready_to_label() == []
+    assert outbox.counts()[LABELLED] == 1
+    body = outbox._connection().execute("SELECT body FROM outbox").fetchone()[0]
+    assert body is None
+
+
+def test_email_is_labelled_only_when_all_its_forwards_are_sent(outbox):
+    enqueue(outbox, 'm1', 'd1')
+    enqueue(outbox, 'm1', 'd2')
+    first, second = outbox.lease()
+    outbox.mark_sent(first.id)
+
+    assert outbox.ready_to_label() == []
+    outbox.mark_sent(second.id)
+    assert outbox.ready_to_label() == ['m1']
+
+
+def test_failed_send_is_retried_after_a_delay(outbox, monkeypatch):
+    enqueue(outbox, 'm1', 'd1')
+    (entry,) = outbox.lease()
+
+    assert outbox.fail(entry.id, 'boom') is True
+    assert outbox.lease() == []
+
+    later = time.time() + outbox_module.RETRY_DELAY + 1
+    monkeypatch.setattr(outbox_module.time, 'time', lambda: later)
+    (entry,) = outbox.lease()
+    assert entry.attempts == 1
+
+
+def test_entry_gives_up_after_max_attempts(outbox, monkeypatch):
+    monkeypatch.setattr(outbox_module, 'RETRY_DELAY', -10)
+    enqueue(outbox, 'm1', 'd1')
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        (entry,) = outbox.lease()
+        assert outbox.fail(entry.id, 'boom') is (attempt < MAX_ATTEMPTS)
+
+    assert outbox.counts()[FAILED] == 1
+    assert outbox.lease() == []
+
+
+def test_failed_entry_keeps_its_email_from_being_labelled(outbox, monkeypatch):
+    monkeypatch.setattr(outbox_module, 'MAX_ATTEMPTS', 1)
+    enqueue(outbox, 'm1', 'd1')
+    enqueue(outbox, 'm1', 'd2')
+    sent, failing = outbox.lease()
+    outbox.mark_sent(sent.id)
+    outbox.fail(failing.id, 'boom')
+
+    assert outbox.counts()[FAILED] == 1
+    assert outbox.ready_to_label() == []
+
+    assert outbox.retry_failed() == 1
+    (entry,) = outbox.lease()
+    assert entry.attempts == 0
+    outbox.mark_sent(entry.id)
+    assert outbox.ready_to_label() == ['m1']
+
+
+def test_drain_sends_then_labels(outbox, monkeypatch):
+    monkeypatch.setattr(outbox_module, 'MAX_ATTEMPTS', 1)
+    enqueue(outbox, 'm1', 'd1')
+    enqueue(outbox, 'm2', 'd2', body=b'bad')
+    sent, labelled = [], []
+
+    def send(entry):
+        if entry.body == b'bad':
+            raise RuntimeError('rejected')
+        sent.append(entry.message_id)
+        return 'gmail-id'
+
+    result = outbox.drain(send, labelled.extend)
+
+    assert (result.sent, result.failed, result.labelled) == (1, 1, 1)
+    assert sent == ['m1']
+    assert labelled == ['m1']
+    assert outbox.has_entries('m2')
+
+
+def _drain_worker(path):
+    outbox = Outbox(path)
+    sent = []
+    while True:
+        entries = outbox.lease(3)
+        if not entries:
+            return sent
+        for entry in entries:
+            outbox.mark_sent(entry.id)
+            sent.append(entry.id)
+
+
+def test_concurrent_processes_never_lease_the_same_entry(path, outbox):
+    for i in range(200):
+        enqueue(outbox, f'm{i}', f'd{i}')
+
+    with multiprocessing.get_context('spawn').Pool(4) as pool:
+        results = pool.map(_drain_worker, [path] * 4)
+
+    sent = [entry_id for result in results for entry_id in result]
+    assert len(sent) == len(set(sent)) == 200
+    assert outbox.counts()[SENT] == 200
@@ -0,0 +1,62 @@
+"""
+Staged worker pipeline and rate limiter (src/utils/pipeline.py).
+"""
+
+import pytest
+
+from src.utils import pipeline
+from src.utils.pipeline import Pipeline, Stage, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(pipeline.time, 'monotonic', clock.monotonic)
+    monkeypatch.setattr(pipeline.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_bucket_starts_full_then_waits_for_refill(clock):
+    bucket = TokenBucket(rate=100)
+
+    bucket.acquire(100)
+    assert clock.now == 0
+    bucket.acquire(50)
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_request_above_capacity_is_charged_in_full(clock):
+    bucket = TokenBucket(rate=250)
+
+    # A 100-message metadata batch: 500 units at 250/s
+    bucket.acquire(500)
+    assert clock.now == pytest.approx(1.0)
+    bucket.acquire(250)
+    assert clock.now == pytest.approx(2.0)
+
+
+def test_pipeline_runs_items_through_stages_and_counts_drops_and_failures():
+    errors = []
+
+    def check(item):
+        if item == 3:
+            raise ValueError('three')
+        return None if item == 4 else item
+
+    stages = [Stage('double', lambda item: item * 2, workers=2), Stage('check', check)]
+    result = Pipeline(stages, on_error=lambda stage, item, error: errors.append((stage, item))).run(
+        [1, 2, 1.5, 5])
+
+    assert result == {'completed': 2, 'dropped': 1, 'failed': 1}
+    assert errors == [('check', 3)]
@@ -0,0 +1,99 @@
+"""
+Push notifications and the push-driven runner (src/utils/push_receiver.py).
+"""
+
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+
+from src.utils.push_receiver import (
+    NotificationQueue,
+    PushReceiver,
+    PushRunner,
+    decode_notification,
+    encode_notification,
+)
+
+
+@pytest.fixture
+def receiver():
+    receiver = PushReceiver(NotificationQueue(), host='127.0.0.1', port=0, token='s3cret')
+    receiver.start()
+    yield receiver
+    receiver.stop()
+
+
+def post(receiver, path, body):
+    host, port = receiver.address[:2]
+    request = urllib.request.Request(f'http://{host}:{port}{path}', data=body, method='POST')
+    try:
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    except urllib.error.HTTPError as error:
+        return error.code
+
+
+def test_notification_round_trip():
+    body = encode_notification('me@example.com', 1234)
+
+    assert decode_notification(body) == {'email_address': 'me@example.com', 'history_id': 1234}
+    with pytest.raises(ValueError):
+        decode_notification(b'{"message": {}}')
+
+
+@pytest.mark.parametrize('query', ['', '?token=wrong', '?token=', '?other=s3cret'])
+def test_requests_without_the_token_are_rejected(receiver, query):
+    body = encode_notification('me@example.com', 1234)
+
+    assert post(receiver, f'/gmail/push{query}', body) == 403
+    assert receiver.queue.get(0) is None
+
+
+def test_request_with_the_token_is_queued(receiver):
+    body = encode_notification('me@example.com', 1234)
+
+    assert post(receiver, '/gmail/push?token=s3cret', body) == 204
+    assert receiver.queue.get(0) == 1234
+
+
+def test_wrong_path_and_malformed_body(receiver):
+    assert post(receiver, '/other?token=s3cret', encode_notification('me@example.com', 1)) == 404
+    assert post(receiver, '/gmail/push?token=s3cret', b'not json') == 400
+
+
+def test_queue_coalesces_a_burst_and_drops_processed_ids():
+    queue = NotificationQueue()
+
+    assert queue.put(10)
+    assert queue.put(12)
+    assert not queue.put(11)
+    assert queue.get(0) == 12
+
+    queue.mark_processed(20)
+    assert not queue.put(15)
+    assert queue.get(0) is None
+
+
+def test_runner_processes_a_burst_once():
+    queue = NotificationQueue()
+    runs = []
+    runner = PushRunner(lambda: runs.append(1), queue, poll_interval=3600, debounce=0.2)
+    thread = threading.Thread(target=runner.run_forever)
+    thread.start()
+    try:
+        for history_id in (101, 102, 103):
+            queue.put(history_id)
+        for _ in range(100):
+            if runner.runs == 2:
+                break
+            time.sleep(0.05)
+    finally:
+        runner.stop()
+        thread.join(5)
+
+    # Startup run plus one run for the whole burst
+    assert runner.runs == 2
+    assert not queue.put(103)
@@ -0,0 +1,102 @@
+"""
+Retry policy and dead-letter queue (src/utils/resilience.py).
+"""
+
+import httpx
+import pytest
+
+from src.integrations.economic_client import EconomicApiError
+from src.utils import resilience
+from src.utils.resilience import DeadLetterQueue, call, is_retry_safe, is_transient
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(resilience, 'backoff_delay', lambda attempt: 0)
+    monkeypatch.setenv('RETRY_MAX_ATTEMPTS', '3')
+
+
+def flaky(error, failures):
+    calls = []
+
+    def func():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise error
+        return 'ok'
+    return func, calls
+
+
+@pytest.mark.parametrize('error, transient, safe', [
+    (httpx.ConnectError('refused'), True, True),
+    (httpx.ConnectTimeout('slow'), True, True),
+    (httpx.ReadTimeout('slow'), True, False),
+    (EconomicApiError(429, 'slow down'), True, True),
+    (EconomicApiError(503, 'unavailable'), True, False),
+    (EconomicApiError(400, 'bad request'), False, False),
+])
+def test_classification(error, transient, safe):
+    assert is_transient(error) is transient
+    assert is_retry_safe(error) is safe
+
+
+def test_default_policy_retries_read_timeouts(request):
+    func, calls = flaky(httpx.ReadTimeout('slow'), 2)
+
+    assert call(request.node.name, func) == 'ok'
+    assert len(calls) == 3
+
+
+def test_retry_safe_policy_does_not_repeat_a_request_that_may_have_arrived(request):
+    func, calls = flaky(httpx.ReadTimeout('slow'), 1)
+
+    with pytest.raises(httpx.ReadTimeout):
+        call(request.node.name, func, retry=is_retry_safe)
+    assert len(calls) == 1
+
+
+def test_retry_safe_policy_retries_connect_errors(request):
+    func, calls = flaky(httpx.ConnectError('refused'), 2)
+
+    assert call(request.node.name, func, retry=is_retry_safe) == 'ok'
+    assert len(calls) == 3
+
+
+@pytest.fixture
+def dead_letters(tmp_path):
+    return DeadLetterQueue(str(tmp_path / 'dead_letters.jsonl'))
+
+
+def test_claimed_entries_survive_a_crash(dead_letters):
+    dead_letters.push('forwarder', {'message_id': 'm1'}, 'boom')
+    dead_letters.claim('forwarder')
+
+    # The run died before release
+    assert [e['message_id'] for e in DeadLetterQueue(dead_letters.path).claim('forwarder')] == ['m1']
+
+
+def test_release_keeps_new_failures_and_other_sources(dead_letters):
+    dead_letters.push('forwarder', {'message_id': 'm1'}, 'boom')
+    dead_letters.push('forwarder', {'message_id': 'm2'}, 'boom')
+    dead_letters.push('other', {'message_id': 'm3'}, 'boom')
+
+    claimed = dead_letters.claim('forwarder')
+    assert sorted(e['message_id'] for e in claimed) == ['m1', 'm2']
+    dead_letters.push('forwarder', {'message_id': 'm1'}, 'boom again')
+    dead_letters.release()
+
+    entries = {(e['source'], e['message_id']): e['attempts'] for e in dead_letters.entries()}
+    assert entries == {('forwarder', 'm1'): 2, ('other', 'm3'): 1}
+
+
+def test_poison_item_is_parked_after_max_attempts(dead_letters):
+    dead_letters.push('forwarder', {'message_id': 'm1'}, 'boom')
+    for _ in range(5):
+        queue = DeadLetterQueue(dead_letters.path)
+        for entry in queue.claim('forwarder'):
+            queue.push('forwarder', {'message_id': entry['message_id']}, 'boom')
+        queue.release()
+
+    assert DeadLetterQueue(dead_letters.path).claim('forwarder') == []
+    (parked,) = dead_letters.entries()
+    assert parked['attempts'] == 3
@@ -0,0 +1,115 @@
+"""
+On-disk cache of parsed bank statements (src/processors/statement_cache.py).
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from src.processors import statement_cache
+from src.processors.statement_cache import StatementCache
+
+
+class CountingParser:
+    """Parses ``date;amount;text`` CSVs and counts how often it was called"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, path):
+        self.calls += 1
+        raw = pd.read_csv(path, sep=';', dtype=str, keep_default_na=False)
+        raw.index = raw.index + 2
+        return pd.DataFrame({
+            'date': pd.to_datetime(raw['date'], format='%d.%m.%Y'),
+            'amount': raw['amount'].astype('float64'),
+            'text': raw['text'],
+        })
+
+
+@pytest.fixture
+def statement(tmp_path):
+    path = tmp_path / 'statement.csv'
+    path.write_text('date;amount;text\n01.03.2024;-10.5;Netto\n02.03.2024;20;Netto\n'
+                    '03.03.2024;-3;Circle K\n', encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return StatementCache(CountingParser(), str(tmp_path / 'cache'))
+
+
+def test_load_round_trips_columns_and_index(cache, statement):
+    frame = cache.load(str(statement))
+
+    assert frame.index.tolist() == [2, 3, 4]
+    assert frame['amount'].tolist() == [-10.5, 20.0, -3.0]
+    assert frame['text'].tolist() == ['Netto', 'Netto', 'Circle K']
+    assert frame['date'].dt.day.tolist() == [1, 2, 3]
+    assert cache.is_fresh(str(statement))
+
+
+def test_unchanged_file_is_not_parsed_again(cache, statement):
+    cache.load(str(statement))
+    cache.load(str(statement))
+
+    assert cache.parse.calls == 1
+    assert cache.import_statement(str(statement)) is False
+
+
+def test_changed_mtime_is_parsed_again(cache, statement):
+    cache.load(str(statement))
+    stat = statement.stat()
+    os.utime(statement, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    assert not cache.is_fresh(str(statement))
+    cache.load(str(statement))
+    assert cache.parse.calls == 2
+
+
+def test_changed_contents_are_reloaded(cache, statement):
+    cache.load(str(statement))
+    statement.write_text('date;amount;text\n05.03.2024;-99;Rema 1000\n', encoding='utf-8')
+
+    frame = cache.load(str(statement))
+
+    assert frame['text'].tolist() == ['Rema 1000']
+    assert frame['amount'].tolist() == [-99.0]
+
+
+def test_force_parses_a_fresh_file(cache, statement):
+    cache.load(str(statement))
+
+    assert cache.import_statement(str(statement), force=True) is True
+    assert cache.parse.calls == 2
+
+
+def test_format_version_change_invalidates_entries(cache, statement, monkeypatch):
+    cache.load(str(statement))
+    monkeypatch.setattr(statement_cache, 'FORMAT_VERSION', statement_cache.FORMAT_VERSION + 1)
+
+    assert not cache.is_fresh(str(statement))
+    cache.load(str(statement))
+    assert cache.parse.calls == 2
+
+
+def test_unreadable_meta_counts_as_missing(cache, statement):
+    cache.load(str(statement))
+    (meta_path,) = cache.directory.glob('*/meta.json')
+    meta_path.write_text('{not json', encoding='utf-8')
+
+    assert not cache.is_fresh(str(statement))
+    cache.load(str(statement))
+    assert json.loads(meta_path.read_text(encoding='utf-8'))['rows'] == 3
+
+
+def test_imported_paths_skips_deleted_sources(cache, statement, tmp_path):
+    other = tmp_path / 'other.csv'
+    other.write_text(statement.read_text(encoding='utf-8'), encoding='utf-8')
+    cache.import_all([str(statement), str(other)])
+    other.unlink()
+
+    assert cache.imported_paths() == [str(statement.resolve())]
@@ -0,0 +1,112 @@
+"""
+Packed multi-vendor Gmail search (src/utils/vendor_search.py).
+"""
+
+import re
+
+import pytest
+
+from src.utils import vendor_search
+from src.utils.vendor_search import plan_queries, search_term, search_vendors
+
+
+def message(message_id, sender, subject='Faktura', filename=None):
+    parts = [{'filename': filename, 'body': {'attachmentId': 'a'}}] if filename else []
+    return {'id': message_id, 'payload': {
+        'headers': [{'name': 'From', 'value': sender}, {'name': 'Subject', 'value': subject}],
+        'parts': parts}}
+
+
+class FakeGmail:
+    """Mailbox whose searches match query terms against From and Subject"""
+
+    def __init__(self, messages):
+        self.messages = {m['id']: m for m in messages}
+        self.queries = []
+        self.fetched = []
+
+    def iter_messages(self, service, query, page_size=100, limit=None):
+        self.queries.append(query)
+        group = re.sub(r'^.*?\(|\)$', '', query) if '(' in query else query.split(' ', 1)[-1]
+        terms = [term.strip('"').lower() for term in group.split(' OR ')]
+        matches = [message_id for message_id, m in self.messages.items()
+                   if any(term in vendor_search.header(m, 'From').lower()
+                          or term in vendor_search.header(m, 'Subject').lower() for term in terms)]
+        return iter([{'id': message_id} for message_id in matches[:limit]])
+
+    def get_messages(self, service, message_ids, projection=None, **kwargs):
+        self.fetched.extend(message_ids)
+        return {message_id: self.messages[message_id] for message_id in message_ids}
+
+
+@pytest.fixture
+def gmail(monkeypatch):
+    def install(messages):
+        fake = FakeGmail(messages)
+        monkeypatch.setattr(vendor_search, 'iter_messages', fake.iter_messages)
+        monkeypatch.setattr(vendor_search, 'get_messages', fake.get_messages)
+        return fake
+    return install
+
+
+def test_search_term_quotes_phrases():
+    assert search_term('Netto') == 'Netto'
+    assert search_term('Circle K') == '"Circle K"'
+    assert search_term('7-Eleven') == '"7-Eleven"'
+
+
+def test_plan_queries_packs_terms_up_to_max_length():
+    vendors = [f'vendor{i:02d}' for i in range(30)]
+
+    plans = plan_queries(vendors, base_query='has:attachment', max_length=120)
+
+    assert all(len(plan.query) <= 120 for plan in plans)
+    assert [vendor for plan in plans for vendor in plan.vendors] == vendors
+    assert plans[0].query.startswith('has:attachment (vendor00 OR vendor01 OR ')
+    # 'has:attachment (' + 8 terms + 7 ' OR ' + ')' is 109 characters; a ninth term would make it 121
+    assert [len(plan.vendors) for plan in plans] == [8, 8, 8, 6]
+
+
+def test_plan_queries_gives_an_overlong_term_its_own_query():
+    plans = plan_queries(['a', 'x' * 50, 'b'], max_length=20)
+
+    assert [plan.vendors for plan in plans] == [['a'], ['x' * 50], ['b']]
+
+
+def test_many_vendors_few_with_mail_take_one_query(gmail):
+    fake = gmail([message('1', 'Netto <bon@netto.dk>'), message('2', 'Netto <bon@netto.dk>'),
+                  message('3', 'Circle K <kvittering@circlek.dk>'),
+                  message('4', 'Shop', subject='Ordre fra Bauhaus')])
+    vendors = ['Netto', 'Circle K', 'Bauhaus'] + [f'vendor{i:02d}' for i in range(22)]
+
+    result = search_vendors(None, vendors, per_vendor=5)
+
+    assert result.queries == len(fake.queries) == 1
+    assert [m['id'] for m in result.hits['Netto']] == ['1', '2']
+    assert [m['id'] for m in result.hits['Circle K']] == ['3']
+    assert [m['id'] for m in result.hits['Bauhaus']] == ['4']
+    assert result.hits['vendor00'] == []
+
+
+def test_vendor_short_after_a_truncated_query_gets_its_own(gmail):
+    # A broad term fills the query's limit before the other vendor's mail is read
+    fake = gmail([message(f'b{i}', 'Bank <info@bank.dk>') for i in range(10)]
+                 + [message('n1', 'Netto <bon@netto.dk>')])
+
+    result = search_vendors(None, ['Bank', 'Netto'], per_vendor=2, limit=5)
+
+    assert fake.queries == ['(Bank OR Netto)', 'Netto']
+    assert result.queries == 2
+    assert [m['id'] for m in result.hits['Netto']] == ['n1']
+    assert len(result.hits['Bank']) == 2
+
+
+def test_followup_skips_known_messages_and_fetches_nothing_twice(gmail):
+    fake = gmail([message(f'b{i}', 'Bank <info@bank.dk>') for i in range(4)]
+                 + [message('n1', 'Netto <bon@netto.dk>'),
+                    message('n2', 'Kvittering', subject='Netto kvittering')])
+
+    result = search_vendors(None, ['Bank', 'Netto'], per_vendor=3, limit=4)
+
+    assert [m['id'] for m in result.hits['Netto']] == ['n1', 'n2']
+    assert sorted(fake.fetched) == sorted(set(fake.fetched))